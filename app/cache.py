@@ -0,0 +1,81 @@
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+import hashlib
+import threading
+import time
+from app.config import get_settings
+
+settings = get_settings()
+
+def content_hash(content: bytes) -> str:
+    """SHA-256 hex digest of image bytes."""
+    return hashlib.sha256(content).hexdigest()
+
+class TTLCache:
+    """
+    Bounded in-memory cache with LRU eviction and a per-entry time to live.
+    Keeps hit/miss/eviction counters for monitoring.
+    """
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: str) -> Optional[Any]:
+        """Return the cached value, or None when missing or expired."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: str, value: Any) -> None:
+        """Store a value, evicting the least recently used entries when full."""
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        """Drop every entry. Counters are kept."""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict:
+        """Current size and hit/miss counters."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0
+            }
+
+# Embeddings keyed by image hash and model name
+embedding_cache = TTLCache(settings.EMBEDDING_CACHE_SIZE, settings.CACHE_TTL)
+
+# Final kNN results keyed by image hash; cleared whenever this process writes to
+# the index, writes by other processes only show once entries expire
+search_result_cache = TTLCache(settings.SEARCH_RESULT_CACHE_SIZE, settings.SEARCH_RESULT_CACHE_TTL)
@@ -1,27 +1,112 @@
 from pydantic_settings import BaseSettings
 from functools import lru_cache
+from typing import Optional
 import os
 
 class Settings(BaseSettings):
     # API Settings
     API_V1_STR: str = "/api/v1"
     PROJECT_NAME: str = "Image Search People API"
+    SERVER_HOST: Optional[str] = None  # host used in image URLs; detected at start-up when unset
+    
+    # Start-up Settings
+    WARMUP_ENABLED: bool = True
+    WARMUP_RUNS: int = 1
     
     # File Upload Settings
     DATASET_FOLDER: str = "dataset/persons"
     DATASET_LOST_FOLDER: str = "dataset/lost-persons"
     MAX_FILE_SIZE: int = 5 * 1024 * 1024  # 5MB
+    MAX_FORM_FIELD_SIZE: int = 64 * 1024 * 1024  # non-file form fields of streamed uploads, e.g. persons_data
     ALLOWED_EXTENSIONS: set = {".jpg", ".jpeg", ".png"}
+    SEARCH_SAVE_PROBES: bool = False  # keep search uploads in DATASET_LOST_FOLDER
+    IMAGE_STORE_SHARD_DEPTH: int = 2  # nested directory levels images are sharded into by content hash
+    IMAGE_CACHE_MAX_AGE: int = 365 * 24 * 3600  # Cache-Control max-age of served images
+    SEARCH_MAX_FACES: int = 20  # faces searched per image by /search/faces/, largest first
+    VERIFY_THRESHOLD: Optional[float] = None  # /verify/ match score; ELASTICSEARCH_SEARCH_THRESHOLD when unset
+    VERIFY_MAX_RECORDS: int = 10  # stored records of one national ID compared by /verify/
+    SEARCH_BULK_MAX_IMAGES: int = 500  # images per /search-bulk/ request
+    SEARCH_BULK_CHUNK_SIZE: int = 64  # images per embedding batch and _msearch when /search-bulk/ streams
+    
+    # Ingestion Settings
+    INGEST_MAX_SIZE: Optional[int] = 1280  # longest side images are decoded at before detection; None for full size
+    INGEST_STORE_NORMALIZED: bool = False  # store registered images downscaled to INGEST_MAX_SIZE instead of the original
+    INGEST_JPEG_QUALITY: int = 90  # quality of normalised images
+    BULK_CHUNK_SIZE: int = 64  # persons registered per chunk by the streaming bulk endpoint
     
     # Elasticsearch Settings
     ELASTICSEARCH_HOST: str = os.getenv("ELASTICSEARCH_HOST", "localhost")
     ELASTICSEARCH_PORT: int = int(os.getenv("ELASTICSEARCH_PORT", "9200"))
-    ELASTICSEARCH_INDEX: str = os.getenv("ELASTICSEARCH_INDEX", "people-image-facenet")
+    ELASTICSEARCH_INDEX: str = os.getenv("ELASTICSEARCH_INDEX", "people-image-facenet")  # alias the app reads and writes through
     ELASTICSEARCH_USERNAME: str = os.getenv("ELASTICSEARCH_USERNAME", "admin")
     ELASTICSEARCH_PASSWORD: str = os.getenv("ELASTICSEARCH_PASSWORD", "4dm1nus3r")
     ELASTICSEARCH_URL: str = f"http://{ELASTICSEARCH_HOST}:{ELASTICSEARCH_PORT}"
-    ELASTICSEARCH_SEARCH_SIZE: int = 3
+    ELASTICSEARCH_SEARCH_SIZE: int = 3  # default k of kNN searches
     ELASTICSEARCH_SEARCH_THRESHOLD: float = 0.89
+    ELASTICSEARCH_NUM_CANDIDATES: int = 100  # default kNN candidates per shard
+    ELASTICSEARCH_MAX_SEARCH_SIZE: int = 20  # upper limit of k requested per search
+    ELASTICSEARCH_MAX_NUM_CANDIDATES: int = 1000  # upper limit of num_candidates requested per search
+    
+    # Elasticsearch Index Settings (applied to new indices; see app.index_tool for rebuilding)
+    ELASTICSEARCH_SHARDS: int = 1
+    ELASTICSEARCH_REPLICAS: int = 1
+    ELASTICSEARCH_REFRESH_INTERVAL: str = "5s"
+    ELASTICSEARCH_HNSW_M: int = 16  # graph connections per node; higher improves recall, costs memory
+    ELASTICSEARCH_HNSW_EF_CONSTRUCTION: int = 100  # candidates per insert; higher builds a better graph, slower
+    ELASTICSEARCH_INGEST_MODE: bool = False  # streaming bulk loads run with refresh off and no replicas
+    ELASTICSEARCH_FORCE_MERGE_SEGMENTS: int = 1  # segments force-merged to after a bulk load
+    
+    # Elasticsearch Client Settings (one pooled async client per process)
+    ELASTICSEARCH_CONNECTIONS_PER_NODE: int = 20
+    ELASTICSEARCH_REQUEST_TIMEOUT: float = 10.0
+    ELASTICSEARCH_MAX_RETRIES: int = 3
+    ELASTICSEARCH_RETRY_ON_TIMEOUT: bool = True
+    
+    # Elasticsearch Bulk Indexing Settings
+    ELASTICSEARCH_BULK_CHUNK_SIZE: int = 500  # documents per bulk request
+    ELASTICSEARCH_BULK_MAX_BYTES: int = 10 * 1024 * 1024  # 10MB per bulk request
+    ELASTICSEARCH_BULK_CONCURRENCY: int = 2  # bulk requests in flight
+    ELASTICSEARCH_BULK_MAX_RETRIES: int = 3  # retries of rejected (429) items
+    ELASTICSEARCH_BULK_INITIAL_BACKOFF: float = 1.0  # seconds, doubled on every retry
+    ELASTICSEARCH_BULK_MAX_BACKOFF: float = 30.0
+    
+    # Repository Settings
+    REPOSITORY_BACKEND: str = "elasticsearch"  # "elasticsearch" or "local" (in-process vector index)
+    VECTOR_INDEX_PATH: str = "dataset/vector-index"
+    VECTOR_INDEX_MODE: str = "exact"  # "exact" or "ivf"
+    VECTOR_INDEX_NLIST: int = 256  # IVF partitions
+    VECTOR_INDEX_NPROBE: int = 16  # IVF partitions searched per query
+    VECTOR_INDEX_METADATA: str = "local"  # where person documents live: "local" or "elasticsearch"
+    EMBEDDING_DIMS: int = 128
+    EMBEDDING_STORAGE: str = "float32"  # "float32", "float16" (local vector index only) or "int8" (scalar-quantised)
+    SEARCH_RESCORE_OVERSAMPLE: int = 4  # with quantised vectors, candidates per match re-scored with the float query
+    
+    # Embedding Settings
+    EMBEDDING_MODEL_NAME: str = "Facenet"  # DeepFace recognition model for registration and search; EMBEDDING_DIMS must match it
+    DETECTOR_BACKEND: str = "opencv"  # any DeepFace detector, or "skip" for inputs that are already face crops
+    DETECTION_ALIGN: bool = True
+    ENFORCE_DETECTION: bool = True  # False embeds the whole image when no face is found
+    DETECTION_MAX_SIZE: Optional[int] = None  # longest image side used for detection; larger images are downscaled
+    EMBEDDING_BATCH_SIZE: int = 32  # faces per batched forward pass
+    EMBEDDING_EXECUTOR: str = "thread"  # "thread" or "process"
+    EMBEDDING_WORKERS: int = 3
+    EMBEDDING_MAX_TASKS_PER_CHILD: Optional[int] = None  # process backend only; not supported with "fork"
+    EMBEDDING_START_METHOD: str = "spawn"  # process backend only: "spawn", "forkserver" or "fork"
+    EMBEDDING_WORKER_THREADS: Optional[int] = None  # TensorFlow threads per worker process
+    
+    # Search Batching Settings
+    SEARCH_BATCHING_ENABLED: bool = True
+    SEARCH_BATCH_WINDOW_MS: float = 5.0  # how long to wait for more queries
+    SEARCH_BATCH_MAX_SIZE: int = 16  # flush early once this many queries are waiting
+    
+    # Video Search Settings
+    VIDEO_ROOT: str = "dataset/videos"  # /search/video/ only reads files under this directory
+    VIDEO_ALLOWED_EXTENSIONS: set = {".mp4", ".avi", ".mkv", ".mov", ".webm"}
+    VIDEO_FRAME_STRIDE: int = 5  # detect faces in every n-th frame
+    VIDEO_TRACK_IOU: float = 0.3  # box overlap with a face in an earlier frame that continues its track
+    VIDEO_TRACK_MAX_GAP: int = 5  # sampled frames a track may go undetected before it ends
+    VIDEO_TRACK_MIN_FRAMES: int = 1  # shorter tracks are dropped as spurious detections
+    VIDEO_FRAMES_PER_TRACK: int = 3  # best-quality frames embedded and searched per track
     
     # CORS Settings
     CORS_ORIGINS: list = [
@@ -31,11 +116,26 @@ class Settings(BaseSettings):
     
     # Cache Settings
     CACHE_TTL: int = 3600  # 1 hour
+    EMBEDDING_CACHE_ENABLED: bool = True
+    EMBEDDING_CACHE_SIZE: int = 10000  # entries
+    # Cached search results are cleared only by writes of the same process: with
+    # several workers, or while index_tool dedups or reindexes, a result can be
+    # stale for up to SEARCH_RESULT_CACHE_TTL. Only enable it with one worker,
+    # or where results that old are acceptable.
+    SEARCH_RESULT_CACHE_ENABLED: bool = False
+    SEARCH_RESULT_CACHE_SIZE: int = 1000  # entries
+    SEARCH_RESULT_CACHE_TTL: int = 60  # seconds
+    
+    # Metrics Settings
+    METRICS_ENABLED: bool = True  # per-stage latency metrics on /metrics (Prometheus format)
     
     # Logging Settings
     LOG_FILE: str = "app.log"
     LOG_MAX_BYTES: int = 1024 * 1024  # 1MB
     LOG_BACKUP_COUNT: int = 5
+    LOG_LEVEL: str = "INFO"
+    LOG_REQUEST_SUMMARY: bool = True  # one structured line per request
+    LOG_DETAIL_SAMPLE_RATE: float = 0.1  # fraction of requests whose step-by-step detail is logged
     
     class Config:
         case_sensitive = True
@@ -0,0 +1,293 @@
+from typing import List, Dict, Union
+import numpy as np
+import threading
+from app.image_io import load_image, longest_side, smallest_limit
+from app.metrics import track_stage
+from app.config import get_settings
+from app.logger import logger
+
+settings = get_settings()
+
+class EmbeddingEngine:
+    """
+    Batched face embedding.
+    Faces are detected and aligned one image at a time, then pushed through the
+    recognition model as stacked batches instead of one forward pass per image.
+    DeepFace (and with it TensorFlow) is imported on first use, so importing
+    the app stays fast and the import can run in a worker during start-up.
+    """
+    # DeepFace caches built models globally, but concurrent first builds race
+    _model_lock = threading.Lock()
+
+    # DeepFace detector backends; "skip" treats the whole image as the face
+    DETECTOR_BACKENDS = (
+        "opencv", "ssd", "dlib", "mtcnn", "fastmtcnn", "retinaface",
+        "mediapipe", "yolov8", "yunet", "centerface", "skip"
+    )
+
+    @staticmethod
+    def detection_options(detector_backend: str = None, align: bool = None, enforce_detection: bool = None, max_size: int = None) -> Dict:
+        """
+        Face detection options, with the Settings defaults for anything not given.
+        Args:
+            detector_backend: DeepFace detector backend, or "skip" for pre-cropped faces
+            align: Align faces on the eyes before embedding
+            enforce_detection: Fail when no face is found instead of embedding the whole image
+            max_size: Longest image side used for detection (0 for no limit)
+        Returns:
+            dict: detector_backend, align, enforce_detection and max_size
+        """
+        options = {
+            "detector_backend": detector_backend or settings.DETECTOR_BACKEND,
+            "align": settings.DETECTION_ALIGN if align is None else align,
+            "enforce_detection": settings.ENFORCE_DETECTION if enforce_detection is None else enforce_detection,
+            "max_size": settings.DETECTION_MAX_SIZE if max_size is None else max_size
+        }
+        if options["detector_backend"] not in EmbeddingEngine.DETECTOR_BACKENDS:
+            raise ValueError(f"Unknown detector backend: {options['detector_backend']}")
+        if options["max_size"] is not None and options["max_size"] < 0:
+            raise ValueError("max_size must not be negative")
+        return options
+
+    @staticmethod
+    def detection_key(detection: Dict = None) -> str:
+        """
+        Short string identifying detection options, for cache keys and grouping.
+        The ingest settings are included too: INGEST_MAX_SIZE changes the pixels
+        every image is decoded at, and the normalisation settings the registered image.
+        """
+        detection = detection or EmbeddingEngine.detection_options()
+        ingest = f"{settings.INGEST_MAX_SIZE or 0}:{settings.INGEST_JPEG_QUALITY if settings.INGEST_STORE_NORMALIZED else 0}"
+        return f"{detection['detector_backend']}:{int(detection['align'])}:{int(detection['enforce_detection'])}:{detection['max_size'] or 0}:{ingest}"
+
+    @staticmethod
+    def get_model(model_name: str = settings.EMBEDDING_MODEL_NAME):
+        """Build (or fetch the cached) recognition model."""
+        from deepface import DeepFace
+        with EmbeddingEngine._model_lock:
+            return DeepFace.build_model(model_name)
+
+    @staticmethod
+    def preload(model_name: str = settings.EMBEDDING_MODEL_NAME, detector_backend: str = "opencv", num_threads: int = None) -> None:
+        """
+        Load the recognition model and face detector into this process.
+        Used as the initializer of embedding worker processes.
+        Args:
+            model_name: Name of the recognition model
+            detector_backend: DeepFace detector backend
+            num_threads: TensorFlow intra-op threads, to avoid oversubscribing cores across workers
+        """
+        from deepface import DeepFace
+        if num_threads:
+            import tensorflow as tf
+            tf.config.threading.set_intra_op_parallelism_threads(num_threads)
+            tf.config.threading.set_inter_op_parallelism_threads(1)
+
+        EmbeddingEngine.get_model(model_name)
+        if detector_backend != "skip":
+            DeepFace.build_model(model_name=detector_backend, task="face_detector")
+        logger.info(f"Loaded {model_name} model and {detector_backend} detector")
+
+    @staticmethod
+    def warm_up(model_name: str = settings.EMBEDDING_MODEL_NAME, detector_backend: str = "opencv", runs: int = 1) -> None:
+        """
+        Load the models and run warm-up inference on a built-in dummy image,
+        so the first real request does not pay for graph building and allocation.
+        Args:
+            model_name: Name of the recognition model
+            detector_backend: DeepFace detector backend
+            runs: Number of warm-up passes
+        """
+        from deepface import DeepFace
+        EmbeddingEngine.preload(model_name, detector_backend)
+        model = EmbeddingEngine.get_model(model_name)
+        image = EmbeddingEngine.dummy_image()
+        for _ in range(runs):
+            DeepFace.extract_faces(img_path=image, detector_backend=detector_backend, enforce_detection=False)
+            model.model(np.zeros((1, *model.input_shape, 3), dtype=np.float32), training=False)
+        logger.info(f"Warm-up inference done ({runs} run(s))")
+
+    @staticmethod
+    def dummy_image(size: int = 320) -> np.ndarray:
+        """Synthetic BGR gradient image used for warm-up."""
+        ramp = np.linspace(0, 255, size, dtype=np.uint8)
+        return np.stack([np.tile(ramp, (size, 1)), np.tile(ramp[:, None], (1, size)), np.full((size, size), 128, dtype=np.uint8)], axis=-1)
+
+    @staticmethod
+    def represent(image: Union[str, bytes, np.ndarray], model_name: str = settings.EMBEDDING_MODEL_NAME, detection: Dict = None) -> List[Dict]:
+        """
+        Embed the first face in one image.
+        Same preprocessing as DeepFace.represent, split into detection and
+        inference so each stage can be timed on its own.
+        Args:
+            image: Path to the image file, encoded image bytes or BGR image array
+            model_name: Name of the model to use for embedding
+            detection: Detection options (see detection_options); Settings defaults when None
+        Returns:
+            List[dict]: Results in the DeepFace.represent format, with the embedding of the face
+        """
+        model = EmbeddingEngine.get_model(model_name)
+        face = EmbeddingEngine.detect_face(image, model.input_shape, detection)
+        with track_stage("embedding"):
+            embedding = model.model(face, training=False).numpy()[0]
+        return [{"embedding": embedding.tolist()}]
+
+    @staticmethod
+    def detect_face(image: Union[str, bytes, np.ndarray], target_size, detection: Dict = None) -> np.ndarray:
+        """
+        Detect, align and preprocess the first face in an image.
+        Args:
+            image: Path to the image file, encoded image bytes or BGR image array
+            target_size: Input shape of the recognition model
+            detection: Detection options (see detection_options); Settings defaults when None
+        Returns:
+            numpy.ndarray: Model input of shape (1, height, width, 3)
+        """
+        return EmbeddingEngine.detect_faces(image, target_size, detection, max_faces=1)[0]["face"]
+
+    @staticmethod
+    def detect_input(image: Union[str, bytes, np.ndarray], model_name: str = settings.EMBEDDING_MODEL_NAME, detection: Dict = None) -> np.ndarray:
+        """Model input of the first face in an image, for embedding later with embed_inputs."""
+        return EmbeddingEngine.detect_face(image, EmbeddingEngine.get_model(model_name).input_shape, detection)
+
+    @staticmethod
+    def detect_faces(image: Union[str, bytes, np.ndarray], target_size, detection: Dict = None, max_faces: int = None) -> List[Dict]:
+        """
+        Detect, align and preprocess the faces in an image.
+        Args:
+            image: Path to the image file, encoded image bytes or BGR image array
+            target_size: Input shape of the recognition model
+            detection: Detection options (see detection_options); Settings defaults when None
+            max_faces: Only preprocess this many faces, largest first when more are found
+        Returns:
+            List[dict]: One entry per face with face (model input of shape
+                (1, height, width, 3)), facial_area (x, y, w, h in original
+                image pixels) and confidence
+        """
+        from deepface import DeepFace
+        from deepface.modules import preprocessing
+
+        detection = detection or EmbeddingEngine.detection_options()
+        detector_backend = detection["detector_backend"]
+
+        # Decode at reduced size; the detection limit does not apply to pre-cropped faces
+        max_size = smallest_limit(settings.INGEST_MAX_SIZE, detection["max_size"] if detector_backend != "skip" else None)
+        loaded = load_image(image, max_size)
+        # Boxes are found on the reduced image and scaled back to the original
+        reduced = max_size and isinstance(loaded, np.ndarray) and max(loaded.shape[:2]) >= max_size
+        scale = longest_side(image) / max(loaded.shape[:2]) if reduced else 1.0
+
+        # Same preprocessing as DeepFace.represent: RGB face, padded resize, base normalization
+        with track_stage("detection"):
+            faces = DeepFace.extract_faces(
+                img_path=loaded,
+                detector_backend=detector_backend,
+                enforce_detection=detection["enforce_detection"],
+                align=detection["align"],
+                normalize_face=detector_backend != "skip"
+            )
+        if max_faces and len(faces) > max_faces:
+            faces = sorted(faces, key=lambda face: face["facial_area"]["w"] * face["facial_area"]["h"], reverse=True)[:max_faces]
+
+        results = []
+        for face in faces:
+            model_input = preprocessing.resize_image(img=face["face"], target_size=(target_size[1], target_size[0]))
+            area = face["facial_area"]
+            results.append({
+                "face": preprocessing.normalize_input(img=model_input, normalization="base"),
+                "facial_area": {key: int(round(area[key] * scale)) for key in ("x", "y", "w", "h")},
+                "confidence": float(face.get("confidence") or 0)
+            })
+        return results
+
+    @staticmethod
+    def represent_faces(image: Union[str, bytes, np.ndarray], model_name: str = settings.EMBEDDING_MODEL_NAME, detection: Dict = None, max_faces: int = None) -> List[Dict]:
+        """
+        Embed every face in one image: detection runs once and all faces go
+        through the model as one batch.
+        Args:
+            image: Path to the image file, encoded image bytes or BGR image array
+            model_name: Name of the model to use for embedding
+            detection: Detection options (see detection_options); Settings defaults when None
+            max_faces: Embed at most this many faces, largest first
+        Returns:
+            List[dict]: One entry per face with embedding, facial_area and confidence;
+                empty when no face is found
+        """
+        model = EmbeddingEngine.get_model(model_name)
+        try:
+            faces = EmbeddingEngine.detect_faces(image, model.input_shape, detection, max_faces)
+        except ValueError as e:
+            if "Face could not be detected" in str(e):
+                return []
+            raise
+
+        with track_stage("embedding"):
+            embeddings = model.model(np.concatenate([face["face"] for face in faces], axis=0), training=False).numpy()
+        return [
+            {"embedding": np.asarray(embedding, dtype=np.float64), "facial_area": face["facial_area"], "confidence": face["confidence"]}
+            for face, embedding in zip(faces, embeddings)
+        ]
+
+    @staticmethod
+    def represent_batch(images: List[Union[str, bytes, np.ndarray]], model_name: str = settings.EMBEDDING_MODEL_NAME, batch_size: int = None, detection: Dict = None) -> List[Dict]:
+        """
+        Generate embeddings for many images with batched model inference.
+        Args:
+            images: Image paths, encoded image bytes or BGR image arrays
+            model_name: Name of the model to use for embedding
+            batch_size: Number of faces per forward pass
+            detection: Detection options (see detection_options); Settings defaults when None
+        Returns:
+            List[dict]: One result per image, in input order, with keys
+                status ("success", "no_face" or "error"), embedding and error
+        """
+        batch_size = batch_size or settings.EMBEDDING_BATCH_SIZE
+        model = EmbeddingEngine.get_model(model_name)
+        results = [None] * len(images)
+
+        # Detect one batch worth of faces at a time so memory stays bounded
+        for start in range(0, len(images), batch_size):
+            faces, face_indices = [], []
+            for idx in range(start, min(start + batch_size, len(images))):
+                try:
+                    faces.append(EmbeddingEngine.detect_face(images[idx], model.input_shape, detection))
+                    face_indices.append(idx)
+                except Exception as e:
+                    results[idx] = EmbeddingEngine.error_result(e)
+
+            if not faces:
+                continue
+
+            try:
+                with track_stage("embedding"):
+                    embeddings = model.model(np.concatenate(faces, axis=0), training=False).numpy()
+                for idx, embedding in zip(face_indices, embeddings):
+                    results[idx] = {"status": "success", "embedding": np.asarray(embedding, dtype=np.float64), "error": None}
+            except Exception as e:
+                logger.error(f"Batched inference failed for {len(faces)} faces: {str(e)}", exc_info=True)
+                for idx in face_indices:
+                    results[idx] = EmbeddingEngine.error_result(e)
+
+        return results
+
+    @staticmethod
+    def embed_inputs(inputs: List[np.ndarray], model_name: str = settings.EMBEDDING_MODEL_NAME, batch_size: int = None) -> np.ndarray:
+        """
+        Embed preprocessed faces (model inputs from detect_faces) in batches.
+        Returns:
+            numpy.ndarray: One embedding per input, in input order
+        """
+        batch_size = batch_size or settings.EMBEDDING_BATCH_SIZE
+        model = EmbeddingEngine.get_model(model_name)
+        embeddings = []
+        for start in range(0, len(inputs), batch_size):
+            with track_stage("embedding"):
+                embeddings.append(model.model(np.concatenate(inputs[start:start + batch_size], axis=0), training=False).numpy())
+        return np.concatenate(embeddings, axis=0).astype(np.float64) if embeddings else np.empty((0, 0))
+
+    @staticmethod
+    def error_result(error: Exception) -> Dict:
+        """Build a per-item error result, telling "no face found" apart from other failures."""
+        status = "no_face" if "Face could not be detected" in str(error) else "error"
+        return {"status": status, "embedding": None, "error": str(error)}
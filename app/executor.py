@@ -0,0 +1,41 @@
+from concurrent.futures import Executor, ThreadPoolExecutor, ProcessPoolExecutor
+import multiprocessing
+from app.embedding_engine import EmbeddingEngine
+from app.metrics import track_executor
+from app.config import get_settings
+from app.logger import logger
+
+settings = get_settings()
+
+def create_executor() -> Executor:
+    """
+    Create the executor that runs embedding work.
+    EMBEDDING_EXECUTOR selects the backend:
+        thread: a thread pool in this process (the Python-side work shares the GIL)
+        process: a process pool; each worker loads the model and detector once at start-up
+    Returns:
+        Executor: Executor for the CPU-intensive embedding tasks
+    """
+    if settings.EMBEDDING_EXECUTOR == "process":
+        logger.info(
+            f"Starting {settings.EMBEDDING_WORKERS} embedding worker processes "
+            f"(start method: {settings.EMBEDDING_START_METHOD})"
+        )
+        options = {}
+        # max_tasks_per_child needs Python 3.11, so it is only passed when set
+        if settings.EMBEDDING_MAX_TASKS_PER_CHILD:
+            options["max_tasks_per_child"] = settings.EMBEDDING_MAX_TASKS_PER_CHILD
+        executor = ProcessPoolExecutor(
+            max_workers=settings.EMBEDDING_WORKERS,
+            mp_context=multiprocessing.get_context(settings.EMBEDDING_START_METHOD),
+            initializer=EmbeddingEngine.preload,
+            initargs=(settings.EMBEDDING_MODEL_NAME, settings.DETECTOR_BACKEND, settings.EMBEDDING_WORKER_THREADS),
+            **options
+        )
+    elif settings.EMBEDDING_EXECUTOR == "thread":
+        executor = ThreadPoolExecutor(max_workers=settings.EMBEDDING_WORKERS)
+    else:
+        raise ValueError(f"Unknown EMBEDDING_EXECUTOR: {settings.EMBEDDING_EXECUTOR}")
+
+    track_executor(executor)
+    return executor
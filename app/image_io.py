@@ -0,0 +1,106 @@
+from typing import Optional, Tuple, Union
+import io
+import math
+import numpy as np
+import cv2
+from PIL import Image, ImageOps
+from app.metrics import track_stage
+
+JPEG_MAGIC = b"\xff\xd8\xff"
+
+def decode_image(content: bytes, max_size: Optional[int] = None) -> np.ndarray:
+    """
+    Decode uploaded image bytes in memory.
+    With max_size, JPEGs are decoded at a reduced DCT scale (1/2, 1/4 or 1/8)
+    that still covers max_size, which is much cheaper than a full decode, and
+    the result is downscaled so its longest side is at most max_size.
+    Args:
+        content: Encoded image file content (JPEG, PNG, ...)
+        max_size: Longest side of the decoded image, or None for full size
+    Returns:
+        numpy.ndarray: Image in BGR format, as DeepFace expects
+    """
+    with track_stage("decode"):
+        if max_size and content[:3] == JPEG_MAGIC:
+            image = decode_jpeg_reduced(content, max_size)
+        else:
+            image = cv2.imdecode(np.frombuffer(content, dtype=np.uint8), cv2.IMREAD_COLOR)
+            if image is None:
+                raise ValueError("Image could not be decoded")
+        if max_size:
+            image = limit_size(image, max_size)
+    return image
+
+def decode_jpeg_reduced(content: bytes, max_size: int) -> np.ndarray:
+    """Decode a JPEG at the smallest DCT scale whose longest side is still at least max_size."""
+    try:
+        with Image.open(io.BytesIO(content)) as img:
+            width, height = img.size
+            scale = max_size / max(width, height)
+            if scale < 1:
+                img.draft("RGB", (math.ceil(width * scale), math.ceil(height * scale)))
+            # Apply the EXIF orientation, as cv2.imdecode does
+            rgb = ImageOps.exif_transpose(img).convert("RGB")
+    except (OSError, ValueError, Image.DecompressionBombError):
+        raise ValueError("Image could not be decoded")
+    return np.ascontiguousarray(np.asarray(rgb)[:, :, ::-1])
+
+def image_size(content: bytes) -> Tuple[int, int]:
+    """Width and height of an encoded image, read from its header only."""
+    try:
+        with Image.open(io.BytesIO(content)) as img:
+            return img.size
+    except (OSError, ValueError, Image.DecompressionBombError):
+        raise ValueError("Image could not be decoded")
+
+def normalize_image(content: bytes, max_size: int, quality: int = 90) -> Optional[bytes]:
+    """
+    Downscale an encoded image so its longest side is at most max_size and
+    re-encode it as JPEG.
+    Returns:
+        bytes: The normalised JPEG, or None when the image is already small enough
+    """
+    if max(image_size(content)) <= max_size:
+        return None
+    image = decode_image(content, max_size)
+    ok, encoded = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    if not ok:
+        raise ValueError("Image could not be encoded")
+    return encoded.tobytes()
+
+def limit_size(image: np.ndarray, max_size: int) -> np.ndarray:
+    """Downscale an image so its longest side is at most max_size pixels."""
+    height, width = image.shape[:2]
+    scale = max_size / max(height, width)
+    if scale >= 1:
+        return image
+    return cv2.resize(image, (max(1, round(width * scale)), max(1, round(height * scale))), interpolation=cv2.INTER_AREA)
+
+def longest_side(image: Union[str, bytes, np.ndarray]) -> int:
+    """Longest side of an image in pixels, without decoding encoded images."""
+    if isinstance(image, np.ndarray):
+        return max(image.shape[:2])
+    if isinstance(image, str):
+        with Image.open(image) as img:
+            return max(img.size)
+    return max(image_size(image))
+
+def smallest_limit(*limits: Optional[int]) -> Optional[int]:
+    """The tightest of several optional size limits (None or 0 means no limit)."""
+    limits = [limit for limit in limits if limit]
+    return min(limits) if limits else None
+
+def load_image(image: Union[str, bytes, np.ndarray], max_size: Optional[int] = None) -> Union[str, np.ndarray]:
+    """
+    Turn an embedding input into something DeepFace accepts.
+    Encoded bytes are decoded; paths and arrays are passed through unchanged
+    unless max_size is given, in which case the image is read and downscaled.
+    """
+    if isinstance(image, (bytes, bytearray)):
+        return decode_image(image, max_size)
+    if isinstance(image, str) and max_size:
+        with open(image, "rb") as f:
+            return decode_image(f.read(), max_size)
+    if max_size and isinstance(image, np.ndarray):
+        return limit_size(image, max_size)
+    return image
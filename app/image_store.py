@@ -0,0 +1,77 @@
+import os
+import tempfile
+from starlette.staticfiles import StaticFiles
+from app.cache import content_hash
+
+class ImageStore:
+    """
+    Content-addressed image files.
+    An image is stored under the SHA-256 digest of its bytes, in nested shard
+    directories named after the leading hex digits (e.g. 3f/a2/3fa2...9c.jpg),
+    so no directory grows large and identical uploads share one file.
+    """
+
+    def __init__(self, root: str, shard_depth: int = 2, shard_width: int = 2):
+        self.root = root
+        self.shard_depth = shard_depth
+        self.shard_width = shard_width
+
+    def path_for(self, content: bytes, filename: str, digest: str = None) -> str:
+        """Path the content is stored at; filename only contributes its extension."""
+        digest = digest or content_hash(content)
+        ext = os.path.splitext(filename or "")[1].lower()
+        shards = [digest[i * self.shard_width:(i + 1) * self.shard_width] for i in range(self.shard_depth)]
+        return os.path.join(self.root, *shards, f"{digest}{ext}")
+
+    def url_path(self, path: str) -> str:
+        """URL path of a stored file relative to the store root (the /images mount)."""
+        if not path:
+            return ""
+        relative = os.path.relpath(path, self.root)
+        if relative.startswith(os.pardir):
+            # Stored under another root, e.g. by another host; only the name can be served
+            return os.path.basename(path)
+        return relative.replace(os.sep, "/")
+
+def write_atomic(path: str, content: bytes) -> bool:
+    """
+    Write a file so readers only ever see it complete: the bytes go to a
+    temporary file in the same directory, which is then renamed into place.
+    A file that already exists is left alone, which for content-addressed
+    paths means the content is already stored.
+    Returns:
+        bool: True if the file was written, False if it already existed
+    """
+    if os.path.exists(path):
+        return False
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+    try:
+        # mkstemp creates the file private to the owner; stored images are shared like any upload
+        os.fchmod(fd, 0o644)
+        with os.fdopen(fd, "wb") as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+    return True
+
+class ImmutableStaticFiles(StaticFiles):
+    """
+    Static files that never change once written, served with long-lived
+    immutable cache headers. Safe for content-addressed files, whose URL
+    changes with their content, and for uniquely named legacy uploads.
+    """
+
+    def __init__(self, *args, max_age: int = 31536000, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.cache_control = f"public, max-age={max_age}, immutable"
+
+    async def get_response(self, path: str, scope):
+        response = await super().get_response(path, scope)
+        if response.status_code in (200, 304):
+            response.headers["Cache-Control"] = self.cache_control
+        return response
@@ -0,0 +1,264 @@
+"""
+Elasticsearch index maintenance.
+
+The application reads and writes through the ELASTICSEARCH_INDEX alias, so an
+index can be rebuilt with different settings (e.g. HNSW m / ef_construction)
+and swapped in while the application keeps serving.
+
+Usage (from the repository root):
+
+    python -m app.index_tool status
+    python -m app.index_tool ingest-start     # before a large bulk load
+    python -m app.index_tool ingest-stop      # restore settings, refresh, force-merge
+    python -m app.index_tool reindex --m 32 --ef-construction 200 [--delete-old]
+    python -m app.index_tool dedup [--dry-run]     # one-off, for documents with random ids
+"""
+import argparse
+import asyncio
+import json
+import os
+from typing import Dict, List, Optional
+from elasticsearch import AsyncElasticsearch
+from elasticsearch.helpers import async_bulk, async_scan
+from app.util import Util
+from app.person import Person
+from app.cache import content_hash
+from app.logger import logger
+from app.config import get_settings
+
+settings = get_settings()
+
+REINDEX_POLL_SECONDS = 5
+DEDUP_CHUNK_SIZE = 500
+
+async def copy_documents(es: AsyncElasticsearch, source: List[str], dest: str, sync: bool = False) -> int:
+    """
+    Copy documents between indices with a server-side _reindex task, polling until it finishes.
+    Documents keep their source version (external versioning), so a sync pass
+    copies exactly the documents created or updated in the source since they
+    were last copied; registration updates documents in place under
+    deterministic ids, so copying only missing ids would keep stale versions.
+    Args:
+        source: Indices to copy from
+        dest: Index to copy to
+        sync: Only copy documents newer in source than in dest (a catch-up pass)
+    Returns:
+        int: Number of documents created or updated
+    """
+    task = await es.reindex(
+        source={"index": source},
+        dest={"index": dest, "version_type": "external"},
+        conflicts="proceed" if sync else "abort",
+        slices="auto",
+        wait_for_completion=False
+    )
+    while True:
+        status = await es.tasks.get(task_id=task["task"])
+        if status["completed"]:
+            break
+        task_status = status["task"]["status"]
+        logger.info(f"Reindexing into {dest}: {task_status.get('created', 0) + task_status.get('updated', 0)} of {task_status.get('total', 0)} documents")
+        await asyncio.sleep(REINDEX_POLL_SECONDS)
+
+    if "error" in status:
+        raise RuntimeError(f"Reindex into {dest} failed: {status['error']}")
+    response = status["response"]
+    # In a sync pass, version conflicts are documents dest already has up to date
+    failures = [failure for failure in response.get("failures", []) if not sync or failure.get("status") != 409]
+    if failures:
+        raise RuntimeError(f"Reindex into {dest} failed for {len(failures)} documents: {failures[0]}")
+    return response["created"] + response.get("updated", 0)
+
+async def set_write_block(es: AsyncElasticsearch, indices: List[str], blocked: bool) -> None:
+    """Block or allow writes to indices."""
+    await es.indices.put_settings(index=",".join(indices), settings={"index.blocks.write": blocked})
+
+async def reindex(es: AsyncElasticsearch, alias: str, m: int = None, ef_construction: int = None, delete_old: bool = False) -> str:
+    """
+    Rebuild the index behind an alias and swap the alias over atomically.
+    The new index is built in ingest mode, restored to serving settings and
+    synced with documents written meanwhile. Writes to the old index are then
+    blocked for a final sync and the alias swap, so no write is lost; writes
+    attempted in that short window fail and can be retried, and the old
+    indices stay read-only afterwards. A concrete index
+    named like the alias (created before aliases were used) is replaced by the
+    alias in the same atomic step.
+    Args:
+        alias: Alias the application uses (ELASTICSEARCH_INDEX)
+        m: HNSW m of the new index
+        ef_construction: HNSW ef_construction of the new index
+        delete_old: Delete the previous indices once the alias has moved
+    Returns:
+        str: Name of the new index
+    """
+    old_indices = await Util.alias_indices(es, alias)
+    legacy = not old_indices and await es.indices.exists(index=alias)
+    if not old_indices and not legacy:
+        raise ValueError(f"Nothing to reindex: {alias} does not exist")
+    source = old_indices or [alias]
+
+    new_index = Util.new_index_name(alias)
+    await es.indices.create(index=new_index, body=Util.index_config(m, ef_construction, ingest=True))
+    logger.info(f"Created {new_index}, copying documents from {', '.join(source)}")
+
+    copied = await copy_documents(es, source, new_index)
+    await Util.end_ingest(es, new_index)
+    await es.cluster.health(index=new_index, wait_for_status="yellow", timeout="5m")
+    # Documents written to the old index while the copy ran
+    copied += await copy_documents(es, source, new_index, sync=True)
+
+    await set_write_block(es, source, True)
+    try:
+        # Writes that landed since the last sync; nothing can land after this one
+        copied += await copy_documents(es, source, new_index, sync=True)
+        await es.indices.refresh(index=new_index)
+
+        actions = [{"add": {"index": new_index, "alias": alias, "is_write_index": True}}]
+        if legacy:
+            actions.append({"remove_index": {"index": alias}})
+        else:
+            actions.extend({"remove": {"index": index, "alias": alias}} for index in old_indices)
+        await es.indices.update_aliases(actions=actions)
+    except BaseException:
+        await set_write_block(es, source, False)
+        raise
+    logger.info(f"Alias {alias} now points to {new_index} ({copied} documents copied)")
+
+    if not legacy and delete_old:
+        await es.indices.delete(index=",".join(old_indices))
+        logger.info(f"Deleted {', '.join(old_indices)}")
+    return new_index
+
+def dedup_target_id(source: Dict) -> Optional[str]:
+    """
+    Deterministic id a document should have (see Person.document_id): from its
+    national ID, else its image hash, else the hash of its stored image file.
+    """
+    image_hash = source.get("image_hash")
+    if not source.get("national_id_number") and not image_hash:
+        image_path = source.get("image_path")
+        if image_path and os.path.exists(image_path):
+            with open(image_path, "rb") as f:
+                image_hash = content_hash(f.read())
+    return Person.document_id_for(source.get("national_id_number"), image_hash)
+
+async def deduplicate(es: AsyncElasticsearch, alias: str, dry_run: bool = False) -> dict:
+    """
+    Move documents to their deterministic ids and drop duplicates.
+    Documents that map to the same id are duplicates; the most recently
+    written one (highest _seq_no, which orders writes within a shard) is kept
+    under that id and the others are deleted. Documents whose id cannot be derived are left alone.
+    Args:
+        alias: Alias or index to deduplicate
+        dry_run: Only count what would change
+    Returns:
+        dict: Counts of scanned, kept, moved and deleted documents
+    """
+    groups: Dict[str, List] = {}
+    scanned = 0
+    async for hit in async_scan(
+        es,
+        index=alias,
+        query={
+            "query": {"match_all": {}},
+            "_source": ["national_id_number", "image_hash", "image_path"],
+            "seq_no_primary_term": True
+        },
+        size=DEDUP_CHUNK_SIZE
+    ):
+        scanned += 1
+        target = await asyncio.to_thread(dedup_target_id, hit["_source"])
+        if target:
+            groups.setdefault(target, []).append((hit["_seq_no"], hit["_id"], hit["_index"]))
+
+    moves = []
+    deletes = []
+    for target, docs in groups.items():
+        docs.sort(reverse=True)
+        _, keep_id, keep_index = docs[0]
+        if keep_id != target:
+            moves.append((keep_id, keep_index, target))
+        deletes.extend((doc_id, index) for _, doc_id, index in docs[1:] if doc_id != target)
+    report = {"scanned": scanned, "kept": len(groups), "moved": len(moves), "deleted": len(deletes) + len(moves)}
+    if dry_run:
+        return report
+
+    async def actions():
+        for start in range(0, len(moves), DEDUP_CHUNK_SIZE):
+            chunk = moves[start:start + DEDUP_CHUNK_SIZE]
+            sources = {}
+            for index in {index for _, index, _ in chunk}:
+                response = await es.mget(index=index, ids=[doc_id for doc_id, doc_index, _ in chunk if doc_index == index])
+                sources.update({(index, doc["_id"]): doc["_source"] for doc in response["docs"] if doc.get("found")})
+            for doc_id, index, target in chunk:
+                if (index, doc_id) in sources:
+                    yield {"_op_type": "index", "_index": index, "_id": target, "_source": sources[(index, doc_id)]}
+                    yield {"_op_type": "delete", "_index": index, "_id": doc_id}
+        for doc_id, index in deletes:
+            yield {"_op_type": "delete", "_index": index, "_id": doc_id}
+
+    _, errors = await async_bulk(es, actions(), chunk_size=DEDUP_CHUNK_SIZE, raise_on_error=False)
+    await es.indices.refresh(index=alias)
+    report["errors"] = len(errors)
+    if errors:
+        logger.error(f"Dedup failed for {len(errors)} operations, e.g. {errors[0]}")
+    return report
+
+async def status(es: AsyncElasticsearch, alias: str) -> dict:
+    """Indices behind the alias with their document count and dynamic settings."""
+    indices = await Util.alias_indices(es, alias) or [alias]
+    response = await es.indices.get_settings(
+        index=",".join(indices),
+        name=["index.refresh_interval", "index.number_of_replicas"],
+        flat_settings=True,
+        include_defaults=True
+    )
+    report = {"alias": alias, "indices": {}}
+    for index in indices:
+        values = {**response[index].get("defaults", {}), **response[index].get("settings", {})}
+        report["indices"][index] = {
+            "documents": (await es.count(index=index))["count"],
+            "refresh_interval": values.get("index.refresh_interval"),
+            "number_of_replicas": values.get("index.number_of_replicas")
+        }
+    return report
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Maintain the people index behind the ELASTICSEARCH_INDEX alias")
+    parser.add_argument("--index", default=settings.ELASTICSEARCH_INDEX, help="alias the application uses")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("status", help="show the indices behind the alias")
+    commands.add_parser("ingest-start", help="switch to ingest mode (refresh off, no replicas) before a bulk load")
+    commands.add_parser("ingest-stop", help="restore serving settings, refresh and force-merge after a bulk load")
+    reindex_parser = commands.add_parser("reindex", help="rebuild the index and move the alias over to it")
+    reindex_parser.add_argument("--m", type=int, help=f"HNSW m (default {settings.ELASTICSEARCH_HNSW_M})")
+    reindex_parser.add_argument("--ef-construction", type=int, help=f"HNSW ef_construction (default {settings.ELASTICSEARCH_HNSW_EF_CONSTRUCTION})")
+    reindex_parser.add_argument("--delete-old", action="store_true", help="delete the previous indices after the swap")
+    dedup_parser = commands.add_parser("dedup", help="move documents to deterministic ids and delete duplicates")
+    dedup_parser.add_argument("--dry-run", action="store_true", help="only report what would change")
+    return parser.parse_args(argv)
+
+async def run(args: argparse.Namespace) -> None:
+    es = Util.get_connection()
+    try:
+        if args.command == "status":
+            print(json.dumps(await status(es, args.index), indent=2))
+        elif args.command == "ingest-start":
+            await Util.begin_ingest(es, args.index)
+        elif args.command == "ingest-stop":
+            await Util.end_ingest(es, args.index)
+        elif args.command == "reindex":
+            # Copying and force-merging outlast the default request timeout
+            es = es.options(request_timeout=max(settings.ELASTICSEARCH_REQUEST_TIMEOUT, 300))
+            print(await reindex(es, args.index, args.m, args.ef_construction, args.delete_old))
+        elif args.command == "dedup":
+            es = es.options(request_timeout=max(settings.ELASTICSEARCH_REQUEST_TIMEOUT, 300))
+            print(json.dumps(await deduplicate(es, args.index, args.dry_run), indent=2))
+    finally:
+        await es.close()
+
+def main(argv=None) -> None:
+    asyncio.run(run(parse_args(argv)))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+from typing import List, Dict
+import asyncio
+import uuid
+from contextlib import nullcontext
+from elasticsearch import AsyncElasticsearch
+from app.person_repository import PersonRepository
+from app.person import Person
+from app.vector_index import VectorIndex
+from app.metrics import track_stage
+from app.quantization import EMBEDDING_FIELDS, decode_embedding
+from app.logger import logger
+from app.config import get_settings
+
+settings = get_settings()
+
+class LocalPersonRepository(PersonRepository):
+    """
+    Person repository that answers kNN queries from the in-process VectorIndex.
+    With VECTOR_INDEX_METADATA="local" the whole document lives in the vector
+    index and Elasticsearch is not used. With "elasticsearch", documents are
+    still indexed in Elasticsearch; only the vectors are searched in-process
+    and hits are filled in with one mget.
+    """
+
+    def __init__(self, es_client: AsyncElasticsearch, index_name: str, vector_index: VectorIndex):
+        super().__init__(es_client, index_name)
+        self.vector_index = vector_index
+        self._metadata_in_es = settings.VECTOR_INDEX_METADATA == "elasticsearch"
+
+    async def setup_index(self):
+        """Load the vector index, and set up the Elasticsearch index when it holds the metadata."""
+        try:
+            if self._metadata_in_es:
+                await super().setup_index()
+            await asyncio.to_thread(self.vector_index.load)
+        except Exception as e:
+            logger.error(f"Error setting up vector index: {str(e)}", exc_info=True)
+            raise
+
+    def ingest_mode(self):
+        """Ingest mode only concerns the Elasticsearch index, when it holds the metadata."""
+        return super().ingest_mode() if self._metadata_in_es else nullcontext()
+
+    async def _get_stored_embeddings(self, ids: List[str]) -> Dict[str, Dict]:
+        if self._metadata_in_es:
+            return await super()._get_stored_embeddings(ids)
+
+        def lookup():
+            stored = {}
+            for doc_id in ids:
+                entry = self.vector_index.get(doc_id)
+                if entry is not None:
+                    vector, source = entry
+                    stored[doc_id] = {**source, "image_embedding": vector.tolist()}
+            return stored
+
+        return await asyncio.to_thread(lookup)
+
+    async def _index_document(self, document: Dict, doc_id: str = None) -> Dict:
+        outcome = (await self._index_documents([document], [doc_id]))[0]
+        if outcome["status"] != "success":
+            raise Exception(outcome["error"])
+        return outcome
+
+    async def _index_documents(self, documents: List[Dict], ids: List[str] = None) -> List[Dict]:
+        # Elasticsearch and the vector index must agree on ids, so generate them up front
+        ids = [doc_id or uuid.uuid4().hex for doc_id in (ids or [None] * len(documents))]
+        if self._metadata_in_es:
+            outcomes = await super()._index_documents(documents, ids)
+        else:
+            outcomes = [{"status": "success", "error": None} for _ in documents]
+
+        added = [idx for idx, outcome in enumerate(outcomes) if outcome["status"] == "success"]
+        if added:
+            metadata = [
+                {} if self._metadata_in_es else {k: v for k, v in documents[idx].items() if k not in EMBEDDING_FIELDS}
+                for idx in added
+            ]
+            with track_stage("vector_add"):
+                await asyncio.to_thread(
+                    self.vector_index.add,
+                    [ids[idx] for idx in added],
+                    [decode_embedding(documents[idx]) for idx in added],
+                    metadata
+                )
+        return outcomes
+
+    async def get_by_national_id(self, national_id_number: str, fields: List[str] = None) -> List[Dict]:
+        # Documents in Elasticsearch carry their embedding, so the keyed lookup can stay there
+        if self._metadata_in_es:
+            return await super().get_by_national_id(national_id_number, fields)
+        fields = list(fields or self.SEARCH_SOURCE_FIELDS)
+        doc_id = Person.document_id_for(national_id_number)
+
+        def lookup():
+            entry = self.vector_index.get(doc_id)
+            if entry is not None:
+                return [(doc_id, *entry)]
+            # Documents indexed before ids were derived from the national ID
+            return self.vector_index.find("national_id_number", national_id_number)
+
+        with track_stage("vector_search"):
+            documents = await asyncio.to_thread(lookup)
+        return [
+            {"id": doc_id, "embedding": vector, "person": {k: source.get(k) for k in fields}}
+            for doc_id, vector, source in documents[:settings.VERIFY_MAX_RECORDS]
+        ]
+
+    async def _search(self, image_embedding: List[float], search: Dict) -> Dict:
+        return (await self._msearch([image_embedding], search))[0]
+
+    async def _msearch(self, image_embeddings: List[List[float]], search: Dict) -> List[Dict]:
+        # Searches are exhaustive (or IVF-probed), so num_candidates does not apply
+        with track_stage("vector_search"):
+            hits_per_query = await asyncio.to_thread(
+                self.vector_index.search_many,
+                image_embeddings,
+                search["k"]
+            )
+
+        if self._metadata_in_es:
+            sources = await self._fetch_sources({hit["_id"] for hits in hits_per_query for hit in hits}, search["fields"])
+            hits_per_query = [
+                [dict(hit, _source=sources[hit["_id"]]) for hit in hits if hit["_id"] in sources]
+                for hits in hits_per_query
+            ]
+        else:
+            hits_per_query = [
+                [dict(hit, _source={k: hit["_source"].get(k) for k in search["fields"]}) for hit in hits]
+                for hits in hits_per_query
+            ]
+
+        return [{"hits": {"hits": hits}} for hits in hits_per_query]
+
+    async def _fetch_sources(self, ids, fields: List[str]) -> Dict[str, Dict]:
+        """Fetch the given fields of many documents from Elasticsearch in one mget."""
+        if not ids:
+            return {}
+        with track_stage("es_query"):
+            response = await self.es_client.mget(index=self._index_name, ids=list(ids), source=fields)
+        return {doc["_id"]: doc["_source"] for doc in response["docs"] if doc.get("found")}
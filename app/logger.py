@@ -1,17 +1,55 @@
+import atexit
+import contextvars
 import logging
+import queue
+import random
 import sys
-from logging.handlers import RotatingFileHandler
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 from app.config import get_settings
 
 settings = get_settings()
 
+# Whether detail records of the current request are kept; None outside a request
+_detail_sampled: contextvars.ContextVar = contextvars.ContextVar("log_detail_sampled", default=None)
+
+class DetailSampler(logging.Filter):
+    """
+    Keeps per-request detail records for a sample of requests only.
+    The decision is made once per request (see sample_request_details) so a
+    sampled request is logged in full; records outside a request are sampled
+    one by one. Warnings and errors always pass.
+    """
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        sampled = _detail_sampled.get()
+        if sampled is None:
+            return random.random() < self.rate
+        return sampled
+
+def sample_request_details() -> bool:
+    """Decide whether the detail records of the current request are logged."""
+    sampled = random.random() < settings.LOG_DETAIL_SAMPLE_RATE
+    _detail_sampled.set(sampled)
+    return sampled
+
 def setup_logger(name: str) -> logging.Logger:
-    """Setup and return a logger instance with both file and console handlers."""
-    
+    """
+    Setup and return a logger instance with both file and console handlers.
+    Records are put on an in-memory queue and written to the file and console
+    by a background listener thread, so formatting, disk I/O and rollover never
+    block the event loop.
+    """
+
     # Create logger
     logger = logging.getLogger(name)
-    logger.setLevel(logging.INFO)
-    
+    logger.setLevel(settings.LOG_LEVEL.upper())
+
     # Create formatters
     file_formatter = logging.Formatter(
         '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
@@ -19,7 +57,7 @@ def setup_logger(name: str) -> logging.Logger:
     console_formatter = logging.Formatter(
         '%(levelname)s: %(message)s'
     )
-    
+
     # File handler
     file_handler = RotatingFileHandler(
         settings.LOG_FILE,
@@ -27,16 +65,23 @@ def setup_logger(name: str) -> logging.Logger:
         backupCount=settings.LOG_BACKUP_COUNT
     )
     file_handler.setFormatter(file_formatter)
-    
+
     # Console handler
     console_handler = logging.StreamHandler(sys.stdout)
     console_handler.setFormatter(console_formatter)
-    
-    # Add handlers to logger
-    logger.addHandler(file_handler)
-    logger.addHandler(console_handler)
-    
+
+    # The logger only enqueues; the listener thread owns the real handlers
+    log_queue = queue.SimpleQueue()
+    listener = QueueListener(log_queue, file_handler, console_handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    logger.addHandler(QueueHandler(log_queue))
+
     return logger
 
 # Create main application logger
 logger = setup_logger('image_search')
+
+# Per-request detail (hot path progress messages), sampled by LOG_DETAIL_SAMPLE_RATE
+detail_logger = logger.getChild('detail')
+detail_logger.addFilter(DetailSampler(settings.LOG_DETAIL_SAMPLE_RATE))
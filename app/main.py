@@ -1,19 +1,30 @@
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Request
-from fastapi.responses import JSONResponse
-from app.search import search_by_image
-from app.register import register_person, register_persons
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Request, BackgroundTasks
+from fastapi.responses import JSONResponse, StreamingResponse, Response
+from app.search import search_by_image, search_by_images, search_faces_by_image
+from app.verify import verify_by_image
+from app.video_search import search_video, resolve_video_path
+from app.register import register_person, register_persons, REGISTERED_STATUSES
 from app.util import Util
 from app.person_service import PersonService
 from app.person_repository import PersonRepository
+from app.local_person_repository import LocalPersonRepository
+from app.vector_index import VectorIndex
+from app.search_batcher import SearchBatcher
+from app.person import Person
+from app.embedding_engine import EmbeddingEngine
+from app.cache import embedding_cache, search_result_cache, content_hash
+from app.multipart_stream import MultipartStream
+from app.image_io import normalize_image
+from app.image_store import ImageStore, ImmutableStaticFiles, write_atomic
+from app.metrics import MetricsMiddleware, track_stage, render_metrics
 from app.config import get_settings
-from app.logger import logger
+from app.logger import logger, detail_logger
+from app.request_log import RequestLogMiddleware, annotate_request
 import os
-from fastapi.staticfiles import StaticFiles
-import uuid
 import socket
 from fastapi.middleware.cors import CORSMiddleware
-from typing import Optional, List
-import aiofiles
+from typing import Optional, List, Tuple
+from contextlib import asynccontextmanager, nullcontext
 from datetime import datetime
 import json
 import asyncio
@@ -35,29 +46,130 @@ def validate_image_file(file: UploadFile) -> None:
     size = file.file.tell()
     file.file.seek(0)  # Reset file pointer
     
+    validate_image_upload(file.filename, size)
+
+def validate_image_upload(filename: str, size: int) -> None:
+    """Validate the name and size of an uploaded image."""
     if size > settings.MAX_FILE_SIZE:
         raise ImageSearchException(f"File size exceeds maximum limit of {settings.MAX_FILE_SIZE/1024/1024}MB")
     
     # Check file extension
-    ext = os.path.splitext(file.filename)[1].lower()
+    ext = os.path.splitext(filename or "")[1].lower()
     if ext not in settings.ALLOWED_EXTENSIONS:
         raise ImageSearchException(f"Invalid file extension. Allowed extensions: {settings.ALLOWED_EXTENSIONS}")
 
-async def save_upload_file(upload_file: UploadFile, folder: str) -> str:
-    """Save uploaded file to disk asynchronously."""
+# Fields every bulk registration item must have
+PERSON_FIELDS = (
+    "full_name", "birth_place", "birth_date", "address", "nationality",
+    "passport_number", "gender", "national_id_number", "marital_status"
+)
+REQUIRED_PERSON_FIELDS = ("full_name", "birth_date", "gender")
+
+def validate_person_data(person_data: dict) -> None:
+    """Validate the person fields of a bulk registration item."""
+    if not isinstance(person_data, dict):
+        raise ImageSearchException("Person data must be an object")
+    missing = [field for field in PERSON_FIELDS if field not in person_data]
+    if missing:
+        raise ImageSearchException(f"Missing person fields: {', '.join(missing)}")
+    # Optional fields may be null, the ones checked below may not
+    invalid = [
+        field for field in PERSON_FIELDS
+        if not isinstance(person_data[field], str)
+        and (person_data[field] is not None or field in REQUIRED_PERSON_FIELDS)
+    ]
+    if invalid:
+        raise ImageSearchException(f"Person fields must be strings: {', '.join(invalid)}")
+    
+    # Validate date format
     try:
-        ext = os.path.splitext(upload_file.filename)[1]
-        filename = f"{uuid.uuid4().hex}{ext}"
-        filepath = os.path.join(folder, filename)
-        
-        async with aiofiles.open(filepath, 'wb') as out_file:
-            content = await upload_file.read()
-            await out_file.write(content)
-            
-        return filepath
+        datetime.strptime(person_data["birth_date"], '%Y-%m-%d')
+    except ValueError:
+        raise ImageSearchException("Invalid birth date format. Use YYYY-MM-DD")
+    
+    # Validate gender
+    if not person_data["gender"].strip():
+        raise ImageSearchException("Gender cannot be empty")
+
+def invalid_person_result(person_data, message: str) -> dict:
+    """Bulk registration result of an item that failed validation."""
+    person_data = person_data if isinstance(person_data, dict) else {}
+    return {
+        "status": "error",
+        "message": message,
+        "data": {
+            "full_name": person_data.get("full_name"),
+            "national_id_number": person_data.get("national_id_number")
+        }
+    }
+
+def detection_options(
+    detector_backend: Optional[str] = None,
+    align: Optional[bool] = None,
+    enforce_detection: Optional[bool] = None,
+    max_detection_size: Optional[int] = None
+) -> dict:
+    """Face detection options of a request; anything not given falls back to the settings."""
+    try:
+        return EmbeddingEngine.detection_options(detector_backend, align, enforce_detection, max_detection_size)
+    except ValueError as e:
+        raise ImageSearchException(str(e))
+
+def search_options(k: Optional[int] = None, num_candidates: Optional[int] = None, fields: Optional[str] = None) -> dict:
+    """kNN search options of a request (fields comma separated); anything not given falls back to the settings."""
+    try:
+        field_list = [field.strip() for field in fields.split(",") if field.strip()] if fields else None
+        return PersonRepository.search_options(k, num_candidates, field_list)
+    except ValueError as e:
+        raise ImageSearchException(str(e))
+
+# Registered images and saved search probes, stored once per content hash
+image_store = ImageStore(settings.DATASET_FOLDER, settings.IMAGE_STORE_SHARD_DEPTH)
+probe_store = ImageStore(settings.DATASET_LOST_FOLDER, settings.IMAGE_STORE_SHARD_DEPTH)
+
+async def read_upload_file(upload_file: UploadFile) -> bytes:
+    """Read the uploaded file content into memory."""
+    try:
+        with track_stage("upload_read"):
+            return await upload_file.read()
+    except Exception as e:
+        logger.error(f"Error reading file: {str(e)}")
+        raise ImageSearchException("Failed to read uploaded file")
+
+async def normalize_upload(content: bytes, filename: str) -> Tuple[bytes, str]:
+    """
+    Replace an image being registered with its downscaled JPEG when
+    INGEST_STORE_NORMALIZED is set, so it is stored and embedded at that size.
+    Returns:
+        tuple: Content to store and embed, and the filename to store it under
+    """
+    if not settings.INGEST_STORE_NORMALIZED or not settings.INGEST_MAX_SIZE:
+        return content, filename
+    try:
+        with track_stage("normalize"):
+            normalized = await asyncio.to_thread(normalize_image, content, settings.INGEST_MAX_SIZE, settings.INGEST_JPEG_QUALITY)
+    except ValueError:
+        # Undecodable uploads are kept as they are and fail when embedded
+        return content, filename
+    if normalized is None:
+        return content, filename
+    return normalized, f"{os.path.splitext(filename)[0]}.jpg"
+
+async def write_file(filepath: str, content: bytes) -> None:
+    """
+    Write file content to disk atomically, skipping content that is already stored.
+    Runs as a background task, so errors are only logged.
+    """
+    try:
+        with track_stage("file_save"):
+            if not await asyncio.to_thread(write_atomic, filepath, content):
+                detail_logger.info(f"Image already stored: {filepath}")
     except Exception as e:
-        logger.error(f"Error saving file: {str(e)}")
-        raise ImageSearchException("Failed to save uploaded file")
+        logger.error(f"Error saving file {filepath}: {str(e)}")
+
+async def write_files(filepaths: List[str], contents: List[bytes]) -> None:
+    """Write many files to disk concurrently."""
+    await asyncio.gather(*[write_file(filepath, content) for filepath, content in zip(filepaths, contents)])
 
 def get_active_ip() -> str:
     """Get active IP address of the server."""
@@ -72,10 +184,106 @@ def get_active_ip() -> str:
         logger.error(f"Failed to get active IP: {e}")
         return "localhost"
 
-server_ip = get_active_ip()
-logger.info(f"Server running on IP: {server_ip}")
+# Resolved during start-up
+server_ip = settings.SERVER_HOST or "localhost"
+
+async def warm_up_models() -> None:
+    """
+    Load the models and run warm-up inference in the embedding executor.
+    With the process backend, one task per worker makes the pool start all of its
+    workers, and each loads the models in its initializer (EmbeddingEngine.preload).
+    The warm-up inference itself may run twice in one worker and not in another.
+    """
+    loop = asyncio.get_running_loop()
+    workers = settings.EMBEDDING_WORKERS if settings.EMBEDDING_EXECUTOR == "process" else 1
+    await asyncio.gather(*[
+        loop.run_in_executor(
+            Person._executor,
+            EmbeddingEngine.warm_up,
+            settings.EMBEDDING_MODEL_NAME,
+            settings.DETECTOR_BACKEND,
+            settings.WARMUP_RUNS
+        )
+        for _ in range(workers)
+    ])
+
+async def warm_up_then_ready(app: FastAPI) -> None:
+    """Warm up the models, then report the app ready. A failed warm-up leaves it not ready."""
+    try:
+        await warm_up_models()
+    except Exception as e:
+        logger.error(f"Failed to warm up the models: {str(e)}")
+        return
+    app.state.ready = True
+    logger.info("Models warmed up, ready")
+
+# Database connection, created and closed by the app lifespan
+person_repo: Optional[PersonRepository] = None
+person_service: Optional[PersonService] = None
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Start-up: create the shared Elasticsearch client, set up the index and resolve
+    the server IP, then warm up the models in the background while requests are
+    already served; the app reports ready once the warm-up is done. Shutdown: report
+    not ready, then close the client and the embedding executor.
+    """
+    global person_repo, person_service, server_ip
+    app.state.ready = False
+    es_db = Util.get_connection()
+    try:
+        if settings.REPOSITORY_BACKEND == "local":
+            vector_index = VectorIndex(
+                settings.VECTOR_INDEX_PATH,
+                dim=settings.EMBEDDING_DIMS,
+                mode=settings.VECTOR_INDEX_MODE,
+                nlist=settings.VECTOR_INDEX_NLIST,
+                nprobe=settings.VECTOR_INDEX_NPROBE,
+                storage=settings.EMBEDDING_STORAGE,
+                rescore_oversample=settings.SEARCH_RESCORE_OVERSAMPLE,
+                keys=("national_id_number",)
+            )
+            person_repo = LocalPersonRepository(es_db, settings.ELASTICSEARCH_INDEX, vector_index)
+        else:
+            person_repo = PersonRepository(es_db, settings.ELASTICSEARCH_INDEX)
+
+        startup = [person_repo.setup_index()]
+        if not settings.SERVER_HOST:
+            startup.append(asyncio.to_thread(get_active_ip))
+        results = await asyncio.gather(*startup)
+        if not settings.SERVER_HOST:
+            server_ip = results[1]
+        logger.info(f"Server running on IP: {server_ip}")
+    except Exception as e:
+        logger.error(f"Failed to start up: {str(e)}")
+        await es_db.close()
+        Person._executor.shutdown(wait=False, cancel_futures=True)
+        raise
+
+    search_batcher = None
+    if settings.SEARCH_BATCHING_ENABLED:
+        search_batcher = SearchBatcher(person_repo)
+        search_batcher.start()
+    person_service = PersonService(person_repo, search_batcher)
+    warm_up = None
+    if settings.WARMUP_ENABLED:
+        warm_up = asyncio.create_task(warm_up_then_ready(app))
+    else:
+        app.state.ready = True
+
+    try:
+        yield
+    finally:
+        app.state.ready = False
+        if warm_up:
+            warm_up.cancel()
+        if search_batcher:
+            await search_batcher.stop()
+        await es_db.close()
+        Person._executor.shutdown(wait=False, cancel_futures=True)
 
-app = FastAPI(title=settings.PROJECT_NAME)
+app = FastAPI(title=settings.PROJECT_NAME, lifespan=lifespan)
 
 @app.exception_handler(ImageSearchException)
 async def image_search_exception_handler(request: Request, exc: ImageSearchException):
@@ -93,23 +301,52 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Setup database connection
-try:
-    es_db = Util.get_connection()
-    person_repo = PersonRepository(es_db, settings.ELASTICSEARCH_INDEX)
-    person_service = PersonService(person_repo)
-except Exception as e:
-    logger.error(f"Failed to initialize database connection: {str(e)}")
-    raise
+# Request counts, latency and in-flight requests per route
+if settings.METRICS_ENABLED:
+    app.add_middleware(MetricsMiddleware)
+
+# One summary line per request; also decides which requests log their details
+if settings.LOG_REQUEST_SUMMARY:
+    app.add_middleware(RequestLogMiddleware)
 
-# Create dataset folder if it doesn't exist
+# Create dataset folders if they don't exist
 os.makedirs(settings.DATASET_FOLDER, exist_ok=True)
+os.makedirs(settings.DATASET_LOST_FOLDER, exist_ok=True)
+
+# Mount static files; stored images never change, so clients may cache them indefinitely
+app.mount("/images", ImmutableStaticFiles(directory=settings.DATASET_FOLDER, max_age=settings.IMAGE_CACHE_MAX_AGE), name="images")
+
+@app.get("/health/live")
+async def liveness():
+    """The process is up."""
+    return {"status": "alive"}
+
+@app.get("/health/ready")
+async def readiness():
+    """The index is set up and the models are warmed up; 503 while warming up or shutting down."""
+    if not getattr(app.state, "ready", False):
+        return JSONResponse(status_code=503, content={"status": "not_ready"})
+    return {"status": "ready"}
 
-# Mount static files
-app.mount("/images", StaticFiles(directory=settings.DATASET_FOLDER), name="images")
+@app.get("/cache/stats/")
+async def cache_stats():
+    """Hit/miss counters and sizes of the embedding and search result caches."""
+    return {
+        "embedding_cache": embedding_cache.stats(),
+        "search_result_cache": search_result_cache.stats()
+    }
+
+@app.get("/metrics")
+async def metrics():
+    """Per-stage latency histograms, executor queue depth and request metrics in the Prometheus format."""
+    if not settings.METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="Metrics are disabled")
+    content, content_type = render_metrics()
+    return Response(content=content, media_type=content_type)
 
 @app.post("/register/")
 async def register_person_api(
+    background_tasks: BackgroundTasks,
     full_name: str = Form(...),
     birth_place: str = Form(...),
     birth_date: str = Form(...),
@@ -119,7 +356,11 @@ async def register_person_api(
     gender: str = Form(...),
     national_id_number: str = Form(...),
     marital_status: str = Form(...),
-    image: UploadFile = File(...)
+    image: UploadFile = File(...),
+    detector_backend: Optional[str] = Form(None),
+    align: Optional[bool] = Form(None),
+    enforce_detection: Optional[bool] = Form(None),
+    max_detection_size: Optional[int] = Form(None)
 ):
     """
     Register a new person with their details and image.
@@ -135,6 +376,10 @@ async def register_person_api(
         national_id_number: National ID number
         marital_status: Marital status
         image: Profile image file
+        detector_backend: Face detector ("skip" for images that are already face crops)
+        align: Align the face before embedding
+        enforce_detection: Reject images without a detected face
+        max_detection_size: Longest image side used for detection
     
     Returns:
         dict: Registration result with person details
@@ -150,14 +395,20 @@ async def register_person_api(
         if not gender.strip():
             raise ImageSearchException("Gender cannot be empty")
             
-        # Validate image
+        # Validate image and detection options
         validate_image_file(image)
+        detection = detection_options(detector_backend, align, enforce_detection, max_detection_size)
         
-        # Save image
-        image_path = await save_upload_file(image, settings.DATASET_FOLDER)
+        # Embed the upload from memory; the file is written after the response is sent
+        content, filename = await normalize_upload(await read_upload_file(image), image.filename)
+        image_hash = content_hash(content)
+        image_path = image_store.path_for(content, filename, image_hash)
+        background_tasks.add_task(write_file, image_path, content)
         
         # Prepare person data
         person_data = {
+            "image": content,
+            "image_hash": image_hash,
             "image_path": image_path,
             "full_name": full_name,
             "birth_place": birth_place,
@@ -171,8 +422,8 @@ async def register_person_api(
         }
         
         # Register person
-        result = await register_person(person_data, person_service)
-        logger.info(f"Successfully registered person: {full_name}")
+        result = await register_person(person_data, person_service, detection)
+        detail_logger.info(f"Successfully registered person: {full_name}")
         return result
         
     except ImageSearchException as e:
@@ -184,9 +435,13 @@ async def register_person_api(
 @app.post("/register-bulk/")
 async def register_bulk_persons(
     request: Request,
+    background_tasks: BackgroundTasks,
     files: List[UploadFile] = File(...),
     persons_data: str = Form(...),
-    enforce_detection: bool = Form(True)
+    detector_backend: Optional[str] = Form(None),
+    align: Optional[bool] = Form(None),
+    enforce_detection: Optional[bool] = Form(None),
+    max_detection_size: Optional[int] = Form(None)
 ):
     """
     Register multiple persons with their details and images in bulk.
@@ -194,6 +449,8 @@ async def register_bulk_persons(
     Args:
         files: List of image files
         persons_data: JSON string containing list of person details
+        detector_backend, align, enforce_detection, max_detection_size:
+            Face detection options for all images, as for /register/
         
     Returns:
         List[dict]: List of registration results
@@ -206,113 +463,597 @@ async def register_bulk_persons(
         
         if len(persons) != len(files):
             raise ImageSearchException("Jumlah data person harus sama dengan jumlah file gambar")
+        detection = detection_options(detector_backend, align, enforce_detection, max_detection_size)
         
-        # Process images in parallel
-        async def save_images():
-            tasks = []
-            for idx, image_file in enumerate(files):
-                # Validate image
-                validate_image_file(image_file)
-                # Save image
-                task = save_upload_file(image_file, settings.DATASET_FOLDER)
-                tasks.append(task)
-            return await asyncio.gather(*tasks)
-        
-        # Save all images and get their paths
-        image_paths = await save_images()
+        # Read images in parallel
+        for image_file in files:
+            validate_image_file(image_file)
+        contents = await asyncio.gather(*[read_upload_file(image_file) for image_file in files])
+        uploads = await asyncio.gather(*[normalize_upload(content, image_file.filename) for content, image_file in zip(contents, files)])
+        contents = [content for content, _ in uploads]
+        image_hashes = [content_hash(content) for content in contents]
+        image_paths = [image_store.path_for(content, filename, image_hash) for (content, filename), image_hash in zip(uploads, image_hashes)]
         
-        # Add image paths to person data
-        for person_data, image_path in zip(persons, image_paths):
-            # Validate date format
+        # Add images and their future paths to person data; invalid items get their own error result
+        results = [None] * len(persons)
+        valid = []
+        for idx, (person_data, content, image_hash, image_path) in enumerate(zip(persons, contents, image_hashes, image_paths)):
             try:
-                datetime.strptime(person_data["birth_date"], '%Y-%m-%d')
-            except ValueError:
-                raise ImageSearchException("Invalid birth date format. Use YYYY-MM-DD")
-            
-            # Validate gender
-            if not person_data["gender"].strip():
-                raise ImageSearchException("Gender cannot be empty")
-            
+                validate_person_data(person_data)
+            except ImageSearchException as e:
+                results[idx] = invalid_person_result(person_data, e.message)
+                continue
+            person_data["image"] = content
+            person_data["image_hash"] = image_hash
             person_data["image_path"] = image_path
+            valid.append(idx)
         
-        # Bulk register all persons
-        results = await register_persons(persons, person_service)
+        # Bulk register the valid persons, then write the images of the registered ones after the response is sent
+        if valid:
+            for idx, result in zip(valid, await register_persons([persons[idx] for idx in valid], person_service, detection)):
+                results[idx] = result
+        registered = [idx for idx, result in enumerate(results) if result["status"] in REGISTERED_STATUSES]
+        background_tasks.add_task(write_files, [image_paths[idx] for idx in registered], [contents[idx] for idx in registered])
         
+        successful = sum(1 for result in results if result["status"] in REGISTERED_STATUSES)
+        annotate_request(total=len(results), successful=successful)
         return JSONResponse({
             "status": "completed",
             "total": len(results),
-            "successful": len(results),
-            "failed": 0,
+            "successful": successful,
+            "failed": len(results) - successful,
             "results": results
         })
         
     except json.JSONDecodeError:
         raise ImageSearchException("Format JSON untuk persons_data tidak valid")
+    except ImageSearchException:
+        raise
     except Exception as e:
         logger.error(f"Bulk registration error: {str(e)}")
         raise HTTPException(status_code=500, detail="Internal server error")
 
+class RequestStreamingResponse(StreamingResponse):
+    """
+    StreamingResponse whose body generator may keep reading the request body.
+    Starlette's StreamingResponse can listen for client disconnects by reading
+    from receive, which would swallow request body chunks the generator needs.
+    """
+    async def __call__(self, scope, receive, send):
+        await self.stream_response(send)
+        if self.background is not None:
+            await self.background()
+
+# Detection option form fields of the streaming endpoint and their parsers
+DETECTION_FIELDS = {
+    "detector_backend": str,
+    "align": lambda value: value.lower() in ("1", "true", "yes", "on"),
+    "enforce_detection": lambda value: value.lower() in ("1", "true", "yes", "on"),
+    "max_detection_size": int
+}
+
+def ndjson_line(item: dict) -> bytes:
+    return (json.dumps(item) + "\n").encode("utf-8")
+
+async def stream_bulk_registration(request: Request):
+    """
+    Register persons from a multipart body while it is still being uploaded.
+    Persons are registered in chunks of BULK_CHUNK_SIZE and one NDJSON line is
+    yielded per person (success, no_face, duplicate or error), followed by a
+    summary line. Only the current chunk's images are held in memory.
+    """
+    parser = MultipartStream(request.headers.get("content-type", ""), settings.MAX_FILE_SIZE, settings.MAX_FORM_FIELD_SIZE)
+    persons = None
+    detection = {}
+    position = 0
+    seen_ids = set()
+    chunk = []
+    counts = {}
+    pending_writes = None
+    # Large loads can run with the index in ingest mode (see ELASTICSEARCH_INGEST_MODE)
+    ingest = person_repo.ingest_mode() if settings.ELASTICSEARCH_INGEST_MODE else nullcontext()
+
+    async def flush(chunk):
+        # Register one chunk; its images are written while the next chunk is processed
+        nonlocal pending_writes
+        results = await register_persons([person_data for _, person_data in chunk], person_service, detection_options(**detection))
+        if pending_writes:
+            await pending_writes
+        pending_writes = asyncio.create_task(write_files(
+            [person_data["image_path"] for (_, person_data), result in zip(chunk, results) if result["status"] in REGISTERED_STATUSES],
+            [person_data["image"] for (_, person_data), result in zip(chunk, results) if result["status"] in REGISTERED_STATUSES]
+        ))
+        return [{"index": idx, **result} for (idx, _), result in zip(chunk, results)]
+
+    def item_result(idx: int, status: str, message: str, person_data: Optional[dict] = None) -> dict:
+        counts[status] = counts.get(status, 0) + 1
+        person_data = person_data if isinstance(person_data, dict) else {}
+        return {
+            "index": idx,
+            "status": status,
+            "message": message,
+            "data": {
+                "full_name": person_data.get("full_name"),
+                "national_id_number": person_data.get("national_id_number")
+            }
+        }
+
+    try:
+        async def parts():
+            async for data in request.stream():
+                for part in parser.feed(data):
+                    yield part
+            for part in parser.finish():
+                yield part
+
+        async with ingest:
+            async for part in parts():
+                if part["filename"] is None and part["too_large"]:
+                    raise ImageSearchException(f"{part['name']} too large: form fields are limited to {settings.MAX_FORM_FIELD_SIZE} bytes")
+                if part["name"] == "persons_data":
+                    persons = json.loads(part["content"])
+                    if not isinstance(persons, list):
+                        raise ImageSearchException("persons_data harus berupa array")
+                    continue
+                if part["name"] in DETECTION_FIELDS:
+                    try:
+                        detection[part["name"]] = DETECTION_FIELDS[part["name"]](part["content"].decode("utf-8"))
+                    except ValueError:
+                        raise ImageSearchException(f"Invalid value for {part['name']}")
+                    # Fail before any image is processed
+                    detection_options(**detection)
+                    continue
+                if part["name"] != "files":
+                    continue
+                if persons is None:
+                    raise ImageSearchException("persons_data must be sent before the files")
+
+                idx = position
+                position += 1
+                if idx >= len(persons):
+                    yield ndjson_line(item_result(idx, "error", "No person data for this file"))
+                    continue
+
+                person_data = persons[idx]
+                try:
+                    validate_image_upload(part["filename"], part["size"])
+                    validate_person_data(person_data)
+                except ImageSearchException as e:
+                    yield ndjson_line(item_result(idx, "error", e.message, person_data))
+                    continue
+
+                national_id_number = person_data.get("national_id_number")
+                if national_id_number in seen_ids:
+                    yield ndjson_line(item_result(idx, "duplicate", "Duplicate national_id_number in this batch", person_data))
+                    continue
+                seen_ids.add(national_id_number)
+
+                content, filename = await normalize_upload(part["content"], part["filename"])
+                person_data["image"] = content
+                person_data["image_hash"] = content_hash(content)
+                person_data["image_path"] = image_store.path_for(content, filename, person_data["image_hash"])
+                chunk.append((idx, person_data))
+                if len(chunk) >= settings.BULK_CHUNK_SIZE:
+                    for result in await flush(chunk):
+                        counts[result["status"]] = counts.get(result["status"], 0) + 1
+                        yield ndjson_line(result)
+                    chunk = []
+
+            if chunk:
+                for result in await flush(chunk):
+                    counts[result["status"]] = counts.get(result["status"], 0) + 1
+                    yield ndjson_line(result)
+
+            if persons is not None and position < len(persons):
+                for idx in range(position, len(persons)):
+                    yield ndjson_line(item_result(idx, "error", "No image file for this person", persons[idx]))
+
+            if pending_writes:
+                await pending_writes
+
+        total = sum(counts.values())
+        successful = sum(counts.get(status, 0) for status in REGISTERED_STATUSES)
+        annotate_request(total=total, successful=successful)
+        yield ndjson_line({
+            "status": "completed",
+            "total": total,
+            "successful": successful,
+            "failed": total - successful,
+            "counts": counts
+        })
+    except ImageSearchException as e:
+        yield ndjson_line({"status": "aborted", "error": e.message})
+    except json.JSONDecodeError:
+        yield ndjson_line({"status": "aborted", "error": "Format JSON untuk persons_data tidak valid"})
+    except Exception as e:
+        logger.error(f"Streaming bulk registration error: {str(e)}", exc_info=True)
+        yield ndjson_line({"status": "aborted", "error": "Internal server error"})
+
+@app.post("/register-bulk/stream/")
+async def register_bulk_persons_stream(request: Request):
+    """
+    Register many persons from a streamed multipart upload.
+    
+    The body has the same fields as /register-bulk/ (persons_data and any
+    detection options first, then the files in the same order). Results are streamed back as NDJSON, one
+    line per person as soon as its chunk is registered, then a summary line.
+    
+    Returns:
+        StreamingResponse: application/x-ndjson stream of per-person results
+    """
+    if not request.headers.get("content-type", "").startswith("multipart/form-data"):
+        raise ImageSearchException("Expected a multipart/form-data body")
+    return RequestStreamingResponse(stream_bulk_registration(request), media_type="application/x-ndjson")
+
+def person_match(match: dict) -> dict:
+    """Response data of a matched person: the requested fields, image URL and score."""
+    data = {}
+    person = match["person"]
+    if "image_path" in person:
+        data["image_url"] = f"http://{server_ip}:8000/images/{image_store.url_path(person['image_path'])}"
+    data.update((field, value) for field, value in person.items() if field != "image_path")
+    data["score"] = match["score"]
+    return data
+
 @app.post("/search/")
-async def search_person(image: UploadFile = File(...)):
+async def search_person(
+    background_tasks: BackgroundTasks,
+    image: UploadFile = File(...),
+    detector_backend: Optional[str] = Form(None),
+    align: Optional[bool] = Form(None),
+    enforce_detection: Optional[bool] = Form(None),
+    max_detection_size: Optional[int] = Form(None),
+    k: Optional[int] = Form(None),
+    num_candidates: Optional[int] = Form(None),
+    fields: Optional[str] = Form(None)
+):
     """
     Search for a person using facial recognition.
     
     Args:
         image: Image file to search with
+        detector_backend, align, enforce_detection, max_detection_size:
+            Face detection options, as for /register/
+        k: Number of nearest neighbours to consider (up to ELASTICSEARCH_MAX_SEARCH_SIZE)
+        num_candidates: kNN candidates per shard; more is slower but finds more
+        fields: Comma separated person fields to return (default: all)
         
     Returns:
         dict: Search results with matching persons
     """
-    temp_path = None
     try:
-        # Validate image
+        # Validate image and detection options
         validate_image_file(image)
+        detection = detection_options(detector_backend, align, enforce_detection, max_detection_size)
+        search = search_options(k, num_candidates, fields)
         
-        # Save temporary image for processing
-        temp_path = await save_upload_file(image, settings.DATASET_LOST_FOLDER)
-        try:
-            # Perform search
-            results = await search_by_image(temp_path, person_service)
-            print("ini results",results)
-            if results.get("status") == "success" and results.get("data"):
-                data = results["data"]['hits']['hits'][0]
-                print("ini result" , data)
-                score = data['_score']
-                source_data = data['_source']
-                image_path = source_data.get("image_path", "")
-                
-                # Create response with image URL
+        # Search straight from memory; probes are only kept on disk when configured
+        content = await read_upload_file(image)
+        if settings.SEARCH_SAVE_PROBES:
+            background_tasks.add_task(write_file, probe_store.path_for(content, image.filename), content)
+        
+        # Perform search
+        results = await search_by_image(content, person_service, detection, search)
+        if results.get("status") == "success" and results.get("data"):
+            with track_stage("response_build"):
+                data = person_match(results["data"][0])
                 response = {
                     "status": "success",
                     "message": "Person found",
-                    "data": {
-                        "image_url": f"http://{server_ip}:8000/images/{os.path.basename(image_path)}",
-                        "full_name": source_data.get("full_name"),
-                        "birth_place": source_data.get("birth_place"),
-                        "birth_date": source_data.get("birth_date"),
-                        "address": source_data.get("address"),
-                        "nationality": source_data.get("nationality"),
-                        "passport_number": source_data.get("passport_number"),
-                        "gender": source_data.get("gender"),
-                        "national_id_number": source_data.get("national_id_number"),
-                        "marital_status": source_data.get("marital_status"),
-                        "score": score
-                    }
+                    "data": data
                 }
-                
-                logger.info(f"Successfully performed search with image: {image.filename}")
-                return response
-            else:
-                return {"status": "not_found", "message": "Person not found"}
-                
-        finally:
-            # Clean up temporary file
-            if os.path.exists(temp_path):
-                print (temp_path)
-                # os.remove(temp_path)
-                
+            
+            detail_logger.info(f"Successfully performed search with image: {image.filename}")
+            annotate_request(outcome="found", score=data["score"])
+            return response
+        else:
+            annotate_request(outcome="not_found")
+            return {"status": "not_found", "message": "Person not found"}
+            
     except ImageSearchException as e:
         raise
     except Exception as e:
         logger.error(f"Error in search_person: {str(e)}")
         raise HTTPException(status_code=500, detail=f"{str(e)}")
+
+@app.post("/search/faces/")
+async def search_faces(
+    image: UploadFile = File(...),
+    detector_backend: Optional[str] = Form(None),
+    align: Optional[bool] = Form(None),
+    enforce_detection: Optional[bool] = Form(None),
+    max_detection_size: Optional[int] = Form(None),
+    k: Optional[int] = Form(None),
+    num_candidates: Optional[int] = Form(None),
+    fields: Optional[str] = Form(None)
+):
+    """
+    Search for every face in an image, e.g. a group photo.
+    
+    Faces are detected once, embedded as one batch and searched with one
+    _msearch; at most SEARCH_MAX_FACES faces are searched, largest first.
+    
+    Args:
+        image: Image file to search with
+        detector_backend, align, enforce_detection, max_detection_size:
+            Face detection options, as for /register/
+        k, num_candidates, fields: Search options, as for /search/
+        
+    Returns:
+        dict: One result per face with its bounding box (x, y, w, h in image pixels)
+    """
+    try:
+        validate_image_file(image)
+        detection = detection_options(detector_backend, align, enforce_detection, max_detection_size)
+        search = search_options(k, num_candidates, fields)
+        content = await read_upload_file(image)
+        
+        faces = await search_faces_by_image(content, person_service, detection, search)
+        with track_stage("response_build"):
+            results = []
+            for idx, face in enumerate(faces):
+                result = face["result"]
+                entry = {"face_index": idx, "facial_area": face["facial_area"], "confidence": face["confidence"]}
+                if result.get("status") == "error":
+                    entry.update(status="error", message=result["message"])
+                elif result.get("status") == "not_found":
+                    entry.update(status="not_found", message="Person not found")
+                else:
+                    entry.update(status="success", message="Person found", data=person_match(result["matches"][0]))
+                results.append(entry)
+        
+        found = sum(1 for entry in results if entry["status"] == "success")
+        annotate_request(faces=len(results), found=found)
+        return {
+            "status": "success" if found else "not_found",
+            "message": f"{found} of {len(results)} faces matched" if results else "No face found",
+            "faces": results
+        }
+            
+    except ImageSearchException as e:
+        raise
+    except Exception as e:
+        logger.error(f"Error in search_faces: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"{str(e)}")
+
+def search_item(idx: int, filename: str, result: dict) -> dict:
+    """Response entry of one image of a bulk search."""
+    entry = {"index": idx, "filename": filename}
+    if result.get("status") == "error":
+        entry.update(status="error", message=result["message"])
+    elif result.get("status") == "not_found":
+        entry.update(status="not_found", message="Person not found")
+    else:
+        entry.update(status="success", message="Person found", data=person_match(result["matches"][0]))
+    return entry
+
+@app.post("/search-bulk/")
+async def search_bulk(
+    background_tasks: BackgroundTasks,
+    files: List[UploadFile] = File(...),
+    detector_backend: Optional[str] = Form(None),
+    align: Optional[bool] = Form(None),
+    enforce_detection: Optional[bool] = Form(None),
+    max_detection_size: Optional[int] = Form(None),
+    k: Optional[int] = Form(None),
+    num_candidates: Optional[int] = Form(None),
+    fields: Optional[str] = Form(None),
+    stream: bool = Form(False)
+):
+    """
+    Search for a person for each of many images, e.g. a folder of probe photos.
+    
+    The images are embedded in batches and all kNN queries are sent with one
+    _msearch. With stream, results are sent as NDJSON, chunk by chunk
+    (SEARCH_BULK_CHUNK_SIZE images) as each chunk completes, then a summary line.
+    
+    Args:
+        files: Image files to search with (up to SEARCH_BULK_MAX_IMAGES)
+        detector_backend, align, enforce_detection, max_detection_size:
+            Face detection options for all images, as for /register/
+        k, num_candidates, fields: Search options, as for /search/
+        stream: Stream the results as NDJSON
+        
+    Returns:
+        dict: One result per image, in input order
+    """
+    try:
+        if len(files) > settings.SEARCH_BULK_MAX_IMAGES:
+            raise ImageSearchException(f"At most {settings.SEARCH_BULK_MAX_IMAGES} images can be searched per request")
+        detection = detection_options(detector_backend, align, enforce_detection, max_detection_size)
+        search = search_options(k, num_candidates, fields)
+        
+        # Invalid files get an error entry; the rest are searched
+        errors = {}
+        for idx, image in enumerate(files):
+            try:
+                validate_image_file(image)
+            except ImageSearchException as e:
+                errors[idx] = {"status": "error", "message": e.message}
+        valid = [idx for idx in range(len(files)) if idx not in errors]
+        contents = await asyncio.gather(*[read_upload_file(files[idx]) for idx in valid])
+        if settings.SEARCH_SAVE_PROBES:
+            background_tasks.add_task(write_files, [probe_store.path_for(content, files[idx].filename) for idx, content in zip(valid, contents)], contents)
+        
+        async def search_chunk(start: int, end: int) -> dict:
+            # Results of the valid files valid[start:end], keyed by file index
+            results = await search_by_images(contents[start:end], person_service, detection, search)
+            return dict(zip(valid[start:end], results))
+        
+        if not stream:
+            results = {**errors, **await search_chunk(0, len(valid))}
+            with track_stage("response_build"):
+                entries = [search_item(idx, image.filename, results[idx]) for idx, image in enumerate(files)]
+            found = sum(1 for entry in entries if entry["status"] == "success")
+            annotate_request(total=len(entries), found=found)
+            return {
+                "status": "success" if found else "not_found",
+                "message": f"{found} of {len(entries)} images matched",
+                "total": len(entries),
+                "found": found,
+                "results": entries
+            }
+        
+        async def lines():
+            # Chunks are searched concurrently and sent in input order as they complete
+            chunk_size = settings.SEARCH_BULK_CHUNK_SIZE
+            starts = list(range(0, len(valid), chunk_size))
+            tasks = [asyncio.create_task(search_chunk(start, start + chunk_size)) for start in starts]
+            counts = {}
+            sent = 0
+            try:
+                for start, task in zip(starts or [0], tasks or [None]):
+                    results = await task if task else {}
+                    # This chunk and the invalid files up to the next chunk
+                    end = valid[start + chunk_size] if start + chunk_size < len(valid) else len(files)
+                    for idx in range(sent, end):
+                        entry = search_item(idx, files[idx].filename, errors.get(idx) or results[idx])
+                        counts[entry["status"]] = counts.get(entry["status"], 0) + 1
+                        yield ndjson_line(entry)
+                    sent = end
+            except Exception as e:
+                logger.error(f"Error in search_bulk stream: {str(e)}", exc_info=True)
+                yield ndjson_line({"status": "aborted", "error": "Internal server error"})
+                return
+            finally:
+                for task in tasks:
+                    task.cancel()
+            annotate_request(total=len(files), found=counts.get("success", 0))
+            yield ndjson_line({"status": "completed", "total": len(files), "found": counts.get("success", 0), "counts": counts})
+        
+        return StreamingResponse(lines(), media_type="application/x-ndjson")
+            
+    except ImageSearchException as e:
+        raise
+    except Exception as e:
+        logger.error(f"Error in search_bulk: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"{str(e)}")
+
+@app.post("/search/video/")
+async def search_video_file(
+    video_path: str = Form(...),
+    frame_stride: Optional[int] = Form(None),
+    detector_backend: Optional[str] = Form(None),
+    align: Optional[bool] = Form(None),
+    max_detection_size: Optional[int] = Form(None),
+    k: Optional[int] = Form(None),
+    num_candidates: Optional[int] = Form(None),
+    fields: Optional[str] = Form(None)
+):
+    """
+    Search for the people appearing in a video file on the server.
+    
+    Faces are detected every frame_stride frames and tracked across frames;
+    only the best frames of each track (VIDEO_FRAMES_PER_TRACK) are embedded,
+    and all of them are searched with _msearch.
+    
+    Args:
+        video_path: Path of the video, relative to VIDEO_ROOT
+        frame_stride: Detect faces in every n-th frame (default VIDEO_FRAME_STRIDE)
+        detector_backend, align, max_detection_size: Face detection options, as for /register/
+        k, num_candidates, fields: Search options, as for /search/
+        
+    Returns:
+        dict: Video details and one result per face track, with the timestamps
+            it appears between and, when found, the best match and the time it was seen
+    """
+    try:
+        if frame_stride is not None and frame_stride < 1:
+            raise ImageSearchException("frame_stride must be at least 1")
+        detection = detection_options(detector_backend, align, True, max_detection_size)
+        if detection["detector_backend"] == "skip":
+            raise ImageSearchException("Video search needs a face detector")
+        search = search_options(k, num_candidates, fields)
+        try:
+            path = resolve_video_path(video_path)
+        except ValueError as e:
+            raise ImageSearchException(str(e))
+        
+        result = await search_video(path, person_service, detection, search, frame_stride)
+        with track_stage("response_build"):
+            tracks = []
+            for track in result["tracks"]:
+                entry = {key: track[key] for key in ("track_id", "start", "end", "detections", "best_frame")}
+                if track["status"] == "error":
+                    entry.update(status="error", message=track["message"])
+                elif track["status"] == "not_found":
+                    entry.update(status="not_found", message="Person not found")
+                else:
+                    match = track["matches"][0]
+                    entry.update(
+                        status="success",
+                        message="Person found",
+                        data={**person_match(match), "timestamp": match["timestamp"], "facial_area": match["facial_area"]}
+                    )
+                tracks.append(entry)
+        
+        found = sum(1 for entry in tracks if entry["status"] == "success")
+        annotate_request(tracks=len(tracks), found=found)
+        return {
+            "status": "success" if found else "not_found",
+            "message": f"{found} of {len(tracks)} face tracks matched" if tracks else "No face found",
+            "video": result["video"],
+            "tracks": tracks
+        }
+            
+    except ImageSearchException as e:
+        raise
+    except Exception as e:
+        logger.error(f"Error in search_video_file: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"{str(e)}")
+
+@app.post("/verify/")
+async def verify_person(
+    image: UploadFile = File(...),
+    national_id_number: str = Form(...),
+    detector_backend: Optional[str] = Form(None),
+    align: Optional[bool] = Form(None),
+    enforce_detection: Optional[bool] = Form(None),
+    max_detection_size: Optional[int] = Form(None),
+    fields: Optional[str] = Form(None)
+):
+    """
+    Verify that an image shows the person registered under a national ID (1:1).
+    
+    The stored embedding of the claimed identity is fetched directly and
+    compared with the probe, which is much cheaper than an open search.
+    
+    Args:
+        image: Image file of the person to verify
+        national_id_number: Claimed identity
+        detector_backend, align, enforce_detection, max_detection_size:
+            Face detection options, as for /register/
+        fields: Comma separated person fields to return with a match (default: all)
+        
+    Returns:
+        dict: match, no_match or not_found, with the score and threshold
+    """
+    try:
+        validate_image_file(image)
+        if not national_id_number.strip():
+            raise ImageSearchException("national_id_number cannot be empty")
+        detection = detection_options(detector_backend, align, enforce_detection, max_detection_size)
+        field_list = search_options(fields=fields)["fields"]
+        content = await read_upload_file(image)
+        
+        result = await verify_by_image(content, national_id_number, person_service, detection, field_list)
+        annotate_request(outcome=result["status"], score=result.get("score"))
+        if result["status"] == "not_found":
+            return {"status": "not_found", "message": "No person registered with this national ID"}
+        
+        with track_stage("response_build"):
+            response = {
+                "status": result["status"],
+                "message": "Identity verified" if result["status"] == "match" else "Face does not match the registered person",
+                "score": result["score"],
+                "threshold": result["threshold"]
+            }
+            if result["status"] == "match":
+                response["data"] = person_match({"person": result["person"], "score": result["score"]})
+        return response
+            
+    except ImageSearchException as e:
+        raise
+    except Exception as e:
+        logger.error(f"Error in verify_person: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"{str(e)}")
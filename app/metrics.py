@@ -0,0 +1,165 @@
+from concurrent.futures import Executor, ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Callable, List, Tuple
+import asyncio
+import threading
+import time
+from prometheus_client import Counter, Gauge, Histogram, CONTENT_TYPE_LATEST, generate_latest
+from starlette.routing import Match
+
+# Stages of the register and search hot paths
+STAGES = (
+    "upload_read", "normalize", "file_save", "decode", "video_decode", "detection", "embedding",
+    "es_query", "es_index", "es_bulk", "vector_search", "vector_add", "response_build"
+)
+
+STAGE_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+STAGE_SECONDS = Histogram(
+    "image_search_stage_seconds",
+    "Time spent in each processing stage",
+    ["stage"],
+    buckets=STAGE_BUCKETS
+)
+for _stage in STAGES:
+    # Export every stage from the start, even before it is first observed
+    STAGE_SECONDS.labels(stage=_stage)
+REQUEST_SECONDS = Histogram(
+    "image_search_request_seconds",
+    "Request latency by route",
+    ["method", "route"],
+    buckets=STAGE_BUCKETS
+)
+REQUESTS_TOTAL = Counter(
+    "image_search_requests_total",
+    "Requests by route and status code",
+    ["method", "route", "status"]
+)
+REQUESTS_IN_FLIGHT = Gauge(
+    "image_search_requests_in_flight",
+    "Requests currently being handled"
+)
+EXECUTOR_QUEUE_DEPTH = Gauge(
+    "image_search_executor_queue_depth",
+    "Embedding tasks waiting for a free executor worker"
+)
+EXECUTOR_TASKS_PENDING = Gauge(
+    "image_search_executor_tasks_pending",
+    "Embedding tasks submitted and not finished (queued or running)"
+)
+EXECUTOR_QUEUE_WAIT_SECONDS = Histogram(
+    "image_search_executor_queue_wait_seconds",
+    "Time embedding tasks wait for an executor worker",
+    buckets=STAGE_BUCKETS
+)
+
+# Set while an executor task runs, so the stages it times are sent back with its result
+_task_local = threading.local()
+
+def observe_stage(stage: str, seconds: float) -> None:
+    """Record the duration of one stage."""
+    timings = getattr(_task_local, "timings", None)
+    if timings is not None:
+        timings.append((stage, seconds))
+    else:
+        STAGE_SECONDS.labels(stage=stage).observe(seconds)
+
+@contextmanager
+def track_stage(stage: str):
+    """Time the enclosed block as the given stage."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - start)
+
+def call_with_stage_timings(func: Callable, *args) -> Tuple[object, List[Tuple[str, float]], float]:
+    """
+    Executor task wrapper: run func and return its result together with the
+    stage timings recorded while it ran and the wall clock time it started.
+    Worker processes have their own metric registry, so the timings are
+    returned to the parent instead of being observed where they are measured.
+    """
+    started = time.time()
+    _task_local.timings = []
+    try:
+        return func(*args), _task_local.timings, started
+    finally:
+        _task_local.timings = None
+
+async def run_in_executor(executor: Executor, func: Callable, *args):
+    """
+    Run func in the executor, recording queue wait, pending tasks and the
+    stages timed inside the task.
+    """
+    loop = asyncio.get_running_loop()
+    submitted = time.time()
+    EXECUTOR_TASKS_PENDING.inc()
+    try:
+        result, timings, started = await loop.run_in_executor(executor, call_with_stage_timings, func, *args)
+    finally:
+        EXECUTOR_TASKS_PENDING.dec()
+
+    EXECUTOR_QUEUE_WAIT_SECONDS.observe(max(0.0, started - submitted))
+    for stage, seconds in timings:
+        STAGE_SECONDS.labels(stage=stage).observe(seconds)
+    return result
+
+def executor_queue_depth(executor: Executor) -> int:
+    """Number of tasks waiting for a worker, read from the executor's own queue."""
+    if isinstance(executor, ThreadPoolExecutor):
+        return executor._work_queue.qsize()
+    # Process pools keep every submitted, unfinished task in _pending_work_items
+    pending = len(getattr(executor, "_pending_work_items", {}))
+    return max(0, pending - getattr(executor, "_max_workers", 0))
+
+def track_executor(executor: Executor) -> None:
+    """Report the queue depth of the executor on every scrape."""
+    EXECUTOR_QUEUE_DEPTH.set_function(lambda: executor_queue_depth(executor))
+
+def render_metrics() -> Tuple[bytes, str]:
+    """Current metrics in the Prometheus text format, with its content type."""
+    return generate_latest(), CONTENT_TYPE_LATEST
+
+def route_path(scope) -> str:
+    """Template of the route a request matches (e.g. /images for any static file)."""
+    for route in scope["app"].routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return route.path
+    return "unmatched"
+
+class MetricsMiddleware:
+    """
+    ASGI middleware counting requests, in-flight requests and latency per route.
+    Requests are labelled with the route template (e.g. /search/), not the raw
+    path, so the number of series stays bounded. Implemented as plain ASGI
+    rather than BaseHTTPMiddleware so streaming endpoints are not buffered.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        route = route_path(scope)
+        method = scope["method"]
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        REQUESTS_IN_FLIGHT.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            REQUESTS_IN_FLIGHT.dec()
+            REQUEST_SECONDS.labels(method=method, route=route).observe(time.perf_counter() - start)
+            REQUESTS_TOTAL.labels(method=method, route=route, status=str(status)).inc()
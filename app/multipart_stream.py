@@ -0,0 +1,91 @@
+from typing import Dict, List, Optional
+
+try:
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ImportError:
+    from multipart.multipart import MultipartParser, parse_options_header
+
+class MultipartStream:
+    """
+    Incremental multipart/form-data parser.
+    Request body chunks are fed in as they arrive and each part is returned as
+    soon as it is complete, so a large upload never has to be held in memory
+    (or spooled to disk) as a whole. Parts larger than their limit
+    (max_part_size for files, max_field_size for other form fields) are not
+    buffered; they are returned with "too_large" set and no content.
+    """
+
+    def __init__(self, content_type: str, max_part_size: int, max_field_size: Optional[int] = None):
+        _, params = parse_options_header(content_type)
+        boundary = params.get(b"boundary")
+        if not boundary:
+            raise ValueError("Missing multipart boundary")
+
+        self.max_part_size = max_part_size
+        self.max_field_size = max_field_size if max_field_size is not None else max_part_size
+        self._completed: List[Dict] = []
+        self._part: Optional[Dict] = None
+        self._chunks: List[bytes] = []
+        self._header_field = b""
+        self._header_value = b""
+        self._parser = MultipartParser(boundary, {
+            "on_part_begin": self._on_part_begin,
+            "on_header_field": self._on_header_field,
+            "on_header_value": self._on_header_value,
+            "on_header_end": self._on_header_end,
+            "on_part_data": self._on_part_data,
+            "on_part_end": self._on_part_end,
+        })
+
+    def feed(self, data: bytes) -> List[Dict]:
+        """
+        Parse the next chunk of the request body.
+        Args:
+            data: Raw body bytes
+        Returns:
+            List[dict]: Parts completed by this chunk, each with name, filename,
+                content, size and too_large
+        """
+        self._parser.write(data)
+        completed, self._completed = self._completed, []
+        return completed
+
+    def finish(self) -> List[Dict]:
+        """Signal the end of the body and return any remaining parts."""
+        self._parser.finalize()
+        completed, self._completed = self._completed, []
+        return completed
+
+    def _on_part_begin(self) -> None:
+        self._part = {"name": None, "filename": None, "content": b"", "size": 0, "too_large": False}
+        self._chunks = []
+
+    def _on_header_field(self, data: bytes, start: int, end: int) -> None:
+        self._header_field += data[start:end]
+
+    def _on_header_value(self, data: bytes, start: int, end: int) -> None:
+        self._header_value += data[start:end]
+
+    def _on_header_end(self) -> None:
+        if self._header_field.lower() == b"content-disposition":
+            _, options = parse_options_header(self._header_value)
+            self._part["name"] = options.get(b"name", b"").decode("utf-8")
+            if b"filename" in options:
+                self._part["filename"] = options[b"filename"].decode("utf-8")
+        self._header_field = b""
+        self._header_value = b""
+
+    def _on_part_data(self, data: bytes, start: int, end: int) -> None:
+        self._part["size"] += end - start
+        limit = self.max_part_size if self._part["filename"] is not None else self.max_field_size
+        if self._part["size"] > limit:
+            self._part["too_large"] = True
+            self._chunks = []
+        else:
+            self._chunks.append(data[start:end])
+
+    def _on_part_end(self) -> None:
+        self._part["content"] = b"".join(self._chunks)
+        self._chunks = []
+        self._completed.append(self._part)
+        self._part = None
@@ -1,15 +1,24 @@
-from deepface import DeepFace
 from PIL import Image
+import hashlib
+import os
 import numpy as np
-from app.logger import logger
+from app.logger import logger, detail_logger
 import asyncio
-from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Union, Optional
+from app.embedding_engine import EmbeddingEngine
+from app.executor import create_executor
+from app.cache import embedding_cache, content_hash
+from app.metrics import run_in_executor
+from app.quantization import encode_embedding
+from app.config import get_settings
+
+settings = get_settings()
 
 class Person:
-    # Thread pool for CPU-intensive tasks
-    _executor = ThreadPoolExecutor(max_workers=3)
+    # Thread or process pool for CPU-intensive tasks (see EMBEDDING_EXECUTOR)
+    _executor = create_executor()
     
-    def __init__(self, image_path=None, full_name=None, birth_place=None, birth_date=None, address=None, nationality=None, passport_number=None, gender=None, national_id_number=None, marital_status=None):
+    def __init__(self, image_path=None, full_name=None, birth_place=None, birth_date=None, address=None, nationality=None, passport_number=None, gender=None, national_id_number=None, marital_status=None, image=None, image_hash=None):
         self.image_path = image_path
         self.full_name = full_name
         self.birth_place = birth_place
@@ -20,51 +29,267 @@ class Person:
         self.gender = gender
         self.national_id_number = national_id_number
         self.marital_status = marital_status
+        # Uploaded image bytes, embedded in memory instead of re-reading image_path
+        self.image = image
+        self._image_hash = image_hash
         self.image_embedding = None
+        # Model and detection options the embedding was made with (see embedding_key)
+        self.embedding_key = None
+
+    @property
+    def image_hash(self) -> Optional[str]:
+        """SHA-256 of the image bytes (the upload, else the stored file), computed once."""
+        if self._image_hash is None:
+            if self.image is not None:
+                self._image_hash = content_hash(self.image)
+            elif self.image_path and os.path.exists(self.image_path):
+                with open(self.image_path, "rb") as f:
+                    self._image_hash = content_hash(f.read())
+        return self._image_hash
+
+    @property
+    def document_id(self) -> str:
+        """Deterministic document id, so registering a person again updates the same document."""
+        return Person.document_id_for(self.national_id_number, self.image_hash)
 
     @staticmethod
-    async def get_embedding(image_path: str, model_name="Facenet") -> np.ndarray:
+    def document_id_for(national_id_number: Optional[str] = None, image_hash: Optional[str] = None) -> Optional[str]:
+        """
+        Document id of a person: derived from the national ID when there is one,
+        else from the image content hash. None when neither is known.
+        """
+        if national_id_number is not None and str(national_id_number).strip():
+            return "nid-" + hashlib.sha256(str(national_id_number).strip().encode("utf-8")).hexdigest()[:32]
+        if image_hash:
+            return f"img-{image_hash}"
+        return None
+
+    @staticmethod
+    def embedding_key_for(model_name: str = settings.EMBEDDING_MODEL_NAME, detection: Dict = None) -> str:
+        """Identifies how an embedding was made; a stored embedding is only reused when it matches."""
+        return f"{model_name}:{EmbeddingEngine.detection_key(detection)}"
+
+    @property
+    def embedding_input(self) -> Union[str, bytes]:
+        """Image to embed: the in-memory upload when available, else the stored file."""
+        return self.image if self.image is not None else self.image_path
+
+    @staticmethod
+    def embedding_cache_key(image, model_name: str, image_hash: str = None, detection: Dict = None) -> Optional[str]:
+        """
+        Embedding cache key for an image, or None when it cannot be cached.
+        Only in-memory uploads are cached; the hash is computed unless given.
+        The detection options are part of the key as they change the embedding.
+        """
+        if not settings.EMBEDDING_CACHE_ENABLED or not isinstance(image, (bytes, bytearray)):
+            return None
+        return f"{model_name}:{EmbeddingEngine.detection_key(detection)}:{image_hash or content_hash(image)}"
+
+    @staticmethod
+    async def get_embedding(image: Union[str, bytes, np.ndarray], model_name=settings.EMBEDDING_MODEL_NAME, image_hash: str = None, detection: Dict = None) -> np.ndarray:
         """
         Generate an embedding vector for the face in the given image.
         Args:
-            image_path: Path to the image file
+            image: Path to the image file, encoded image bytes or BGR image array
             model_name: Name of the model to use for embedding
+            image_hash: Precomputed content hash of the image bytes, if known
+            detection: Detection options (see EmbeddingEngine.detection_options)
         Returns:
             numpy.ndarray: Embedding vector
         """
         try:
-            logger.info(f"Generating embedding for image: {image_path}")
+            detection = detection or EmbeddingEngine.detection_options()
+            cache_key = Person.embedding_cache_key(image, model_name, image_hash, detection)
+            if cache_key:
+                cached = embedding_cache.get(cache_key)
+                if cached is not None:
+                    detail_logger.info("Embedding cache hit")
+                    return cached
+
+            detail_logger.info(f"Generating embedding for image: {Person.describe_image(image)}")
             
-            # Run CPU-intensive task in thread pool
-            loop = asyncio.get_event_loop()
-            embedding_result = await loop.run_in_executor(
+            # Run CPU-intensive task in the embedding executor
+            embedding_result = await run_in_executor(
                 Person._executor,
-                lambda: DeepFace.represent(img_path=image_path, model_name=model_name)
+                EmbeddingEngine.represent,
+                image,
+                model_name,
+                detection
             )
             
             if embedding_result:
                 embedding = embedding_result[0]["embedding"]
                 embedding_array = np.array(embedding)
-                logger.info(f"Successfully generated embedding with shape: {embedding_array.shape}")
+                detail_logger.info(f"Successfully generated embedding with shape: {embedding_array.shape}")
+                if cache_key:
+                    embedding_cache.set(cache_key, embedding_array)
                 return embedding_array
             else:
                 raise ValueError("No embedding found for the given image.")
         except Exception as e:
-            logger.error(f"Error generating embedding for {image_path}: {str(e)}", exc_info=True)
+            logger.error(f"Error generating embedding for {Person.describe_image(image)}: {str(e)}", exc_info=True)
+            raise
+
+    @staticmethod
+    async def get_embeddings(images: List[Union[str, bytes, np.ndarray]], model_name=settings.EMBEDDING_MODEL_NAME, image_hashes: List[str] = None, detection: Dict = None) -> List[Dict]:
+        """
+        Generate embedding vectors for many images with batched inference.
+        Args:
+            images: Image paths, encoded image bytes or BGR image arrays
+            model_name: Name of the model to use for embedding
+            image_hashes: Precomputed content hashes of the images, if known
+            detection: Detection options shared by all images (see EmbeddingEngine.detection_options)
+        Returns:
+            List[dict]: Per-image results from EmbeddingEngine.represent_batch, in input order
+        """
+        try:
+            detail_logger.info(f"Generating embeddings for {len(images)} images")
+            detection = detection or EmbeddingEngine.detection_options()
+
+            # Serve cached embeddings and only run inference for the rest
+            cache_keys, results, pending = Person._cached_embeddings(images, model_name, image_hashes, detection)
+
+            # Each executor task runs one batch so the pool workers share the load
+            batch_size = settings.EMBEDDING_BATCH_SIZE
+            chunks = await asyncio.gather(*[
+                run_in_executor(
+                    Person._executor,
+                    EmbeddingEngine.represent_batch,
+                    [images[idx] for idx in pending[start:start + batch_size]],
+                    model_name,
+                    batch_size,
+                    detection
+                )
+                for start in range(0, len(pending), batch_size)
+            ])
+            for idx, result in zip(pending, [result for chunk in chunks for result in chunk]):
+                results[idx] = result
+                if result["status"] == "success" and cache_keys[idx]:
+                    embedding_cache.set(cache_keys[idx], result["embedding"])
+
+            failed = sum(1 for result in results if result["status"] != "success")
+            detail_logger.info(f"Generated {len(results) - failed} embeddings, {failed} failed")
+            return results
+        except Exception as e:
+            logger.error(f"Error generating batched embeddings: {str(e)}", exc_info=True)
+            raise
+
+    @staticmethod
+    async def get_query_embeddings(images: List[Union[str, bytes, np.ndarray]], model_name=settings.EMBEDDING_MODEL_NAME, image_hashes: List[str] = None, detection: Dict = None) -> List[Dict]:
+        """
+        Generate embedding vectors for a few latency-sensitive images, e.g. coalesced searches.
+        Face detection, the expensive part, runs as one executor task per image
+        so it is spread over all workers; only the forward pass is batched.
+        Args:
+            images: Image paths, encoded image bytes or BGR image arrays
+            model_name: Name of the model to use for embedding
+            image_hashes: Precomputed content hashes of the images, if known
+            detection: Detection options shared by all images (see EmbeddingEngine.detection_options)
+        Returns:
+            List[dict]: Per-image results as from get_embeddings, in input order
+        """
+        try:
+            detection = detection or EmbeddingEngine.detection_options()
+            cache_keys, results, pending = Person._cached_embeddings(images, model_name, image_hashes, detection)
+
+            detected = await asyncio.gather(*[
+                run_in_executor(Person._executor, EmbeddingEngine.detect_input, images[idx], model_name, detection)
+                for idx in pending
+            ], return_exceptions=True)
+            faces, face_indices = [], []
+            for idx, face in zip(pending, detected):
+                if isinstance(face, Exception):
+                    results[idx] = EmbeddingEngine.error_result(face)
+                else:
+                    faces.append(face)
+                    face_indices.append(idx)
+
+            if faces:
+                try:
+                    embeddings = await run_in_executor(Person._executor, EmbeddingEngine.embed_inputs, faces, model_name)
+                    for idx, embedding in zip(face_indices, embeddings):
+                        results[idx] = {"status": "success", "embedding": embedding, "error": None}
+                        if cache_keys[idx]:
+                            embedding_cache.set(cache_keys[idx], embedding)
+                except Exception as e:
+                    logger.error(f"Batched inference failed for {len(faces)} faces: {str(e)}", exc_info=True)
+                    for idx in face_indices:
+                        results[idx] = EmbeddingEngine.error_result(e)
+            return results
+        except Exception as e:
+            logger.error(f"Error generating query embeddings: {str(e)}", exc_info=True)
+            raise
+
+    @staticmethod
+    def _cached_embeddings(images: List, model_name: str, image_hashes: Optional[List[str]], detection: Dict):
+        """
+        Look up cached embeddings of many images.
+        Returns:
+            tuple: Cache keys, results (cache hits filled in, None elsewhere) and the indices still to embed
+        """
+        image_hashes = image_hashes or [None] * len(images)
+        cache_keys = [Person.embedding_cache_key(image, model_name, image_hash, detection) for image, image_hash in zip(images, image_hashes)]
+        results = [None] * len(images)
+        pending = []
+        for idx, cache_key in enumerate(cache_keys):
+            cached = embedding_cache.get(cache_key) if cache_key else None
+            if cached is not None:
+                results[idx] = {"status": "success", "embedding": cached, "error": None}
+            else:
+                pending.append(idx)
+        return cache_keys, results, pending
+
+    @staticmethod
+    async def get_face_embeddings(image: Union[str, bytes, np.ndarray], model_name=settings.EMBEDDING_MODEL_NAME, detection: Dict = None, max_faces: int = None) -> List[Dict]:
+        """
+        Generate embedding vectors for every face in one image.
+        Args:
+            image: Path to the image file, encoded image bytes or BGR image array
+            model_name: Name of the model to use for embedding
+            detection: Detection options (see EmbeddingEngine.detection_options)
+            max_faces: Embed at most this many faces, largest first
+        Returns:
+            List[dict]: One entry per face with embedding, facial_area and confidence
+        """
+        try:
+            detail_logger.info(f"Generating face embeddings for image: {Person.describe_image(image)}")
+            faces = await run_in_executor(
+                Person._executor,
+                EmbeddingEngine.represent_faces,
+                image,
+                model_name,
+                detection or EmbeddingEngine.detection_options(),
+                max_faces
+            )
+            detail_logger.info(f"Generated embeddings for {len(faces)} faces")
+            return faces
+        except Exception as e:
+            logger.error(f"Error generating face embeddings for {Person.describe_image(image)}: {str(e)}", exc_info=True)
             raise
 
-    async def generate_embedding(self, model_name="Facenet") -> None:
+    async def generate_embedding(self, model_name=settings.EMBEDDING_MODEL_NAME, detection: Dict = None) -> None:
         """
         Generate and store the embedding for the current instance.
         Args:
             model_name: Name of the model to use for embedding
+            detection: Detection options (see EmbeddingEngine.detection_options)
         """
         try:
-            self.image_embedding = await self.get_embedding(self.image_path, model_name)
+            self.image_embedding = await self.get_embedding(self.embedding_input, model_name, image_hash=self._image_hash, detection=detection)
+            self.embedding_key = Person.embedding_key_for(model_name, detection)
         except Exception as e:
             logger.error(f"Error generating embedding for person {self.full_name}: {str(e)}", exc_info=True)
             raise
 
+    @staticmethod
+    def describe_image(image) -> str:
+        """Short description of an embedding input for log messages."""
+        if isinstance(image, (bytes, bytearray)):
+            return f"<{len(image)} bytes in memory>"
+        if isinstance(image, np.ndarray):
+            return f"<array {image.shape}>"
+        return str(image)
+
     def __repr__(self):
         return (f"Person(image_path={self.image_path}, "
                 f"full_name={self.full_name})")
@@ -83,7 +308,9 @@ class Person:
                 "gender": self.gender,
                 "national_id_number": self.national_id_number,
                 "marital_status": self.marital_status,
-                "image_embedding": self.image_embedding.tolist() if self.image_embedding is not None else None
+                "image_hash": self.image_hash,
+                "embedding_key": self.embedding_key,
+                **encode_embedding(self.image_embedding, settings.EMBEDDING_STORAGE)
             }
         except Exception as e:
             logger.error(f"Error converting person to dict: {str(e)}", exc_info=True)
@@ -1,115 +1,453 @@
 from typing import List, Dict
+import asyncio
+import uuid
+from contextlib import asynccontextmanager
+import numpy as np
 from elasticsearch import AsyncElasticsearch
+from elasticsearch.helpers import async_streaming_bulk
 from app.util import Util
-from app.logger import logger
+from app.person import Person
+from app.metrics import track_stage
+from app.quantization import EMBEDDING_FIELDS, cosine_similarities, decode_embedding, query_vector
+from app.logger import logger, detail_logger
 from app.config import get_settings
 
 settings = get_settings()
 
 class PersonRepository:
+    # Fields returned with each search hit
+    SEARCH_SOURCE_FIELDS = [
+        "full_name", "birth_place", "birth_date",
+        "address", "nationality", "passport_number",
+        "gender", "national_id_number", "marital_status", "image_path"
+    ]
+    # Only the parts of kNN responses that are used are sent back
+    SEARCH_FILTER_PATH = ["hits.hits._id", "hits.hits._score", "hits.hits._source"]
+    # Every msearch response keeps its status, so empty ones stay in position
+    MSEARCH_FILTER_PATH = [f"responses.{path}" for path in SEARCH_FILTER_PATH] + ["responses.status", "responses.error"]
+    # How far below the threshold quantised kNN scores may fall and still be re-scored
+    RESCORE_SIMILARITY_MARGIN = 0.02
+
     def __init__(self, es_client: AsyncElasticsearch, index_name: str):
         self.es_client = es_client
         self._index_name = index_name
-        # Panggil setup index saat inisialisasi
-        self._setup_index()
+        # Byte vectors are searched with a quantised query, so hits are re-scored with the float one
+        self._rescore = settings.EMBEDDING_STORAGE == "int8"
+        # Bulk loads sharing the ingest mode window (see ingest_mode)
+        self._ingest_lock = asyncio.Lock()
+        self._ingest_loads = 0
+
+    @staticmethod
+    def search_options(k: int = None, num_candidates: int = None, fields: List[str] = None) -> Dict:
+        """
+        kNN search options, with the Settings defaults for anything not given.
+        Args:
+            k: Number of matches to return
+            num_candidates: Candidates considered per shard; trades latency for recall
+            fields: Person fields to return, a subset of SEARCH_SOURCE_FIELDS
+        Returns:
+            dict: k, num_candidates and fields
+        """
+        if k is None:
+            k = settings.ELASTICSEARCH_SEARCH_SIZE
+        if num_candidates is None:
+            num_candidates = max(settings.ELASTICSEARCH_NUM_CANDIDATES, k)
+        if not 1 <= k <= settings.ELASTICSEARCH_MAX_SEARCH_SIZE:
+            raise ValueError(f"k must be between 1 and {settings.ELASTICSEARCH_MAX_SEARCH_SIZE}")
+        if not k <= num_candidates <= settings.ELASTICSEARCH_MAX_NUM_CANDIDATES:
+            raise ValueError(f"num_candidates must be between k and {settings.ELASTICSEARCH_MAX_NUM_CANDIDATES}")
+
+        fields = list(fields) if fields else list(PersonRepository.SEARCH_SOURCE_FIELDS)
+        unknown = [field for field in fields if field not in PersonRepository.SEARCH_SOURCE_FIELDS]
+        if unknown:
+            raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+        return {"k": k, "num_candidates": num_candidates, "fields": fields}
+
+    @staticmethod
+    def search_key(search: Dict = None) -> str:
+        """Short string identifying search options, for cache keys and grouping."""
+        search = search or PersonRepository.search_options()
+        return f"{search['k']}:{search['num_candidates']}:{','.join(search['fields'])}"
 
-    def _setup_index(self):
+    async def setup_index(self):
         """Setup Elasticsearch index with proper mappings."""
         try:
-            # Gunakan client yang sama
-            es = Util.get_connection()
-            Util.create_index(es, self._index_name)
+            await Util.create_index(self.es_client, self._index_name)
         except Exception as e:
             logger.error(f"Error setting up index: {str(e)}", exc_info=True)
             raise
 
-    async def insert(self, person) -> None:
+    @asynccontextmanager
+    async def ingest_mode(self):
+        """
+        Keep the index in ingest mode (refresh off, no replicas) while the block runs.
+        Overlapping bulk loads share one window: the first switches the index
+        over, the last restores it and starts the force-merge. The loads are
+        counted per process, so with several workers one worker's load can end
+        ingest mode while another's is still running.
+        """
+        async with self._ingest_lock:
+            self._ingest_loads += 1
+            if self._ingest_loads == 1:
+                try:
+                    await Util.begin_ingest(self.es_client, self._index_name)
+                except Exception:
+                    self._ingest_loads -= 1
+                    raise
+        try:
+            yield
+        finally:
+            async with self._ingest_lock:
+                self._ingest_loads -= 1
+                if self._ingest_loads == 0:
+                    try:
+                        await Util.end_ingest(self.es_client, self._index_name)
+                    except Exception as e:
+                        logger.error(f"Error restoring index from ingest mode: {str(e)}", exc_info=True)
+
+    async def insert(self, person, detection: Dict = None) -> Dict:
         """
-        Insert a single person document into Elasticsearch.
+        Create or update a single person document in Elasticsearch.
+        The document id is derived from the person (see Person.document_id), so
+        registering the same person again replaces the document. When the
+        stored image hash is unchanged the stored embedding is reused.
         Args:
             person: Person object to insert.
+            detection: Face detection options for the embedding.
+        Returns:
+            dict: Outcome with status (success, or unchanged when the embedding was reused).
         """
         try:
-            await person.generate_embedding()
+            reused = (await self._reuse_stored_embeddings([person], detection))[0]
+            if not reused:
+                await person.generate_embedding(detection=detection)
             document = person.to_dict()
             
-            # Gunakan client yang sama
-            es = Util.get_connection()
-            response = es.index(index=self._index_name, document=document)
-            logger.info(f"Successfully inserted person: {person.full_name} with response: {response}")
+            await self._index_document(document, person.document_id)
+            detail_logger.info(f"Successfully inserted person: {person.full_name}")
+            return {"status": "unchanged" if reused else "success", "error": None}
         except Exception as e:
             logger.error(f"Error inserting person: {str(e)}", exc_info=True)
             raise
 
-    async def bulk_insert(self, persons: List) -> None:
+    async def bulk_insert(self, persons: List, detection: Dict = None) -> List[Dict]:
         """
-        Insert multiple person documents in bulk.
+        Create or update multiple person documents in bulk.
+        Embeddings are generated in batches, except for persons whose stored
+        image hash is unchanged; persons whose image fails are reported instead
+        of failing the whole batch.
         Args:
             persons: List of Person objects to insert.
+            detection: Face detection options for the embeddings.
+        Returns:
+            List[dict]: One outcome per person, in input order, with status and error.
         """
         try:
-            operations = []
-            for person in persons:
-                await person.generate_embedding()
-                operations.append({"index": {"_index": self._index_name}})
-                operations.append(person.to_dict())
-
-            # Gunakan client yang sama
-            es = Util.get_connection()
-            response = es.bulk(body=operations)
-            if response.get('errors', False):
-                logger.error("Bulk insert encountered errors.")
-                raise Exception("Some documents failed during bulk insert.")
-            
-            logger.info(f"Successfully bulk inserted {len(persons)} persons")
+            reused = await self._reuse_stored_embeddings(persons, detection)
+            to_embed = [idx for idx, person_reused in enumerate(reused) if not person_reused]
+            embeddings = await Person.get_embeddings(
+                [persons[idx].embedding_input for idx in to_embed],
+                image_hashes=[persons[idx].image_hash for idx in to_embed],
+                detection=detection
+            )
+
+            outcomes = [{"status": "unchanged", "error": None} for _ in persons]
+            for idx, result in zip(to_embed, embeddings):
+                outcomes[idx] = {"status": result["status"], "error": result["error"]}
+                if result["status"] == "success":
+                    persons[idx].image_embedding = result["embedding"]
+                    persons[idx].embedding_key = Person.embedding_key_for(detection=detection)
+
+            indexed = [idx for idx, outcome in enumerate(outcomes) if outcome["status"] in ("success", "unchanged")]
+            if indexed:
+                documents = [persons[idx].to_dict() for idx in indexed]
+                ids = [persons[idx].document_id for idx in indexed]
+                for idx, outcome in zip(indexed, await self._index_documents(documents, ids)):
+                    if outcome["status"] != "success" or outcomes[idx]["status"] != "unchanged":
+                        outcomes[idx] = outcome
+
+            successful = sum(1 for outcome in outcomes if outcome["status"] in ("success", "unchanged"))
+            detail_logger.info(f"Successfully bulk inserted {successful} of {len(persons)} persons")
+            return outcomes
         except Exception as e:
             logger.error(f"Error in bulk insert: {str(e)}", exc_info=True)
             raise
 
-    async def search_by_image(self, image_embedding: List[float]) -> Dict:
+    async def _reuse_stored_embeddings(self, persons: List, detection: Dict = None) -> List[bool]:
+        """
+        Give persons whose document is stored with the same image hash and
+        embedding options the stored embedding, so they are not embedded again.
+        Returns:
+            List[bool]: Whether each person's embedding was reused.
+        """
+        ids = [person.document_id for person in persons]
+        stored = await self._get_stored_embeddings([doc_id for doc_id in ids if doc_id])
+        embedding_key = Person.embedding_key_for(detection=detection)
+
+        reused = []
+        for person, doc_id in zip(persons, ids):
+            source = stored.get(doc_id)
+            if (source and source.get("image_embedding") is not None and source.get("embedding_key") == embedding_key
+                    and source.get("image_hash") == person.image_hash):
+                person.image_embedding = decode_embedding(source)
+                person.embedding_key = embedding_key
+                reused.append(True)
+            else:
+                reused.append(False)
+        if any(reused):
+            detail_logger.info(f"Reusing {sum(reused)} stored embeddings of unchanged images")
+        return reused
+
+    async def _get_stored_embeddings(self, ids: List[str]) -> Dict[str, Dict]:
+        """Image hash, embedding key and stored embedding fields of the documents that exist, by id."""
+        if not ids:
+            return {}
+        with track_stage("es_query"):
+            response = await self.es_client.mget(
+                index=self._index_name,
+                ids=ids,
+                source=["image_hash", "embedding_key", *EMBEDDING_FIELDS]
+            )
+        return {doc["_id"]: doc["_source"] for doc in response["docs"] if doc.get("found")}
+
+    async def _index_document(self, document: Dict, doc_id: str = None) -> Dict:
+        """Index one document in Elasticsearch."""
+        with track_stage("es_index"):
+            return await self.es_client.index(index=self._index_name, id=doc_id, document=document)
+
+    async def _index_documents(self, documents: List[Dict], ids: List[str] = None) -> List[Dict]:
+        """
+        Index many documents in Elasticsearch.
+        Documents are streamed in chunks bounded by ELASTICSEARCH_BULK_CHUNK_SIZE
+        documents and ELASTICSEARCH_BULK_MAX_BYTES, with up to
+        ELASTICSEARCH_BULK_CONCURRENCY bulk requests in flight. Rejected (429)
+        items are retried with exponential backoff; other failures are reported
+        per document instead of failing the whole batch.
+        Returns:
+            List[dict]: One outcome per document, in input order, with status and error.
+        """
+        # Results come back out of order when items are retried, so match them by _id
+        ids = [doc_id or uuid.uuid4().hex for doc_id in (ids or [None] * len(documents))]
+        positions = {}
+        for position, doc_id in enumerate(ids):
+            positions.setdefault(doc_id, []).append(position)
+
+        outcomes = [{"status": "error", "error": "Bulk request failed"} for _ in documents]
+        pending = iter(range(len(documents)))
+
+        async def actions():
+            # Every worker pulls from the same iterator, so each document is sent once
+            for position in pending:
+                yield {
+                    "_op_type": "index",
+                    "_index": self._index_name,
+                    "_id": ids[position],
+                    "_source": documents[position]
+                }
+
+        async def worker():
+            try:
+                async for ok, info in async_streaming_bulk(
+                    self.es_client,
+                    actions(),
+                    chunk_size=settings.ELASTICSEARCH_BULK_CHUNK_SIZE,
+                    max_chunk_bytes=settings.ELASTICSEARCH_BULK_MAX_BYTES,
+                    max_retries=settings.ELASTICSEARCH_BULK_MAX_RETRIES,
+                    initial_backoff=settings.ELASTICSEARCH_BULK_INITIAL_BACKOFF,
+                    max_backoff=settings.ELASTICSEARCH_BULK_MAX_BACKOFF,
+                    raise_on_error=False,
+                    raise_on_exception=False
+                ):
+                    item = next(iter(info.values()))
+                    position = positions[item["_id"]].pop(0)
+                    if ok:
+                        outcomes[position] = {"status": "success", "error": None}
+                    else:
+                        outcomes[position] = {"status": "error", "error": str(item.get("error"))}
+            except Exception as e:
+                # Documents this worker had in flight keep their default error outcome
+                logger.error(f"Bulk indexing worker failed: {str(e)}", exc_info=True)
+
+        with track_stage("es_bulk"):
+            await asyncio.gather(*[worker() for _ in range(settings.ELASTICSEARCH_BULK_CONCURRENCY)])
+
+        failed = sum(1 for outcome in outcomes if outcome["status"] != "success")
+        if failed:
+            logger.error(f"Bulk insert encountered errors for {failed} of {len(documents)} documents.")
+        return outcomes
+
+    def _build_search_body(self, image_embedding: List[float], search: Dict) -> Dict:
+        """
+        Build the kNN search body for one query embedding.
+        With int8 storage, SEARCH_RESCORE_OVERSAMPLE times k candidates are
+        fetched with their stored vectors, under a slightly looser cut-off, for
+        _rescore_hits to rank with the float query.
+        """
+        # The cosine _score is (1 + cosine) / 2; cut off at the matching cosine
+        similarity = 2 * settings.ELASTICSEARCH_SEARCH_THRESHOLD - 1
+        size = search["k"]
+        fields = search["fields"]
+        if self._rescore:
+            similarity -= self.RESCORE_SIMILARITY_MARGIN
+            size = search["k"] * settings.SEARCH_RESCORE_OVERSAMPLE
+            fields = fields + list(EMBEDDING_FIELDS)
+
+        return {
+            "knn": {
+                "field": "image_embedding",
+                "k": size,
+                "num_candidates": max(search["num_candidates"], size),
+                "query_vector": query_vector(image_embedding, settings.EMBEDDING_STORAGE),
+                "similarity": similarity
+            },
+            "_source": fields,
+            "size": size
+        }
+
+    def _rescore_hits(self, search_response: Dict, image_embedding: List[float], k: int) -> Dict:
+        """
+        Re-rank quantised kNN hits by the cosine of the float query with each
+        stored (dequantised) vector, keep the best k and drop the vector fields.
+        """
+        hits = search_response.get("hits", {}).get("hits", [])
+        if not hits:
+            return search_response
+
+        vectors = np.stack([decode_embedding(hit["_source"]) for hit in hits])
+        cosines = cosine_similarities(vectors, np.asarray(image_embedding, dtype=np.float32))
+        rescored = []
+        for hit, cosine in zip(hits, cosines):
+            source = {key: value for key, value in hit["_source"].items() if key not in EMBEDDING_FIELDS}
+            rescored.append(dict(hit, _score=float((1 + cosine) / 2), _source=source))
+        rescored.sort(key=lambda hit: hit["_score"], reverse=True)
+        return {"hits": {"hits": rescored[:k]}}
+
+    def _to_result(self, search_response: Dict) -> Dict:
+        """
+        Turn a kNN response into a search result: the matches, best first, or
+        a not_found result. The threshold is applied in the query already and
+        is only checked again here for backends that do not support it.
+        """
+        matches = [
+            {"id": hit["_id"], "score": hit["_score"], "person": hit.get("_source", {})}
+            for hit in search_response.get("hits", {}).get("hits", [])
+            if hit["_score"] >= settings.ELASTICSEARCH_SEARCH_THRESHOLD
+        ]
+
+        if matches:
+            detail_logger.info(f"Found {len(matches)} matching results")
+            return {"status": "success", "matches": matches}
+
+        detail_logger.info("No matches found above threshold")
+        return {"status": "not_found", "message": "No matching results found"}
+
+    async def search_by_image(self, image_embedding: List[float], search: Dict = None) -> Dict:
         """
         Search for persons using image embedding vector.
         Args:
             image_embedding: Vector embedding of the query image.
+            search: Search options (see search_options); Settings defaults when None.
+        Returns:
+            dict: Search result with status and, when found, the matches
+                (id, score and person fields), best first.
+        """
+        try:
+            search_response = await self._search(image_embedding, search or self.search_options())
+            return self._to_result(search_response)
+            
+        except Exception as e:
+            logger.error(f"Error in search_by_image: {str(e)}", exc_info=True)
+            raise
+
+    async def search_by_images(self, image_embeddings: List[List[float]], search: Dict = None) -> List[Dict]:
+        """
+        Search for persons using many embedding vectors in one _msearch round trip.
+        Args:
+            image_embeddings: Vector embeddings of the query images.
+            search: Search options shared by all queries; Settings defaults when None.
         Returns:
-            dict: Search results with matching persons.
+            List[dict]: One search result per embedding, in input order. A query that
+                failed on the Elasticsearch side is returned as an error result.
         """
         try:
-            search_body = {
-                "knn": {
-                    "field": "image_embedding",
-                    "k": settings.ELASTICSEARCH_SEARCH_SIZE,
-                    "num_candidates": 100,
-                    "query_vector": image_embedding
-                },
-                "_source": [
-                    "full_name", "birth_place", "birth_date",
-                    "address", "nationality", "passport_number",
-                    "gender", "national_id_number", "marital_status", "image_path"
-                ]
+            results = []
+            for search_response in await self._msearch(image_embeddings, search or self.search_options()):
+                if "error" in search_response:
+                    logger.error(f"Query in msearch failed: {search_response['error']}")
+                    results.append({"status": "error", "message": str(search_response["error"])})
+                else:
+                    results.append(self._to_result(search_response))
+            return results
+
+        except Exception as e:
+            logger.error(f"Error in search_by_images: {str(e)}", exc_info=True)
+            raise
+
+    async def get_by_national_id(self, national_id_number: str, fields: List[str] = None) -> List[Dict]:
+        """
+        Persons registered under a national ID, with their stored embeddings,
+        fetched with a keyed lookup instead of a kNN search.
+        Args:
+            national_id_number: National ID to look up.
+            fields: Person fields to return; all SEARCH_SOURCE_FIELDS when None.
+        Returns:
+            List[dict]: id, embedding (float32 array) and person fields of each document.
+        """
+        fields = list(fields or self.SEARCH_SOURCE_FIELDS)
+        source = fields + list(EMBEDDING_FIELDS)
+        with track_stage("es_query"):
+            response = await self.es_client.options(ignore_status=404).get(
+                index=self._index_name,
+                id=Person.document_id_for(national_id_number),
+                source=source
+            )
+            if response.get("found"):
+                hits = [response]
+            else:
+                # Documents indexed before ids were derived from the national ID (see app.index_tool dedup)
+                response = await self.es_client.search(
+                    index=self._index_name,
+                    query={"term": {"national_id_number": national_id_number}},
+                    source=source,
+                    size=settings.VERIFY_MAX_RECORDS,
+                    filter_path=self.SEARCH_FILTER_PATH
+                )
+                hits = response.get("hits", {}).get("hits", [])
+        return [
+            {
+                "id": hit["_id"],
+                "embedding": decode_embedding(hit["_source"]),
+                "person": {field: hit["_source"].get(field) for field in fields}
             }
+            for hit in hits
+            if hit.get("_source", {}).get("image_embedding")
+        ]
 
-            # Gunakan client yang sama
-            es = Util.get_connection()
-            search_result = es.search(
+    async def _search(self, image_embedding: List[float], search: Dict) -> Dict:
+        """Run one kNN query and return the (filtered) search response."""
+        with track_stage("es_query"):
+            response = await self.es_client.search(
                 index=self._index_name,
-                body=search_body,
-                size=settings.ELASTICSEARCH_SEARCH_SIZE
+                body=self._build_search_body(image_embedding, search),
+                filter_path=self.SEARCH_FILTER_PATH
             )
+        if self._rescore:
+            response = self._rescore_hits(response, image_embedding, search["k"])
+        return response
 
-            # Validasi threshold
-            results = [
-                hit['_source'] for hit in search_result['hits']['hits']
-                if hit['_score'] >= settings.ELASTICSEARCH_SEARCH_THRESHOLD
-            ]
+    async def _msearch(self, image_embeddings: List[List[float]], search: Dict) -> List[Dict]:
+        """Run many kNN queries in one _msearch and return the (filtered) per-query responses."""
+        searches = []
+        for image_embedding in image_embeddings:
+            searches.append({})
+            searches.append(self._build_search_body(image_embedding, search))
 
-            if results:
-                logger.info(f"Found {len(results)} matching results") 
-                return search_result
-            
-            logger.info("No matches found above threshold")
-            return {"status": "not_found", "message": "No matching results found"}
-            
-        except Exception as e:
-            logger.error(f"Error in search_by_image: {str(e)}", exc_info=True)
-            raise
+        with track_stage("es_query"):
+            response = await self.es_client.msearch(index=self._index_name, searches=searches, filter_path=self.MSEARCH_FILTER_PATH)
+        responses = response["responses"]
+        if self._rescore:
+            responses = [
+                search_response if "error" in search_response else self._rescore_hits(search_response, image_embedding, search["k"])
+                for search_response, image_embedding in zip(responses, image_embeddings)
+            ]
+        return responses
@@ -1,54 +1,219 @@
-from typing import List 
+from typing import List, Dict, Optional, Union
+import asyncio
+import numpy as np
 from app.person_repository import PersonRepository
+from app.search_batcher import SearchBatcher
 from app.person import Person
-from app.logger import logger
+from app.embedding_engine import EmbeddingEngine
+from app.cache import search_result_cache, content_hash
+from app.quantization import cosine_similarities
+from app.config import get_settings
+from app.logger import logger, detail_logger
+
+settings = get_settings()
 
 class PersonService:
-    def __init__(self, person_repository: PersonRepository):
+    def __init__(self, person_repository: PersonRepository, search_batcher: Optional[SearchBatcher] = None):
         self.person_repository = person_repository
+        self.search_batcher = search_batcher
 
-    async def register_person(self, person: Person) -> None:
+    async def register_person(self, person: Person, detection: Optional[Dict] = None) -> Dict:
         """
-        Register a single person in the database.
+        Register (create or update) a single person in the database.
         Args:
             person: Person object to register
+            detection: Face detection options (see EmbeddingEngine.detection_options)
+        Returns:
+            dict: Outcome with status (success or unchanged)
         """
         try:
-            logger.info(f"Registering person: {person.full_name}")
-            await self.person_repository.insert(person)
+            detail_logger.info(f"Registering person: {person.full_name}")
+            outcome = await self.person_repository.insert(person, detection)
+            search_result_cache.clear()
+            return outcome
         except Exception as e:
             logger.error(f"Error registering person: {str(e)}", exc_info=True)
             raise
 
-    async def register_persons(self, persons: List[Person]) -> None:
+    async def register_persons(self, persons: List[Person], detection: Optional[Dict] = None) -> List[Dict]:
         """
         Register multiple persons in bulk.
         Args:
             persons: List of Person objects to register
+            detection: Face detection options (see EmbeddingEngine.detection_options)
+        Returns:
+            List[dict]: One outcome per person, in input order
         """
         try:
-            logger.info(f"Bulk registering {len(persons)} persons")
-            await self.person_repository.bulk_insert(persons)
+            detail_logger.info(f"Bulk registering {len(persons)} persons")
+            outcomes = await self.person_repository.bulk_insert(persons, detection)
+            search_result_cache.clear()
+            return outcomes
         except Exception as e:
             logger.error(f"Error in bulk registration: {str(e)}", exc_info=True)
             raise
 
-    async def find_person_by_image(self, image_path: str) -> dict:
+    async def find_person_by_image(self, image: Union[str, bytes], detection: Optional[Dict] = None, search: Optional[Dict] = None) -> dict:
         """
         Find a person using facial recognition from an image.
         Args:
-            image_path: Path to the image file
+            image: Path to the image file or encoded image bytes
+            detection: Face detection options (see EmbeddingEngine.detection_options)
+            search: kNN search options (see PersonRepository.search_options)
         Returns:
             dict: Search results with person data if found
         """
         try:
-            logger.info(f"Getting embedding for image: {image_path}")
-            image_embedding = await Person.get_embedding(image_path)
-            
-            logger.info("Searching database with image embedding")
-            result = await self.person_repository.search_by_image(image_embedding)
-            # print("find_person_by_image", result)
+            detection = detection or EmbeddingEngine.detection_options()
+            search = search or PersonRepository.search_options()
+            image_hash = None
+            if isinstance(image, (bytes, bytearray)) and (settings.EMBEDDING_CACHE_ENABLED or settings.SEARCH_RESULT_CACHE_ENABLED):
+                image_hash = content_hash(image)
+            # Detection and search options change the result, so they are part of its key
+            result_key = f"{EmbeddingEngine.detection_key(detection)}:{PersonRepository.search_key(search)}:{image_hash}"
+
+            if image_hash and settings.SEARCH_RESULT_CACHE_ENABLED:
+                cached = search_result_cache.get(result_key)
+                if cached is not None:
+                    detail_logger.info("Search result cache hit")
+                    return cached
+
+            if self.search_batcher:
+                detail_logger.info(f"Queueing batched search for image: {Person.describe_image(image)}")
+                result = await self.search_batcher.search(image, image_hash, detection, search)
+            else:
+                detail_logger.info(f"Getting embedding for image: {Person.describe_image(image)}")
+                image_embedding = await Person.get_embedding(image, image_hash=image_hash, detection=detection)
+                
+                detail_logger.info("Searching database with image embedding")
+                result = await self.person_repository.search_by_image(image_embedding, search)
+
+            if image_hash and settings.SEARCH_RESULT_CACHE_ENABLED:
+                search_result_cache.set(result_key, result)
             return result
         except Exception as e:
             logger.error(f"Error in find_person_by_image: {str(e)}", exc_info=True)
             raise
+
+    async def find_persons_by_image_faces(self, image: Union[str, bytes], detection: Optional[Dict] = None, search: Optional[Dict] = None) -> List[Dict]:
+        """
+        Find a person for every face in an image.
+        All faces are detected once, embedded as one batch and searched with one _msearch.
+        Args:
+            image: Path to the image file or encoded image bytes
+            detection: Face detection options (see EmbeddingEngine.detection_options)
+            search: kNN search options (see PersonRepository.search_options)
+        Returns:
+            List[dict]: One entry per face with facial_area, confidence and result
+                (as returned by PersonRepository.search_by_image)
+        """
+        try:
+            faces = await Person.get_face_embeddings(image, detection=detection, max_faces=settings.SEARCH_MAX_FACES)
+            if not faces:
+                return []
+
+            detail_logger.info(f"Searching database with {len(faces)} face embeddings")
+            results = await self.person_repository.search_by_images([face["embedding"] for face in faces], search)
+            return [
+                {"facial_area": face["facial_area"], "confidence": face["confidence"], "result": result}
+                for face, result in zip(faces, results)
+            ]
+        except Exception as e:
+            logger.error(f"Error in find_persons_by_image_faces: {str(e)}", exc_info=True)
+            raise
+
+    async def find_persons_by_images(self, images: List[Union[str, bytes]], detection: Optional[Dict] = None, search: Optional[Dict] = None) -> List[Dict]:
+        """
+        Find a person for each of many images.
+        Images without a cached result are embedded in batches and searched with one _msearch.
+        Args:
+            images: Paths to the image files or encoded image bytes
+            detection: Face detection options shared by all images (see EmbeddingEngine.detection_options)
+            search: kNN search options shared by all images (see PersonRepository.search_options)
+        Returns:
+            List[dict]: One search result per image, in input order (as returned by
+                PersonRepository.search_by_image, or an error result when the image could not be embedded)
+        """
+        try:
+            detection = detection or EmbeddingEngine.detection_options()
+            search = search or PersonRepository.search_options()
+            hashing = settings.EMBEDDING_CACHE_ENABLED or settings.SEARCH_RESULT_CACHE_ENABLED
+            image_hashes = [content_hash(image) if hashing and isinstance(image, (bytes, bytearray)) else None for image in images]
+            options_key = f"{EmbeddingEngine.detection_key(detection)}:{PersonRepository.search_key(search)}"
+
+            results = [None] * len(images)
+            pending = []
+            for idx, image_hash in enumerate(image_hashes):
+                cached = search_result_cache.get(f"{options_key}:{image_hash}") if image_hash and settings.SEARCH_RESULT_CACHE_ENABLED else None
+                if cached is not None:
+                    results[idx] = cached
+                else:
+                    pending.append(idx)
+            if not pending:
+                return results
+
+            detail_logger.info(f"Embedding {len(pending)} of {len(images)} search images")
+            embeddings = await Person.get_embeddings(
+                [images[idx] for idx in pending],
+                image_hashes=[image_hashes[idx] for idx in pending],
+                detection=detection
+            )
+            searchable = []
+            for idx, embedding in zip(pending, embeddings):
+                if embedding["status"] == "success":
+                    searchable.append((idx, embedding["embedding"]))
+                else:
+                    results[idx] = {"status": "error", "message": embedding["error"]}
+
+            if searchable:
+                detail_logger.info(f"Searching database with {len(searchable)} embeddings")
+                found = await self.person_repository.search_by_images([embedding for _, embedding in searchable], search)
+                for (idx, _), result in zip(searchable, found):
+                    results[idx] = result
+                    if image_hashes[idx] and settings.SEARCH_RESULT_CACHE_ENABLED and result.get("status") != "error":
+                        search_result_cache.set(f"{options_key}:{image_hashes[idx]}", result)
+            return results
+        except Exception as e:
+            logger.error(f"Error in find_persons_by_images: {str(e)}", exc_info=True)
+            raise
+
+    async def verify_person(self, image: Union[str, bytes], national_id_number: str, detection: Optional[Dict] = None, fields: Optional[List[str]] = None) -> dict:
+        """
+        Check whether an image shows the person registered under a national ID.
+        The stored embeddings of that ID are fetched by key while the probe is
+        embedded, and compared with one cosine each; no kNN search is run.
+        Args:
+            image: Path to the image file or encoded image bytes
+            national_id_number: Claimed identity
+            detection: Face detection options (see EmbeddingEngine.detection_options)
+            fields: Person fields to return (see PersonRepository.search_options)
+        Returns:
+            dict: status (match, no_match or not_found), score on the search
+                scale ((1 + cosine) / 2), threshold, and the best id and person
+        """
+        try:
+            image_hash = content_hash(image) if isinstance(image, (bytes, bytearray)) and settings.EMBEDDING_CACHE_ENABLED else None
+            image_embedding, stored = await asyncio.gather(
+                Person.get_embedding(image, image_hash=image_hash, detection=detection),
+                self.person_repository.get_by_national_id(national_id_number, fields)
+            )
+            threshold = settings.VERIFY_THRESHOLD if settings.VERIFY_THRESHOLD is not None else settings.ELASTICSEARCH_SEARCH_THRESHOLD
+            if not stored:
+                detail_logger.info(f"No person registered with national ID {national_id_number}")
+                return {"status": "not_found", "threshold": threshold}
+
+            # A person registered more than once matches on any of the stored images
+            cosines = cosine_similarities(np.stack([record["embedding"] for record in stored]), np.asarray(image_embedding, dtype=np.float32))
+            best = int(np.argmax(cosines))
+            score = float((1 + cosines[best]) / 2)
+            detail_logger.info(f"Verified national ID {national_id_number} with score {score}")
+            return {
+                "status": "match" if score >= threshold else "no_match",
+                "score": score,
+                "threshold": threshold,
+                "id": stored[best]["id"],
+                "person": stored[best]["person"]
+            }
+        except Exception as e:
+            logger.error(f"Error in verify_person: {str(e)}", exc_info=True)
+            raise
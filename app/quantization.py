@@ -0,0 +1,65 @@
+from typing import Dict, Tuple
+import numpy as np
+
+# Ways embeddings can be stored (see EMBEDDING_STORAGE)
+EMBEDDING_STORAGES = ("float32", "float16", "int8")
+# Document fields holding the stored embedding
+EMBEDDING_FIELDS = ("image_embedding", "image_embedding_scale")
+
+INT8_LEVELS = 127
+
+def quantize_int8(vectors) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Symmetric scalar quantisation with one scale factor per vector.
+    Each vector is mapped to integers in [-127, 127] so that its largest
+    component becomes +/-127; codes * scale restores the vector.
+    Args:
+        vectors: Array-like of shape (n, dim) or (dim,)
+    Returns:
+        tuple: int8 codes with the shape of vectors, and float32 scales (one per vector)
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    peaks = np.abs(vectors).max(axis=-1, keepdims=True)
+    peaks[peaks == 0] = 1
+    scales = peaks / INT8_LEVELS
+    codes = np.clip(np.rint(vectors / scales), -INT8_LEVELS, INT8_LEVELS).astype(np.int8)
+    return codes, scales[..., 0].astype(np.float32)
+
+def dequantize_int8(codes, scales) -> np.ndarray:
+    """Restore float32 vectors from int8 codes and their scale factors."""
+    return np.asarray(codes, dtype=np.float32) * np.asarray(scales, dtype=np.float32)[..., None]
+
+def encode_embedding(embedding, storage: str) -> Dict:
+    """
+    Document fields for an embedding in the given storage.
+    int8 stores the codes in image_embedding (a byte dense_vector) and the scale
+    factor in image_embedding_scale. Elasticsearch has no half precision
+    vectors, so float16 only applies to the local vector index and documents
+    keep float values.
+    """
+    if embedding is None:
+        return {"image_embedding": None}
+    if storage == "int8":
+        codes, scale = quantize_int8(embedding)
+        return {"image_embedding": codes.tolist(), "image_embedding_scale": float(scale)}
+    return {"image_embedding": np.asarray(embedding, dtype=np.float32).tolist()}
+
+def decode_embedding(document: Dict) -> np.ndarray:
+    """Float32 embedding of a document, whichever storage it was written with."""
+    embedding = np.asarray(document["image_embedding"], dtype=np.float32)
+    scale = document.get("image_embedding_scale")
+    if scale is not None:
+        embedding = embedding * np.float32(scale)
+    return embedding
+
+def query_vector(embedding, storage: str) -> list:
+    """Query vector for a kNN search on the stored field: int8 fields need int8 queries."""
+    if storage == "int8":
+        return quantize_int8(embedding)[0].tolist()
+    return np.asarray(embedding, dtype=np.float32).tolist()
+
+def cosine_similarities(vectors: np.ndarray, query: np.ndarray) -> np.ndarray:
+    """Cosine similarity of each row of vectors with the query."""
+    norms = np.linalg.norm(vectors, axis=1) * (np.linalg.norm(query) or 1)
+    norms[norms == 0] = 1
+    return (vectors @ query) / norms
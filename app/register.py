@@ -1,18 +1,19 @@
 from app.person import Person
-from app.logger import logger
-from typing import List, Dict
+from app.logger import logger, detail_logger
+from typing import List, Dict, Optional
 
-async def register_person(person_data: dict, person_service) -> dict:
+async def register_person(person_data: dict, person_service, detection: Optional[Dict] = None) -> dict:
     """
     Register a person based on user input.
     Args:
         person_data: Dictionary containing person data
         person_service: Instance of PersonService
+        detection: Face detection options (see EmbeddingEngine.detection_options)
     Returns:
         dict: Registration result
     """
     try:
-        logger.info(f"Creating Person object for {person_data['full_name']}")
+        detail_logger.info(f"Creating Person object for {person_data['full_name']}")
         person = Person(
             person_data["image_path"],
             person_data["full_name"],
@@ -23,16 +24,18 @@ async def register_person(person_data: dict, person_service) -> dict:
             person_data["passport_number"],
             person_data["gender"],
             person_data["national_id_number"],
-            person_data["marital_status"]
+            person_data["marital_status"],
+            image=person_data.get("image"),
+            image_hash=person_data.get("image_hash")
         )
         
-        logger.info("Registering person in database")
-        await person_service.register_person(person)
-        logger.info(f"Successfully registered {person_data['full_name']}")
+        detail_logger.info("Registering person in database")
+        outcome = await person_service.register_person(person, detection)
+        detail_logger.info(f"Successfully registered {person_data['full_name']}")
         
         return {
-            "status": "success",
-            "message": "Person registered successfully",
+            "status": outcome["status"],
+            "message": BULK_RESULT_MESSAGES[outcome["status"]],
             "data": {
                 "full_name": person_data["full_name"],
                 "national_id_number": person_data["national_id_number"]
@@ -42,17 +45,18 @@ async def register_person(person_data: dict, person_service) -> dict:
         logger.error(f"Error in register_person: {str(e)}", exc_info=True)
         raise
 
-async def register_persons(persons_data: List[dict], person_service) -> List[Dict]:
+async def register_persons(persons_data: List[dict], person_service, detection: Optional[Dict] = None) -> List[Dict]:
     """
     Register multiple persons in bulk.
     Args:
         persons_data: List of dictionaries containing person data
         person_service: Instance of PersonService
+        detection: Face detection options (see EmbeddingEngine.detection_options)
     Returns:
         List[dict]: List of registration results
     """
     try:
-        logger.info(f"Creating Person objects for {len(persons_data)} persons")
+        detail_logger.info(f"Creating Person objects for {len(persons_data)} persons")
         persons = []
         for data in persons_data:
             person = Person(
@@ -65,23 +69,50 @@ async def register_persons(persons_data: List[dict], person_service) -> List[Dic
                 data["passport_number"],
                 data["gender"],
                 data["national_id_number"],
-                data["marital_status"]
+                data["marital_status"],
+                image=data.get("image"),
+                image_hash=data.get("image_hash")
             )
             persons.append(person)
         
-        logger.info("Bulk registering persons in database")
-        await person_service.register_persons(persons)
-        logger.info(f"Successfully bulk registered {len(persons)} persons")
+        detail_logger.info("Bulk registering persons in database")
+        outcomes = await person_service.register_persons(persons, detection)
+        detail_logger.info(f"Finished bulk registration of {len(persons)} persons")
         
-        return [{
-            "status": "success",
-            "message": "Person registered successfully",
-            "data": {
-                "full_name": data["full_name"],
-                "national_id_number": data["national_id_number"]
-            }
-        } for data in persons_data]
+        return [bulk_result(data, outcome) for data, outcome in zip(persons_data, outcomes)]
         
     except Exception as e:
         logger.error(f"Error in register_persons: {str(e)}", exc_info=True)
         raise
+
+# Statuses of persons whose document is stored after the registration
+REGISTERED_STATUSES = ("success", "unchanged")
+
+BULK_RESULT_MESSAGES = {
+    "success": "Person registered successfully",
+    "unchanged": "Person already registered with this image; details updated",
+    "no_face": "No face found in image",
+    "duplicate": "Person already registered",
+    "error": "Failed to register person",
+}
+
+def bulk_result(person_data: dict, outcome: dict) -> dict:
+    """
+    Build the per-person result of a bulk registration.
+    Args:
+        person_data: Dictionary containing person data
+        outcome: Outcome of the person from the repository (status and error)
+    Returns:
+        dict: Registration result
+    """
+    result = {
+        "status": outcome["status"],
+        "message": BULK_RESULT_MESSAGES.get(outcome["status"], outcome["status"]),
+        "data": {
+            "full_name": person_data["full_name"],
+            "national_id_number": person_data["national_id_number"]
+        }
+    }
+    if outcome.get("error"):
+        result["error"] = outcome["error"]
+    return result
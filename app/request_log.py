@@ -0,0 +1,59 @@
+import contextvars
+import json
+import time
+from typing import Optional
+from app.metrics import route_path
+from app.logger import logger, sample_request_details
+
+# Extra fields for the summary line of the current request
+_request_fields: contextvars.ContextVar = contextvars.ContextVar("request_log_fields", default=None)
+
+def annotate_request(**fields) -> None:
+    """Add fields (e.g. the search outcome) to the summary line of the current request."""
+    current: Optional[dict] = _request_fields.get()
+    if current is not None:
+        current.update(fields)
+
+class RequestLogMiddleware:
+    """
+    ASGI middleware writing one structured (JSON) line per request with its
+    route, status and duration plus any fields added with annotate_request.
+    It also decides whether the request's detail records are sampled.
+    Health checks and metric scrapes are not summarised.
+    """
+    QUIET_ROUTES = {"/health/live", "/health/ready", "/metrics"}
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        sampled = sample_request_details()
+        fields = {}
+        _request_fields.set(fields)
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = route_path(scope)
+            if route not in self.QUIET_ROUTES:
+                summary = {
+                    "method": scope["method"],
+                    "route": route,
+                    "status": status,
+                    "duration_ms": round((time.perf_counter() - start) * 1000, 2),
+                    "detail_sampled": sampled,
+                    **fields
+                }
+                logger.info(f"request {json.dumps(summary, default=str)}")
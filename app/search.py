@@ -1,37 +1,89 @@
 import os
-from app.util import Util
-from app.logger import logger
+from typing import Dict, List, Optional, Union
+from app.logger import logger, detail_logger
 
-async def search_by_image(image_path: str, service) -> dict:
+async def search_by_image(image: Union[str, bytes], service, detection: Optional[Dict] = None, search: Optional[Dict] = None) -> dict:
     """
     Search for a person using facial recognition.
     Args:
-        image_path: Path to the image file
+        image: Path to the image file or encoded image bytes
         service: Instance of PersonService
+        detection: Face detection options (see EmbeddingEngine.detection_options)
+        search: kNN search options (see PersonRepository.search_options)
     Returns:
-        dict: Search results with person data if found
+        dict: Search results; when found, data holds the matches (id, score and person), best first
     """
     try:
-        logger.info(f"Checking if image exists: {image_path}")
-        if not os.path.exists(image_path):
-            error_msg = f"File not found: {image_path}"
-            logger.error(error_msg)
-            raise FileNotFoundError(error_msg)
+        if isinstance(image, str):
+            detail_logger.info(f"Checking if image exists: {image}")
+            if not os.path.exists(image):
+                error_msg = f"File not found: {image}"
+                logger.error(error_msg)
+                raise FileNotFoundError(error_msg)
 
         # Search for person
-        logger.info("Searching for person using facial recognition")
-        result = await service.find_person_by_image(image_path)
-        # print("search_by_image", result)
+        detail_logger.info("Searching for person using facial recognition")
+        result = await service.find_person_by_image(image, detection, search)
         if result.get("status") == "not_found":
-            logger.info("No matching person found")
+            detail_logger.info("No matching person found")
             return result
 
-        logger.info(f"Person found with score: {result.get('_score', 'N/A')}")
+        detail_logger.info(f"Person found with score: {result['matches'][0]['score']}")
         return {
             "status": "success",
             "message": "Person found",
-            "data": result
+            "data": result["matches"]
         }
     except Exception as e:
         logger.error(f"Error in search_by_image: {str(e)}", exc_info=True)
         raise
+
+async def search_faces_by_image(image: Union[str, bytes], service, detection: Optional[Dict] = None, search: Optional[Dict] = None) -> List[Dict]:
+    """
+    Search for a person for every face in an image.
+    Args:
+        image: Path to the image file or encoded image bytes
+        service: Instance of PersonService
+        detection: Face detection options (see EmbeddingEngine.detection_options)
+        search: kNN search options (see PersonRepository.search_options)
+    Returns:
+        List[dict]: One entry per face with facial_area, confidence and result
+    """
+    try:
+        if isinstance(image, str) and not os.path.exists(image):
+            error_msg = f"File not found: {image}"
+            logger.error(error_msg)
+            raise FileNotFoundError(error_msg)
+
+        faces = await service.find_persons_by_image_faces(image, detection, search)
+        detail_logger.info(f"Searched {len(faces)} faces")
+        return faces
+    except Exception as e:
+        logger.error(f"Error in search_faces_by_image: {str(e)}", exc_info=True)
+        raise
+
+async def search_by_images(images: List[Union[str, bytes]], service, detection: Optional[Dict] = None, search: Optional[Dict] = None) -> List[Dict]:
+    """
+    Search for a person for each of many images.
+    Args:
+        images: Paths to the image files or encoded image bytes
+        service: Instance of PersonService
+        detection: Face detection options (see EmbeddingEngine.detection_options)
+        search: kNN search options (see PersonRepository.search_options)
+    Returns:
+        List[dict]: One search result per image, in input order
+    """
+    try:
+        missing = [image for image in images if isinstance(image, str) and not os.path.exists(image)]
+        if missing:
+            error_msg = f"File not found: {missing[0]}"
+            logger.error(error_msg)
+            raise FileNotFoundError(error_msg)
+
+        results = await service.find_persons_by_images(images, detection, search)
+        found = sum(1 for result in results if result.get("status") == "success")
+        detail_logger.info(f"Searched {len(results)} images, {found} found")
+        return results
+    except Exception as e:
+        logger.error(f"Error in search_by_images: {str(e)}", exc_info=True)
+        raise
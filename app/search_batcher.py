@@ -0,0 +1,121 @@
+import asyncio
+from typing import Dict, List, Tuple, Union
+from app.person import Person
+from app.embedding_engine import EmbeddingEngine
+from app.logger import logger, detail_logger
+from app.config import get_settings
+
+settings = get_settings()
+
+class SearchBatcher:
+    """
+    Coalesces concurrent image searches.
+    Queries that arrive within a short window are embedded with one batched
+    forward pass and sent to Elasticsearch as one _msearch; every caller
+    still gets back its own result. Each face is still detected in its own
+    executor task, so detection is spread over all workers.
+    """
+
+    def __init__(self, person_repository, window_ms: float = None, max_size: int = None):
+        self.person_repository = person_repository
+        self._window = (window_ms if window_ms is not None else settings.SEARCH_BATCH_WINDOW_MS) / 1000
+        self._max_size = max_size or settings.SEARCH_BATCH_MAX_SIZE
+        self._queue: asyncio.Queue = None
+        self._worker: asyncio.Task = None
+        self._batches = set()
+
+    def start(self) -> None:
+        """Start collecting queries. Must be called from the running event loop."""
+        self._queue = asyncio.Queue()
+        self._worker = asyncio.create_task(self._collect())
+
+    async def stop(self) -> None:
+        """Stop collecting, let in-flight batches finish and fail queries still waiting."""
+        if self._worker:
+            self._worker.cancel()
+            await asyncio.gather(self._worker, return_exceptions=True)
+            self._worker = None
+        if self._batches:
+            await asyncio.gather(*self._batches, return_exceptions=True)
+        while self._queue and not self._queue.empty():
+            _, _, _, _, future = self._queue.get_nowait()
+            if not future.done():
+                future.set_exception(RuntimeError("Search batcher stopped"))
+
+    async def search(self, image: Union[str, bytes], image_hash: str = None, detection: Dict = None, search: Dict = None) -> dict:
+        """
+        Queue an image search and wait for its result.
+        Args:
+            image: Path to the image file or encoded image bytes
+            image_hash: Precomputed content hash of the image bytes, if known
+            detection: Face detection options (see EmbeddingEngine.detection_options)
+            search: kNN search options (see PersonRepository.search_options)
+        Returns:
+            dict: Search result, as returned by PersonRepository.search_by_image
+        """
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((image, image_hash, detection, search, future))
+        return await future
+
+    async def _collect(self) -> None:
+        """Gather queries into batches of up to max_size items or one window, whichever comes first."""
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self._window
+            while len(batch) < self._max_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            # Run the batch in the background so the next window starts right away
+            task = asyncio.create_task(self._process(batch))
+            self._batches.add(task)
+            task.add_done_callback(self._batches.discard)
+
+    async def _process(self, batch: List[Tuple[Union[str, bytes], str, Dict, Dict, asyncio.Future]]) -> None:
+        """Embed and search one batch; queries with different detection or search options are handled separately."""
+        groups = {}
+        for item in batch:
+            key = (EmbeddingEngine.detection_key(item[2]), self.person_repository.search_key(item[3]))
+            groups.setdefault(key, []).append(item)
+        await asyncio.gather(*[self._process_group(group) for group in groups.values()])
+
+    async def _process_group(self, batch: List[Tuple[Union[str, bytes], str, Dict, Dict, asyncio.Future]]) -> None:
+        """Embed and search queries sharing their options, then resolve each caller's future."""
+        try:
+            detail_logger.info(f"Processing search batch of {len(batch)} queries")
+            # Detection runs per query across the workers; only the forward pass is batched
+            embeddings = await Person.get_query_embeddings(
+                [image for image, _, _, _, _ in batch],
+                image_hashes=[image_hash for _, image_hash, _, _, _ in batch],
+                detection=batch[0][2]
+            )
+
+            searchable = []
+            for (_, _, _, _, future), result in zip(batch, embeddings):
+                if result["status"] == "success":
+                    searchable.append((future, result["embedding"]))
+                elif not future.done():
+                    future.set_exception(ValueError(result["error"]))
+
+            if not searchable:
+                return
+
+            results = await self.person_repository.search_by_images([embedding for _, embedding in searchable], batch[0][3])
+            for (future, _), result in zip(searchable, results):
+                if future.done():
+                    continue
+                if result.get("status") == "error":
+                    future.set_exception(RuntimeError(result["message"]))
+                else:
+                    future.set_result(result)
+        except Exception as e:
+            logger.error(f"Error processing search batch: {str(e)}", exc_info=True)
+            for _, _, _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
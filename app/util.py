@@ -1,33 +1,71 @@
-from elasticsearch import Elasticsearch
+from typing import List
+import time
+from elasticsearch import AsyncElasticsearch
 from app.config import get_settings
-import getpass
+from app.logger import logger
 
 settings = get_settings()
 
 class Util:
     @staticmethod
-    def get_connection():
-        es = Elasticsearch(
+    def get_connection() -> AsyncElasticsearch:
+        """
+        Create the pooled async Elasticsearch client.
+        The client is meant to be created once per process (see the app lifespan)
+        and shared by every repository call.
+        """
+        return AsyncElasticsearch(
             hosts=settings.ELASTICSEARCH_URL,
-            basic_auth=(settings.ELASTICSEARCH_USERNAME, settings.ELASTICSEARCH_PASSWORD)
+            basic_auth=(settings.ELASTICSEARCH_USERNAME, settings.ELASTICSEARCH_PASSWORD),
+            connections_per_node=settings.ELASTICSEARCH_CONNECTIONS_PER_NODE,
+            request_timeout=settings.ELASTICSEARCH_REQUEST_TIMEOUT,
+            max_retries=settings.ELASTICSEARCH_MAX_RETRIES,
+            retry_on_timeout=settings.ELASTICSEARCH_RETRY_ON_TIMEOUT
         )
-        es.info() 
-        return es
 
     @staticmethod
-    def create_index(es: Elasticsearch, index_name: str):
-        index_config = {
+    def index_config(m: int = None, ef_construction: int = None, ingest: bool = False) -> dict:
+        """
+        Settings and mappings of a people index.
+        Args:
+            m: HNSW graph connections per node (ELASTICSEARCH_HNSW_M when None)
+            ef_construction: HNSW candidates considered while building the graph
+                (ELASTICSEARCH_HNSW_EF_CONSTRUCTION when None)
+            ingest: Create the index in ingest mode (see ingest_settings)
+        """
+        embedding_mapping = {
+            "type": "dense_vector",
+            "dims": settings.EMBEDDING_DIMS,
+            "index": True,
+            "similarity": "cosine",
+            "index_options": {
+                "type": "hnsw",
+                "m": m or settings.ELASTICSEARCH_HNSW_M,
+                "ef_construction": ef_construction or settings.ELASTICSEARCH_HNSW_EF_CONSTRUCTION
+            }
+        }
+        if settings.EMBEDDING_STORAGE == "int8":
+            # A quarter of the float memory for vectors and the HNSW graph
+            embedding_mapping["element_type"] = "byte"
+
+        return {
             "settings": {
-                "index.refresh_interval": "5s",
-                "number_of_shards": 1
+                "number_of_shards": settings.ELASTICSEARCH_SHARDS,
+                **(Util.ingest_settings() if ingest else Util.serving_settings())
             },
             "mappings": {
                 "properties": {
-                    "image_embedding": {
-                        "type": "dense_vector",
-                        "dims": 128,
-                        "index": True,
-                        "similarity": "cosine"
+                    "image_embedding": embedding_mapping,
+                    "image_embedding_scale": {
+                        "type": "float",
+                        "index": False
+                    },
+                    "image_hash": {
+                        "type": "keyword"
+                    },
+                    "embedding_key": {
+                        "type": "keyword",
+                        "index": False
                     },
                     "full_name": {
                         "type": "keyword"
@@ -70,12 +108,76 @@ class Util:
             }
         }
 
-        if not es.indices.exists(index=index_name):
-            index_creation = es.indices.create(index=index_name, ignore=400, body=index_config)
-            print("Index created: ", index_creation)
+    @staticmethod
+    def serving_settings() -> dict:
+        """Dynamic index settings for normal operation."""
+        return {
+            "index.refresh_interval": settings.ELASTICSEARCH_REFRESH_INTERVAL,
+            "index.number_of_replicas": settings.ELASTICSEARCH_REPLICAS
+        }
+
+    @staticmethod
+    def ingest_settings() -> dict:
+        """Dynamic index settings for bulk loads: no periodic refresh and no replicas to copy to."""
+        return {
+            "index.refresh_interval": "-1",
+            "index.number_of_replicas": 0
+        }
+
+    @staticmethod
+    def new_index_name(alias: str) -> str:
+        """Name of a new concrete index behind an alias, e.g. people-image-facenet-20240101120000."""
+        return f"{alias}-{time.strftime('%Y%m%d%H%M%S')}"
+
+    @staticmethod
+    async def create_index(es: AsyncElasticsearch, index_name: str):
+        """
+        Create the index the application reads and writes through.
+        index_name (ELASTICSEARCH_INDEX) is an alias over a concrete index, so the
+        index can later be rebuilt and swapped in (see app.index_tool). An existing
+        concrete index of that name is used as is.
+        The first concrete index has a fixed name, so workers starting together on
+        an empty cluster all create the same index: one wins, the others get a 400.
+        """
+        if not await es.indices.exists(index=index_name):
+            concrete_index = f"{index_name}-000001"
+            index_config = Util.index_config()
+            index_config["aliases"] = {index_name: {"is_write_index": True}}
+            index_creation = await es.options(ignore_status=400).indices.create(index=concrete_index, body=index_config)
+            logger.info(f"Index {concrete_index} created behind alias {index_name}: {index_creation.get('acknowledged', False)}")
         else:
-            print("Index already exists.")
+            logger.info(f"Index {index_name} already exists")
+
+    @staticmethod
+    async def alias_indices(es: AsyncElasticsearch, alias: str) -> List[str]:
+        """Concrete indices behind an alias; empty when the name is not an alias."""
+        if not await es.indices.exists_alias(name=alias):
+            return []
+        return list((await es.indices.get_alias(name=alias)).body)
+
+    @staticmethod
+    async def begin_ingest(es: AsyncElasticsearch, index_name: str):
+        """Switch an index (or alias) to ingest settings before a large bulk load."""
+        await es.indices.put_settings(index=index_name, settings=Util.ingest_settings())
+        logger.info(f"Index {index_name} switched to ingest mode")
+
+    @staticmethod
+    async def end_ingest(es: AsyncElasticsearch, index_name: str):
+        """
+        Restore the serving settings after a bulk load, make the loaded
+        documents searchable and start a force-merge in the background.
+        """
+        await es.indices.put_settings(index=index_name, settings=Util.serving_settings())
+        await es.indices.refresh(index=index_name)
+        await es.indices.forcemerge(
+            index=index_name,
+            max_num_segments=settings.ELASTICSEARCH_FORCE_MERGE_SEGMENTS,
+            wait_for_completion=False
+        )
+        logger.info(f"Index {index_name} restored from ingest mode, force-merge started")
 
     @staticmethod
-    def delete_index(es: Elasticsearch, index_name: str):
-        es.indices.delete(index=index_name, ignore_unavailable=True)
+    async def delete_index(es: AsyncElasticsearch, index_name: str):
+        """Delete an index, or every index behind it when index_name is an alias."""
+        indices = await Util.alias_indices(es, index_name) or [index_name]
+        await es.indices.delete(index=",".join(indices), ignore_unavailable=True)
@@ -0,0 +1,384 @@
+from typing import List, Dict, Optional, Tuple
+import numpy as np
+import fcntl
+import json
+import os
+import threading
+from app.logger import logger
+from app.quantization import EMBEDDING_STORAGES, cosine_similarities, dequantize_int8, quantize_int8
+
+class VectorIndex:
+    """
+    In-process cosine similarity index.
+    Vectors are L2-normalised and appended to a raw file that is memory-mapped
+    on load, so a restart does not re-read or re-parse the gallery. The file
+    holds float32, float16 or int8 rows (storage); int8 rows have a float32
+    scale factor each in a second file. Compact storage is searched with the
+    float query, and the best rescore_oversample * k candidates are re-ranked
+    by their exact cosine with it. Each row has a record (document id and metadata) in a JSON lines
+    sidecar file. Re-adding an id supersedes its previous row.
+    Search is either exact (one matrix product over the whole gallery) or
+    IVF-partitioned (spherical k-means lists, probing the nprobe closest).
+    Metadata fields listed in keys can be looked up directly with find.
+    """
+    VECTORS_FILES = {"float32": "vectors.f32", "float16": "vectors.f16", "int8": "vectors.i8"}
+    SCALES_FILE = "scales.f32"
+    METADATA_FILE = "metadata.jsonl"
+    CENTROIDS_FILE = "centroids.npy"
+    LOCK_FILE = ".lock"
+
+    # IVF needs enough vectors per list to be worth it
+    MIN_VECTORS_PER_LIST = 39
+    KMEANS_ITERATIONS = 10
+    KMEANS_SAMPLE_PER_LIST = 64
+    BLOCK_SIZE = 65536
+
+    def __init__(self, path: str, dim: int = 128, mode: str = "exact", nlist: int = 256, nprobe: int = 16,
+                 storage: str = "float32", rescore_oversample: int = 4, keys: Tuple[str, ...] = ()):
+        if mode not in ("exact", "ivf"):
+            raise ValueError(f"Unknown vector index mode: {mode}")
+        if storage not in EMBEDDING_STORAGES:
+            raise ValueError(f"Unknown vector storage: {storage}")
+        self.path = path
+        self.dim = dim
+        self.mode = mode
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.storage = storage
+        self.rescore_oversample = rescore_oversample if storage != "float32" else 1
+        self._dtype = np.dtype(storage)
+        self._lock = threading.RLock()
+        self._matrix = np.empty((0, dim), dtype=self._dtype)
+        self._scales: Optional[np.ndarray] = np.empty(0, dtype=np.float32) if storage == "int8" else None
+        self._records: List[Dict] = []
+        self._positions: Dict[str, int] = {}
+        self.keys = tuple(keys)
+        # Live document ids per value of each key field
+        self._key_ids: Dict[str, Dict[object, set]] = {key: {} for key in self.keys}
+        self._live = np.zeros(0, dtype=bool)
+        self._metadata_offset = 0
+        self._centroids: Optional[np.ndarray] = None
+        self._assignments = np.zeros(0, dtype=np.int32)
+        self._lists: Optional[List[np.ndarray]] = None
+        self._trained_size = 0
+
+    @property
+    def _vectors_path(self) -> str:
+        return os.path.join(self.path, self.VECTORS_FILES[self.storage])
+
+    @property
+    def _scales_path(self) -> str:
+        return os.path.join(self.path, self.SCALES_FILE)
+
+    @property
+    def _metadata_path(self) -> str:
+        return os.path.join(self.path, self.METADATA_FILE)
+
+    @property
+    def _centroids_path(self) -> str:
+        return os.path.join(self.path, self.CENTROIDS_FILE)
+
+    def __len__(self) -> int:
+        return int(self._live.sum())
+
+    def load(self) -> None:
+        """Open the index files, creating an empty index if needed."""
+        os.makedirs(self.path, exist_ok=True)
+        for storage, name in self.VECTORS_FILES.items():
+            file_path = os.path.join(self.path, name)
+            if storage != self.storage and os.path.exists(file_path) and os.path.getsize(file_path):
+                raise ValueError(f"Vector index at {self.path} holds {storage} vectors; rebuild it to use {self.storage}")
+        for file_path in (self._vectors_path, self._metadata_path):
+            open(file_path, "ab").close()
+        if self.storage == "int8":
+            open(self._scales_path, "ab").close()
+
+        with self._lock:
+            if self.mode == "ivf" and os.path.exists(self._centroids_path):
+                centroids = np.load(self._centroids_path)
+                if centroids.shape == (self.nlist, self.dim):
+                    self._centroids = centroids
+            self.refresh()
+            logger.info(f"Loaded vector index from {self.path} with {len(self)} vectors")
+
+    def refresh(self) -> None:
+        """Pick up rows appended since the last load, including by other processes."""
+        with self._lock:
+            with open(self._metadata_path, "rb") as f:
+                f.seek(self._metadata_offset)
+                data = f.read()
+            # Only consume complete lines; a concurrent writer may be mid-line
+            complete = data[:data.rfind(b"\n") + 1]
+            self._metadata_offset += len(complete)
+            self._records.extend(json.loads(line) for line in complete.splitlines() if line)
+
+            row_bytes = self.dim * self._dtype.itemsize
+            rows = min(os.path.getsize(self._vectors_path) // row_bytes, len(self._records))
+            if self._scales is not None:
+                rows = min(rows, os.path.getsize(self._scales_path) // np.dtype(np.float32).itemsize)
+            if rows == len(self._matrix):
+                return
+
+            first_new = len(self._matrix)
+            self._matrix = np.memmap(self._vectors_path, dtype=self._dtype, mode="r", shape=(rows, self.dim))
+            if self._scales is not None:
+                self._scales = np.memmap(self._scales_path, dtype=np.float32, mode="r", shape=(rows,))
+            self._live = np.concatenate([self._live, np.zeros(rows - first_new, dtype=bool)])
+            for row in range(first_new, rows):
+                record = self._records[row]
+                previous = self._positions.get(record["_id"])
+                if previous is not None:
+                    self._live[previous] = False
+                    self._update_keys(self._records[previous], remove=True)
+                if record.get("_deleted"):
+                    self._positions.pop(record["_id"], None)
+                else:
+                    self._positions[record["_id"]] = row
+                    self._live[row] = True
+                    self._update_keys(record)
+
+            if self.mode == "ivf":
+                self._update_ivf(first_new)
+
+    def _refresh_if_grown(self) -> None:
+        """
+        Refresh when the metadata file has grown since the last refresh, so rows
+        appended by other workers or index_tool are searched too. Costs one stat
+        per call when nothing changed.
+        """
+        try:
+            grown = os.path.getsize(self._metadata_path) > self._metadata_offset
+        except OSError:
+            return
+        if grown:
+            self.refresh()
+
+    def add(self, ids: List[str], vectors, metadata: List[Dict]) -> None:
+        """
+        Append vectors with their document ids and metadata.
+        Args:
+            ids: Document ids; an existing id is replaced
+            vectors: Array-like of shape (n, dim)
+            metadata: One metadata dict per vector
+        """
+        vectors = self._normalize(np.asarray(vectors, dtype=np.float32).reshape(-1, self.dim))
+        records = [{"_id": doc_id, "_source": source} for doc_id, source in zip(ids, metadata)]
+        self._append(vectors, records)
+
+    def delete(self, ids: List[str]) -> None:
+        """Remove documents by id."""
+        vectors = np.zeros((len(ids), self.dim), dtype=np.float32)
+        self._append(vectors, [{"_id": doc_id, "_deleted": True} for doc_id in ids])
+
+    def get(self, doc_id: str) -> Optional[Tuple[np.ndarray, Dict]]:
+        """Return the (normalised) vector and metadata of a document, or None."""
+        with self._lock:
+            row = self._positions.get(doc_id)
+            if row is None:
+                return None
+            return self._decode(self._matrix, self._scales, np.array([row]))[0], self._records[row]["_source"]
+
+    def find(self, key: str, value) -> List[Tuple[str, np.ndarray, Dict]]:
+        """
+        Documents whose metadata field key (one of keys) equals value.
+        Returns:
+            List[tuple]: Document id, normalised vector and metadata of each document
+        """
+        with self._lock:
+            self._refresh_if_grown()
+            ids = sorted(self._key_ids[key].get(value, ()))
+            return [(doc_id, *self.get(doc_id)) for doc_id in ids]
+
+    def _update_keys(self, record: Dict, remove: bool = False) -> None:
+        """Add a live record to, or remove a superseded one from, the key lookups."""
+        source = record.get("_source") or {}
+        for key in self.keys:
+            value = source.get(key)
+            if value is None:
+                continue
+            ids = self._key_ids[key].setdefault(value, set())
+            if remove:
+                ids.discard(record["_id"])
+                if not ids:
+                    del self._key_ids[key][value]
+            else:
+                ids.add(record["_id"])
+
+    def search_many(self, queries, k: int) -> List[List[Dict]]:
+        """
+        Find the k most similar documents for each query vector.
+        Args:
+            queries: Array-like of shape (n, dim)
+            k: Number of hits per query
+        Returns:
+            List[list]: Hits per query, best first, each with _id, _score and _source.
+                _score uses the Elasticsearch cosine scale, (1 + cosine) / 2.
+        """
+        queries = self._normalize(np.asarray(queries, dtype=np.float32).reshape(-1, self.dim))
+        with self._lock:
+            self._refresh_if_grown()
+            matrix, scales, live, records = self._matrix, self._scales, self._live, self._records
+            use_ivf = self.mode == "ivf" and self._centroids is not None
+            if use_ivf:
+                lists = self._get_lists()
+                centroids = self._centroids
+
+        if not live.any():
+            return [[] for _ in range(len(queries))]
+
+        results = []
+        candidates = k * self.rescore_oversample
+        if use_ivf:
+            nprobe = min(self.nprobe, len(centroids))
+            probes = np.argpartition(-(queries @ centroids.T), nprobe - 1, axis=1)[:, :nprobe]
+            for query, probe in zip(queries, probes):
+                rows = np.concatenate([lists[c] for c in probe])
+                rows = rows[live[rows]]
+                best, scores = self._top_k(self._decode(matrix, scales, rows) @ query, rows, candidates)
+                results.append(self._hits(*self._rescore(matrix, scales, best, scores, query, k), records))
+        else:
+            scores = self._scores(matrix, scales, queries)
+            scores[~live] = -np.inf
+            for column, query in enumerate(queries):
+                best, best_scores = self._top_k(scores[:, column], None, candidates)
+                results.append(self._hits(*self._rescore(matrix, scales, best, best_scores, query, k), records))
+        return results
+
+    @staticmethod
+    def _top_k(scores: np.ndarray, rows: Optional[np.ndarray], k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Row numbers and scores of the k best (finite) scores, best first."""
+        k = min(k, len(scores))
+        if k == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        best = np.argpartition(-scores, k - 1)[:k]
+        best = best[np.argsort(-scores[best])]
+        best = best[np.isfinite(scores[best])]
+        return (rows[best] if rows is not None else best), scores[best]
+
+    def _rescore(self, matrix: np.ndarray, scales: Optional[np.ndarray], rows: np.ndarray, scores: np.ndarray,
+                 query: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Re-rank candidates of a compact index by the exact cosine of the query
+        with each dequantised row, keeping the best k. float32 rows are exact already.
+        """
+        if self.storage == "float32" or not len(rows):
+            return rows[:k], scores[:k]
+        exact = cosine_similarities(self._decode(matrix, scales, rows), query)
+        order = np.argsort(-exact, kind="stable")[:k]
+        return rows[order], exact[order]
+
+    @staticmethod
+    def _hits(rows: np.ndarray, scores: np.ndarray, records: List[Dict]) -> List[Dict]:
+        """Turn row numbers and cosine scores into search hits."""
+        return [
+            {
+                "_id": records[row]["_id"],
+                "_score": float((1 + score) / 2),
+                "_source": records[row]["_source"]
+            }
+            for row, score in zip(rows.tolist(), scores.tolist())
+        ]
+
+    @staticmethod
+    def _decode(matrix: np.ndarray, scales: Optional[np.ndarray], rows) -> np.ndarray:
+        """Float32 vectors of the given rows (a slice or an array of row numbers)."""
+        if scales is not None:
+            return dequantize_int8(matrix[rows], scales[rows])
+        return np.asarray(matrix[rows], dtype=np.float32)
+
+    def _scores(self, matrix: np.ndarray, scales: Optional[np.ndarray], queries: np.ndarray) -> np.ndarray:
+        """Cosine scores of every row against every query, computed in blocks."""
+        scores = np.empty((len(matrix), len(queries)), dtype=np.float32)
+        for start in range(0, len(matrix), self.BLOCK_SIZE):
+            block = slice(start, start + self.BLOCK_SIZE)
+            scores[block] = self._decode(matrix, scales, block) @ queries.T
+        return scores
+
+    def _encode(self, vectors: np.ndarray) -> Tuple[bytes, Optional[bytes]]:
+        """Rows in the storage format, and their scale factors for int8 storage."""
+        if self.storage == "int8":
+            codes, scales = quantize_int8(vectors)
+            return codes.tobytes(), scales.tobytes()
+        return vectors.astype(self._dtype).tobytes(), None
+
+    def _append(self, vectors: np.ndarray, records: List[Dict]) -> None:
+        """Append rows to the vector and metadata files under an inter-process lock."""
+        lines = "".join(json.dumps(record) + "\n" for record in records).encode("utf-8")
+        rows, scales = self._encode(vectors)
+        with self._lock:
+            with open(os.path.join(self.path, self.LOCK_FILE), "w") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    # Catch up first so rows written by other processes keep their numbers
+                    self.refresh()
+                    with open(self._vectors_path, "ab") as f:
+                        f.write(rows)
+                    if scales is not None:
+                        with open(self._scales_path, "ab") as f:
+                            f.write(scales)
+                    with open(self._metadata_path, "ab") as f:
+                        f.write(lines)
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+            self.refresh()
+
+    def _update_ivf(self, first_new: int) -> None:
+        """Assign new rows to lists, retraining the centroids when the gallery has doubled."""
+        size = len(self._matrix)
+        if size < self.nlist * self.MIN_VECTORS_PER_LIST:
+            self._centroids = None
+            self._trained_size = 0
+            return
+
+        if self._centroids is None or (self._trained_size and size >= 2 * self._trained_size):
+            self._train(size)
+            self._assignments = self._assign(0)
+        elif not self._trained_size:
+            # Centroids were loaded from disk; only the assignments need rebuilding
+            self._trained_size = size
+            self._assignments = self._assign(0)
+        else:
+            self._assignments = np.concatenate([self._assignments[:first_new], self._assign(first_new)])
+        self._lists = None
+
+    def _train(self, size: int) -> None:
+        """Spherical k-means on a sample of the gallery."""
+        rng = np.random.default_rng(0)
+        sample_size = min(size, self.nlist * self.KMEANS_SAMPLE_PER_LIST)
+        sample = self._decode(self._matrix, self._scales, np.sort(rng.choice(size, sample_size, replace=False)))
+        centroids = sample[rng.choice(sample_size, self.nlist, replace=False)]
+        for _ in range(self.KMEANS_ITERATIONS):
+            assignments = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignments, sample)
+            empty = ~sums.any(axis=1)
+            sums[empty] = sample[rng.choice(sample_size, int(empty.sum()))]
+            centroids = self._normalize(sums)
+
+        self._centroids = centroids
+        self._trained_size = size
+        np.save(self._centroids_path, centroids)
+        logger.info(f"Trained {self.nlist} IVF lists on {sample_size} of {size} vectors")
+
+    def _assign(self, first: int) -> np.ndarray:
+        """Nearest centroid of each row from the first given one on."""
+        size = len(self._matrix)
+        assignments = np.empty(size - first, dtype=np.int32)
+        for start in range(first, size, self.BLOCK_SIZE):
+            block = self._decode(self._matrix, self._scales, slice(start, min(start + self.BLOCK_SIZE, size)))
+            assignments[start - first:start - first + len(block)] = np.argmax(block @ self._centroids.T, axis=1)
+        return assignments
+
+    def _get_lists(self) -> List[np.ndarray]:
+        """Row numbers per IVF list, rebuilt lazily after additions."""
+        if self._lists is None:
+            order = np.argsort(self._assignments, kind="stable")
+            bounds = np.searchsorted(self._assignments[order], np.arange(len(self._centroids) + 1))
+            self._lists = [order[bounds[c]:bounds[c + 1]] for c in range(len(self._centroids))]
+        return self._lists
+
+    @staticmethod
+    def _normalize(vectors: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1
+        return (vectors / norms).astype(np.float32)
@@ -0,0 +1,27 @@
+import os
+from typing import Dict, List, Optional, Union
+from app.logger import logger, detail_logger
+
+async def verify_by_image(image: Union[str, bytes], national_id_number: str, service, detection: Optional[Dict] = None, fields: Optional[List[str]] = None) -> dict:
+    """
+    Verify that an image shows the person registered under a national ID.
+    Args:
+        image: Path to the image file or encoded image bytes
+        national_id_number: Claimed identity
+        service: Instance of PersonService
+        detection: Face detection options (see EmbeddingEngine.detection_options)
+        fields: Person fields to return with a match
+    Returns:
+        dict: Verification result (see PersonService.verify_person)
+    """
+    try:
+        if isinstance(image, str) and not os.path.exists(image):
+            error_msg = f"File not found: {image}"
+            logger.error(error_msg)
+            raise FileNotFoundError(error_msg)
+
+        detail_logger.info(f"Verifying image against national ID {national_id_number}")
+        return await service.verify_person(image, national_id_number, detection, fields)
+    except Exception as e:
+        logger.error(f"Error in verify_by_image: {str(e)}", exc_info=True)
+        raise
@@ -0,0 +1,301 @@
+"""
+Search for the people in a video file.
+
+Faces are detected in every frame_stride-th frame and linked into tracks by
+the overlap of their boxes in consecutive sampled frames. Only the best
+frames of each track are embedded, so a face on screen for minutes costs a
+few forward passes instead of hundreds. All embeddings are then searched
+together with _msearch and the matches are merged per track.
+"""
+import asyncio
+import heapq
+import itertools
+import math
+import os
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+import cv2
+from app.embedding_engine import EmbeddingEngine
+from app.person import Person
+from app.metrics import track_stage, run_in_executor
+from app.config import get_settings
+from app.logger import logger, detail_logger
+
+settings = get_settings()
+
+def resolve_video_path(video_path: str, root: str = None) -> str:
+    """
+    Resolve a requested video path, which must name a video file under the video root.
+    Relative paths are relative to the root; symlinks are resolved before the check.
+    Raises:
+        ValueError: If the path is outside the root, not a video file or missing
+    """
+    root = os.path.realpath(root or settings.VIDEO_ROOT)
+    path = os.path.realpath(os.path.join(root, video_path))
+    if os.path.commonpath([root, path]) != root:
+        raise ValueError("video_path must be inside the video directory")
+    if os.path.splitext(path)[1].lower() not in settings.VIDEO_ALLOWED_EXTENSIONS:
+        raise ValueError(f"Invalid video extension. Allowed extensions: {settings.VIDEO_ALLOWED_EXTENSIONS}")
+    if not os.path.isfile(path):
+        raise ValueError(f"Video not found: {video_path}")
+    return path
+
+def box_iou(a: Dict, b: Dict) -> float:
+    """Intersection over union of two facial areas (x, y, w, h)."""
+    width = min(a["x"] + a["w"], b["x"] + b["w"]) - max(a["x"], b["x"])
+    height = min(a["y"] + a["h"], b["y"] + b["h"]) - max(a["y"], b["y"])
+    if width <= 0 or height <= 0:
+        return 0.0
+    intersection = width * height
+    return intersection / (a["w"] * a["h"] + b["w"] * b["h"] - intersection)
+
+def face_quality(frame: np.ndarray, area: Dict, confidence: float) -> float:
+    """
+    How well a detected face should embed: larger, sharper (variance of the
+    Laplacian of the crop) and more confidently detected faces score higher.
+    """
+    crop = frame[max(area["y"], 0):area["y"] + area["h"], max(area["x"], 0):area["x"] + area["w"]]
+    if crop.size == 0:
+        return 0.0
+    sharpness = cv2.Laplacian(cv2.cvtColor(crop, cv2.COLOR_BGR2GRAY), cv2.CV_64F).var()
+    return math.sqrt(area["w"] * area["h"]) * math.log1p(sharpness) * (confidence or 1.0)
+
+class FaceTrack:
+    """One face followed across sampled frames, keeping the model inputs of its best frames."""
+
+    def __init__(self, track_id: int, frames_per_track: int):
+        self.track_id = track_id
+        self.frames_per_track = frames_per_track
+        self.start = None
+        self.end = None
+        self.detections = 0
+        self.last_area = None
+        self.last_seen = None
+        # Min-heap of (quality, order, frame); the order breaks ties without comparing frames
+        self.best = []
+        self._order = itertools.count()
+
+    def add(self, frame_number: int, timestamp: float, face: Dict, quality: float) -> None:
+        if self.start is None:
+            self.start = timestamp
+        self.end = timestamp
+        self.detections += 1
+        self.last_area = face["facial_area"]
+        self.last_seen = frame_number
+        entry = (quality, next(self._order), {"timestamp": timestamp, "facial_area": face["facial_area"], "quality": quality, "face": face["face"]})
+        if len(self.best) < self.frames_per_track:
+            heapq.heappush(self.best, entry)
+        elif quality > self.best[0][0]:
+            heapq.heapreplace(self.best, entry)
+
+    def best_frames(self) -> List[Dict]:
+        """Kept frames, best first."""
+        return [frame for _, _, frame in sorted(self.best, key=lambda entry: entry[0], reverse=True)]
+
+class FaceTracker:
+    """
+    Greedy IoU tracker: each face continues the active track whose last box it
+    overlaps most (at least iou_threshold); other faces start new tracks.
+    Tracks not seen for more than max_gap sampled frames end and are handed
+    to the caller, so only live tracks hold face crops.
+    """
+
+    def __init__(self, iou_threshold: float, max_gap: int, frames_per_track: int):
+        self.iou_threshold = iou_threshold
+        self.max_gap = max_gap
+        self.frames_per_track = frames_per_track
+        self.active: List[FaceTrack] = []
+        self._ids = itertools.count()
+
+    def update(self, frame_number: int, timestamp: float, frame: np.ndarray, faces: List[Dict]) -> List[FaceTrack]:
+        """
+        Add the faces of one sampled frame.
+        Args:
+            frame_number: Index of the sample (not the video frame)
+        Returns:
+            List[FaceTrack]: Tracks that ended
+        """
+        pairs = sorted(
+            ((box_iou(track.last_area, face["facial_area"]), t, f) for t, track in enumerate(self.active) for f, face in enumerate(faces)),
+            reverse=True
+        )
+        matched_tracks, matched_faces = set(), set()
+        for iou, t, f in pairs:
+            if iou < self.iou_threshold:
+                break
+            if t in matched_tracks or f in matched_faces:
+                continue
+            matched_tracks.add(t)
+            matched_faces.add(f)
+            self.active[t].add(frame_number, timestamp, faces[f], face_quality(frame, faces[f]["facial_area"], faces[f]["confidence"]))
+
+        for f, face in enumerate(faces):
+            if f not in matched_faces:
+                track = FaceTrack(next(self._ids), self.frames_per_track)
+                track.add(frame_number, timestamp, face, face_quality(frame, face["facial_area"], face["confidence"]))
+                self.active.append(track)
+
+        ended = [track for track in self.active if frame_number - track.last_seen > self.max_gap]
+        self.active = [track for track in self.active if frame_number - track.last_seen <= self.max_gap]
+        return ended
+
+    def finish(self) -> List[FaceTrack]:
+        """End all tracks."""
+        ended, self.active = self.active, []
+        return ended
+
+def scan_video(path: str, frame_stride: int, detection: Dict, model_name: str = settings.EMBEDDING_MODEL_NAME) -> Dict:
+    """
+    Decode a video at a frame stride, track faces and embed the best frames of each track.
+    Runs in an embedding executor worker; faces of ended tracks are embedded in
+    batches while decoding goes on, so memory is bounded by the live tracks.
+    Args:
+        path: Video file path
+        frame_stride: Detect faces in every n-th frame; the frames between are skipped without conversion
+        detection: Detection options (see EmbeddingEngine.detection_options)
+        model_name: Name of the model to use for embedding
+    Returns:
+        dict: video (fps, duration, frames, sampled_frames) and tracks, each with
+            track_id, start, end, detections and frames (timestamp, facial_area,
+            quality and embedding of each embedded frame, best first)
+    """
+    capture = cv2.VideoCapture(path)
+    if not capture.isOpened():
+        raise ValueError("Video could not be opened")
+    fps = capture.get(cv2.CAP_PROP_FPS) or 0.0
+    model = EmbeddingEngine.get_model(model_name)
+    tracker = FaceTracker(settings.VIDEO_TRACK_IOU, settings.VIDEO_TRACK_MAX_GAP, settings.VIDEO_FRAMES_PER_TRACK)
+    tracks, pending = [], []
+
+    def end_tracks(ended: List[FaceTrack], flush: bool = False) -> None:
+        # Queue the best frames of ended tracks and embed them once a batch is full
+        for track in ended:
+            if track.detections < settings.VIDEO_TRACK_MIN_FRAMES:
+                continue
+            frames = track.best_frames()
+            tracks.append({"track_id": track.track_id, "start": track.start, "end": track.end, "detections": track.detections, "frames": frames})
+            pending.extend(frames)
+        if pending and (flush or len(pending) >= settings.EMBEDDING_BATCH_SIZE):
+            embeddings = EmbeddingEngine.embed_inputs([frame.pop("face") for frame in pending], model_name)
+            for frame, embedding in zip(pending, embeddings):
+                frame["embedding"] = embedding
+            pending.clear()
+
+    frame_index, sample = 0, 0
+    try:
+        while True:
+            with track_stage("video_decode"):
+                # grab() only advances; retrieve() converts the sampled frames
+                if not capture.grab():
+                    break
+                frame = capture.retrieve()[1] if frame_index % frame_stride == 0 else None
+            if frame is not None:
+                timestamp = frame_index / fps if fps else capture.get(cv2.CAP_PROP_POS_MSEC) / 1000
+                try:
+                    faces = EmbeddingEngine.detect_faces(frame, model.input_shape, detection)
+                except ValueError as e:
+                    if "Face could not be detected" not in str(e):
+                        raise
+                    faces = []
+                end_tracks(tracker.update(sample, round(timestamp, 3), frame, faces))
+                sample += 1
+            frame_index += 1
+        end_tracks(tracker.finish(), flush=True)
+    finally:
+        capture.release()
+
+    tracks.sort(key=lambda track: track["track_id"])
+    return {
+        "video": {
+            "fps": fps,
+            "duration": round(frame_index / fps, 3) if fps else None,
+            "frames": frame_index,
+            "sampled_frames": sample
+        },
+        "tracks": tracks
+    }
+
+def merge_track_matches(frames: List[Dict], results: List[Dict], k: int) -> Tuple[List[Dict], Optional[str]]:
+    """
+    Merge the search results of a track's frames: each person keeps its best
+    score, with the timestamp and box of the frame it was matched on.
+    Returns:
+        tuple: Matches, best first (at most k), and the error message if every search failed
+    """
+    matches: Dict[str, Dict] = {}
+    errors = []
+    for frame, result in zip(frames, results):
+        if result.get("status") == "error":
+            errors.append(result["message"])
+            continue
+        for match in result.get("matches", []):
+            if match["id"] not in matches or match["score"] > matches[match["id"]]["score"]:
+                matches[match["id"]] = {**match, "timestamp": frame["timestamp"], "facial_area": frame["facial_area"]}
+    error = errors[0] if errors and len(errors) == len(results) else None
+    return sorted(matches.values(), key=lambda match: match["score"], reverse=True)[:k], error
+
+async def search_video(video_path: str, service, detection: Optional[Dict] = None, search: Optional[Dict] = None, frame_stride: Optional[int] = None) -> Dict:
+    """
+    Search for the people appearing in a video.
+    Args:
+        video_path: Video file path, resolved with resolve_video_path
+        service: Instance of PersonService
+        detection: Face detection options (see EmbeddingEngine.detection_options)
+        search: kNN search options (see PersonRepository.search_options)
+        frame_stride: Detect faces in every n-th frame (default VIDEO_FRAME_STRIDE)
+    Returns:
+        dict: video details and one entry per face track with start, end,
+            status (success, not_found or error) and, when found, the matches
+            (id, score, person, timestamp and facial_area), best first
+    """
+    try:
+        detection = detection or EmbeddingEngine.detection_options()
+        search = search or service.person_repository.search_options()
+        frame_stride = frame_stride or settings.VIDEO_FRAME_STRIDE
+        if frame_stride < 1:
+            raise ValueError("frame_stride must be at least 1")
+        if detection["detector_backend"] == "skip":
+            raise ValueError("Video search needs a face detector")
+        # Without enforce_detection a frame without faces would be embedded whole
+        detection = {**detection, "enforce_detection": True}
+
+        detail_logger.info(f"Scanning video {video_path} at frame stride {frame_stride}")
+        scan = await run_in_executor(Person._executor, scan_video, video_path, frame_stride, detection, settings.EMBEDDING_MODEL_NAME)
+        tracks = scan["tracks"]
+        frames = [frame for track in tracks for frame in track["frames"]]
+        detail_logger.info(f"Found {len(tracks)} face tracks in {scan['video']['sampled_frames']} sampled frames, searching {len(frames)} embeddings")
+
+        # Long videos yield thousands of queries; they are sent as several concurrent _msearch requests
+        chunk_size = settings.SEARCH_BULK_CHUNK_SIZE
+        chunks = await asyncio.gather(*[
+            service.person_repository.search_by_images([frame["embedding"] for frame in frames[start:start + chunk_size]], search)
+            for start in range(0, len(frames), chunk_size)
+        ])
+        results = [result for chunk in chunks for result in chunk]
+        entries = []
+        position = 0
+        for track in tracks:
+            count = len(track["frames"])
+            matches, error = merge_track_matches(track["frames"], results[position:position + count], search["k"])
+            position += count
+            best = track["frames"][0]
+            entry = {
+                "track_id": track["track_id"],
+                "start": track["start"],
+                "end": track["end"],
+                "detections": track["detections"],
+                "best_frame": {"timestamp": best["timestamp"], "facial_area": best["facial_area"]}
+            }
+            if error:
+                entry.update(status="error", message=error)
+            elif matches:
+                entry.update(status="success", matches=matches)
+            else:
+                entry.update(status="not_found")
+            entries.append(entry)
+
+        scan["video"]["frame_stride"] = frame_stride
+        return {"video": scan["video"], "tracks": entries}
+    except Exception as e:
+        logger.error(f"Error in search_video: {str(e)}", exc_info=True)
+        raise
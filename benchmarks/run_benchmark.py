@@ -0,0 +1,320 @@
+"""
+Offline end-to-end benchmark of the API.
+
+DeepFace is replaced by a deterministic stub and Elasticsearch by an in-process
+fake (see benchmarks/stubs.py), and requests are sent straight to the FastAPI
+app over ASGI, so the run needs no network, model weights or cluster. What it
+measures is the app itself: request parsing, validation, executor hand-off,
+batching, caching, repository calls and response building. The simulated
+model latency can be raised to see how the app behaves under a CPU-bound model.
+
+Usage (from the repository root):
+
+    python -m benchmarks.run_benchmark --requests 200 --concurrency 16
+    python -m benchmarks.run_benchmark --compare benchmarks/results/<previous>.json
+
+Each run writes a JSON report (tagged with the git commit) to --output-dir so
+runs on different commits can be compared.
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional
+
+import cv2
+import numpy as np
+
+from benchmarks.stubs import FakeAsyncElasticsearch, StubLatency, install_deepface_stub
+
+ENDPOINTS = ("register", "register-bulk", "search")
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Offline benchmark of the register and search endpoints")
+    parser.add_argument("--endpoints", default=",".join(ENDPOINTS), help="comma separated subset of: " + ", ".join(ENDPOINTS))
+    parser.add_argument("--requests", type=int, default=200, help="requests per endpoint")
+    parser.add_argument("--concurrency", type=int, default=16, help="requests in flight")
+    parser.add_argument("--bulk-size", type=int, default=20, help="persons per /register-bulk/ request")
+    parser.add_argument("--image-size", type=int, default=480, help="side of the generated JPEG images, in pixels")
+    parser.add_argument("--repeat-fraction", type=float, default=0.0, help="fraction of searches that repeat an earlier probe")
+    parser.add_argument("--backend", choices=("elasticsearch", "local"), default="elasticsearch", help="REPOSITORY_BACKEND to run against")
+    parser.add_argument("--detector-latency-ms", type=float, default=0.0, help="simulated detection time per image")
+    parser.add_argument("--model-latency-ms", type=float, default=0.0, help="simulated time per model call")
+    parser.add_argument("--model-item-latency-ms", type=float, default=0.0, help="simulated time per face in a model call")
+    parser.add_argument("--output-dir", default=os.path.join("benchmarks", "results"))
+    parser.add_argument("--compare", help="previous report to compare against")
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args(argv)
+
+def configure_environment(args: argparse.Namespace, workdir: str) -> None:
+    """Point the app at scratch folders and the stubs; must run before the app is imported."""
+    os.environ.update({
+        "SERVER_HOST": "localhost",
+        "DATASET_FOLDER": os.path.join(workdir, "persons"),
+        "DATASET_LOST_FOLDER": os.path.join(workdir, "lost-persons"),
+        "VECTOR_INDEX_PATH": os.path.join(workdir, "vector-index"),
+        "LOG_FILE": os.path.join(workdir, "app.log"),
+        "REPOSITORY_BACKEND": args.backend,
+        # Worker processes would import the real DeepFace, not the stub
+        "EMBEDDING_EXECUTOR": "thread",
+    })
+    StubLatency.detector = args.detector_latency_ms / 1000
+    StubLatency.model_call = args.model_latency_ms / 1000
+    StubLatency.model_item = args.model_item_latency_ms / 1000
+    install_deepface_stub()
+
+def make_image(rng: np.random.Generator, size: int) -> bytes:
+    """A random but smooth JPEG, so every image gets a distinct embedding."""
+    small = rng.integers(0, 256, size=(8, 8, 3), dtype=np.uint8)
+    image = cv2.resize(small, (size, size), interpolation=cv2.INTER_LINEAR)
+    ok, encoded = cv2.imencode(".jpg", image)
+    if not ok:
+        raise RuntimeError("Could not encode benchmark image")
+    return encoded.tobytes()
+
+def make_person(idx: int) -> Dict[str, str]:
+    return {
+        "full_name": f"Benchmark Person {idx}",
+        "birth_place": "Jakarta",
+        "birth_date": "1990-01-01",
+        "address": f"Jalan Benchmark {idx}",
+        "nationality": "Indonesia",
+        "passport_number": f"P{idx:08d}",
+        "gender": "M" if idx % 2 else "F",
+        "national_id_number": f"{idx:016d}",
+        "marital_status": "single"
+    }
+
+def current_rss_mb() -> Optional[float]:
+    """Resident set size of this process now, or None when it cannot be read."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import psutil
+    except ImportError:
+        return None
+    return psutil.Process().memory_info().rss / (1024 * 1024)
+
+class RSSSampler:
+    """
+    Samples the RSS in a background thread while a phase runs, so each phase
+    reports its own peak (ru_maxrss would be the peak of the whole process,
+    including earlier phases) and how far it grew above its starting point.
+    """
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.start_mb = None
+        self.peak_mb = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+
+    def _sample(self) -> None:
+        while True:
+            rss = current_rss_mb()
+            if rss is not None:
+                self.peak_mb = max(self.peak_mb or rss, rss)
+            if self._stop.wait(self.interval):
+                return
+
+    def __enter__(self) -> "RSSSampler":
+        self.start_mb = current_rss_mb()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._stop.set()
+        self._thread.join()
+
+def percentile(values: List[float], q: float) -> float:
+    return float(np.percentile(values, q)) if values else 0.0
+
+async def run_phase(name: str, requests: List[Callable], concurrency: int, items_per_request: int = 1) -> Dict:
+    """Send the requests with at most `concurrency` in flight and summarise the latencies."""
+    latencies: List[float] = []
+    errors: Dict[str, int] = {}
+    queue: asyncio.Queue = asyncio.Queue()
+    for send in requests:
+        queue.put_nowait(send)
+
+    async def worker():
+        while not queue.empty():
+            send = queue.get_nowait()
+            start = time.perf_counter()
+            try:
+                response = await send()
+                failure = None if response.status_code < 400 else f"HTTP {response.status_code}"
+            except Exception as e:
+                failure = type(e).__name__
+            latencies.append(time.perf_counter() - start)
+            if failure:
+                errors[failure] = errors.get(failure, 0) + 1
+
+    started = time.perf_counter()
+    with RSSSampler() as rss:
+        await asyncio.gather(*[worker() for _ in range(max(1, concurrency))])
+    elapsed = time.perf_counter() - started
+
+    latencies_ms = [latency * 1000 for latency in latencies]
+    result = {
+        "requests": len(latencies),
+        "errors": sum(errors.values()),
+        "error_types": errors,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "items_per_s": round(len(latencies) * items_per_request / elapsed, 2) if elapsed else 0.0,
+        "latency_ms": {
+            "mean": round(float(np.mean(latencies_ms)), 2) if latencies_ms else 0.0,
+            "p50": round(percentile(latencies_ms, 50), 2),
+            "p95": round(percentile(latencies_ms, 95), 2),
+            "p99": round(percentile(latencies_ms, 99), 2),
+            "max": round(max(latencies_ms, default=0.0), 2)
+        },
+        # Peak during this phase, and its growth over the RSS the phase started with
+        "peak_rss_mb": round(rss.peak_mb, 1) if rss.peak_mb is not None else None,
+        "rss_growth_mb": round(rss.peak_mb - rss.start_mb, 1) if rss.peak_mb is not None and rss.start_mb is not None else None
+    }
+    print(f"{name:>14}: {result['requests']} requests, {result['errors']} errors, "
+          f"{result['throughput_rps']} req/s, p50 {result['latency_ms']['p50']} ms, "
+          f"p95 {result['latency_ms']['p95']} ms, p99 {result['latency_ms']['p99']} ms, "
+          f"peak RSS {result['peak_rss_mb']} MB (+{result['rss_growth_mb']} MB)")
+    return result
+
+async def run(args: argparse.Namespace) -> Dict:
+    import httpx
+    from app.util import Util
+    from app.main import app
+
+    Util.get_connection = staticmethod(FakeAsyncElasticsearch)
+    endpoints = [endpoint.strip() for endpoint in args.endpoints.split(",") if endpoint.strip()]
+    unknown = set(endpoints) - set(ENDPOINTS)
+    if unknown:
+        raise SystemExit(f"Unknown endpoints: {', '.join(sorted(unknown))}")
+
+    rng = np.random.default_rng(args.seed)
+    results = {}
+    registered: List[bytes] = []
+
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=None) as client:
+
+            if "register" in endpoints:
+                def register_request(idx: int, image: bytes):
+                    return lambda: client.post("/register/", data=make_person(idx), files={"image": (f"person-{idx}.jpg", image, "image/jpeg")})
+
+                images = [make_image(rng, args.image_size) for _ in range(args.requests)]
+                registered.extend(images)
+                requests = [register_request(idx, image) for idx, image in enumerate(images)]
+                results["register"] = await run_phase("register", requests, args.concurrency)
+
+            if "register-bulk" in endpoints:
+                def bulk_request(first: int, images: List[bytes]):
+                    persons = [make_person(first + offset) for offset in range(len(images))]
+                    files = [("files", (f"person-{first + offset}.jpg", image, "image/jpeg")) for offset, image in enumerate(images)]
+                    return lambda: client.post("/register-bulk/", data={"persons_data": json.dumps(persons)}, files=files)
+
+                requests = []
+                first = len(registered)
+                for _ in range(max(1, args.requests // args.bulk_size)):
+                    images = [make_image(rng, args.image_size) for _ in range(args.bulk_size)]
+                    registered.extend(images)
+                    requests.append(bulk_request(first, images))
+                    first += args.bulk_size
+                results["register-bulk"] = await run_phase("register-bulk", requests, args.concurrency, args.bulk_size)
+
+            if "search" in endpoints:
+                def search_request(idx: int, image: bytes):
+                    return lambda: client.post("/search/", files={"image": (f"probe-{idx}.jpg", image, "image/jpeg")})
+
+                probes = []
+                for idx in range(args.requests):
+                    if probes and rng.random() < args.repeat_fraction:
+                        probes.append(probes[int(rng.integers(len(probes)))])
+                    elif registered and idx % 2 == 0:
+                        probes.append(registered[int(rng.integers(len(registered)))])
+                    else:
+                        probes.append(make_image(rng, args.image_size))
+                requests = [search_request(idx, probe) for idx, probe in enumerate(probes)]
+                results["search"] = await run_phase("search", requests, args.concurrency)
+
+            stages = await stage_summary(client)
+            if stages:
+                results["stages"] = stages
+
+    return results
+
+async def stage_summary(client) -> Dict:
+    """Mean time per processing stage over the whole run, from the app's /metrics endpoint."""
+    from prometheus_client.parser import text_string_to_metric_families
+
+    response = await client.get("/metrics")
+    if response.status_code != 200:
+        return {}
+    totals: Dict[str, Dict[str, float]] = {}
+    for family in text_string_to_metric_families(response.text):
+        if family.name != "image_search_stage_seconds":
+            continue
+        for sample in family.samples:
+            if sample.name.endswith(("_sum", "_count")):
+                totals.setdefault(sample.labels["stage"], {})[sample.name.rsplit("_", 1)[1]] = sample.value
+    return {
+        stage: {"count": int(values["count"]), "mean_ms": round(values["sum"] / values["count"] * 1000, 3)}
+        for stage, values in totals.items() if values.get("count")
+    }
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True, stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+def compare(report: Dict, baseline: Dict) -> None:
+    """Print the change of the headline numbers against a previous report."""
+    print(f"\nCompared with {baseline.get('commit', 'unknown')} ({baseline.get('timestamp', '')}):")
+    for endpoint, result in report["results"].items():
+        previous = baseline.get("results", {}).get(endpoint)
+        if not previous or endpoint == "stages":
+            continue
+        rows = [("throughput_rps", result["throughput_rps"], previous["throughput_rps"])]
+        rows += [(f"{q} ms", result["latency_ms"][q], previous["latency_ms"][q]) for q in ("p50", "p95", "p99")]
+        # Reports written before per-phase sampling have a process-wide peak and no growth; skip those
+        if "rss_growth_mb" in previous:
+            rows += [(metric, result[metric], previous[metric]) for metric in ("peak_rss_mb", "rss_growth_mb")]
+        for metric, current, before in rows:
+            change = f"{(current - before) / before * 100:+.1f}%" if before and current is not None else "n/a"
+            before, current = ("n/a" if value is None else value for value in (before, current))
+            print(f"{endpoint:>14} {metric:>14}: {before:>10} -> {current:>10} ({change})")
+
+def main(argv=None) -> None:
+    args = parse_args(argv)
+    with tempfile.TemporaryDirectory(prefix="benchmark-") as workdir:
+        configure_environment(args, workdir)
+        results = asyncio.run(run(args))
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "config": vars(args),
+        "results": results
+    }
+    os.makedirs(args.output_dir, exist_ok=True)
+    output_path = os.path.join(args.output_dir, f"{report['commit']}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+    with open(output_path, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nReport written to {output_path}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(report, json.load(f))
+
+if __name__ == "__main__":
+    main()
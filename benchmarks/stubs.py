@@ -0,0 +1,296 @@
+"""
+Offline stand-ins for the benchmark suite.
+
+- A deterministic stub of the deepface package: embeddings are derived from
+  the image pixels, so the same image always gets the same embedding and
+  searches for registered images find them.
+- FakeAsyncElasticsearch, an in-process stand-in for the parts of the
+  Elasticsearch API the app uses (index management, index/bulk, kNN and term
+  search, msearch, get/mget).
+"""
+import json
+import sys
+import time
+import types
+import numpy as np
+import cv2
+
+EMBEDDING_DIMS = 128
+INPUT_SHAPE = (160, 160)
+POOL = 20  # 160x160 faces are average-pooled to 8x8x3 features
+
+class StubLatency:
+    """Simulated CPU cost of detection and inference, in seconds."""
+    detector = 0.0
+    model_call = 0.0
+    model_item = 0.0
+
+class _Tensor:
+    def __init__(self, value: np.ndarray):
+        self._value = value
+
+    def numpy(self) -> np.ndarray:
+        return self._value
+
+class _StubKerasModel:
+    """Callable like a Keras model: batch of faces in, batch of embeddings out."""
+    _projection = np.random.default_rng(42).normal(size=((INPUT_SHAPE[0] // POOL) * (INPUT_SHAPE[1] // POOL) * 3, EMBEDDING_DIMS))
+
+    def __call__(self, batch: np.ndarray, training: bool = False) -> _Tensor:
+        batch = np.asarray(batch, dtype=np.float32)
+        time.sleep(StubLatency.model_call + StubLatency.model_item * len(batch))
+        n, h, w, c = batch.shape
+        features = batch.reshape(n, h // POOL, POOL, w // POOL, POOL, c).mean(axis=(2, 4)).reshape(n, -1)
+        # Centre the features so different images point in different directions
+        features = features - features.mean(axis=1, keepdims=True)
+        return _Tensor(features @ self._projection)
+
+class _StubRecognitionModel:
+    input_shape = INPUT_SHAPE
+
+    def __init__(self):
+        self.model = _StubKerasModel()
+
+    def forward(self, img: np.ndarray):
+        return self.model(img).numpy()[0].tolist()
+
+_models = {}
+
+def _load(img_path):
+    if isinstance(img_path, np.ndarray):
+        return img_path
+    image = cv2.imread(img_path)
+    if image is None:
+        raise ValueError(f"Exception while loading {img_path}")
+    return image
+
+def build_model(model_name: str, task: str = "facial_recognition"):
+    if task != "facial_recognition":
+        return None
+    if model_name not in _models:
+        _models[model_name] = _StubRecognitionModel()
+    return _models[model_name]
+
+def extract_faces(img_path, detector_backend: str = "opencv", enforce_detection: bool = True, align: bool = True,
+                  expand_percentage: int = 0, grayscale: bool = False, color_face: str = "rgb",
+                  normalize_face: bool = True, anti_spoofing: bool = False):
+    """Treat the whole image as one face; a flat (blank) image has no face."""
+    image = _load(img_path)
+    if detector_backend != "skip":
+        time.sleep(StubLatency.detector)
+        if enforce_detection and image.std() < 1:
+            raise ValueError("Face could not be detected. Please confirm that the picture is a face photo "
+                             "or consider to set enforce_detection param to False.")
+    face = cv2.resize(image, (INPUT_SHAPE[1], INPUT_SHAPE[0]))[:, :, ::-1]
+    if normalize_face:
+        face = face / 255
+    height, width = image.shape[:2]
+    return [{
+        "face": face,
+        "facial_area": {"x": 0, "y": 0, "w": width, "h": height, "left_eye": None, "right_eye": None},
+        "confidence": 1.0
+    }]
+
+def represent(img_path, model_name: str = "VGG-Face", enforce_detection: bool = True, detector_backend: str = "opencv",
+              align: bool = True, expand_percentage: int = 0, normalization: str = "base", **kwargs):
+    model = build_model(model_name)
+    results = []
+    for face_obj in extract_faces(img_path, detector_backend=detector_backend, enforce_detection=enforce_detection, align=align):
+        face = resize_image(face_obj["face"], (INPUT_SHAPE[1], INPUT_SHAPE[0]))
+        results.append({
+            "embedding": model.forward(face),
+            "facial_area": face_obj["facial_area"],
+            "face_confidence": face_obj["confidence"]
+        })
+    return results
+
+def resize_image(img: np.ndarray, target_size) -> np.ndarray:
+    img = np.asarray(img, dtype=np.float32)
+    if img.shape[:2] != tuple(target_size):
+        img = cv2.resize(img, (target_size[1], target_size[0]))
+    return np.expand_dims(img, axis=0)
+
+def normalize_input(img: np.ndarray, normalization: str = "base") -> np.ndarray:
+    return img
+
+def install_deepface_stub() -> None:
+    """Register the stub as the deepface package, before the app imports it."""
+    deepface = types.ModuleType("deepface")
+    deepface_api = types.ModuleType("deepface.DeepFace")
+    modules = types.ModuleType("deepface.modules")
+    preprocessing = types.ModuleType("deepface.modules.preprocessing")
+
+    for name in ("build_model", "extract_faces", "represent"):
+        setattr(deepface_api, name, globals()[name])
+    preprocessing.resize_image = resize_image
+    preprocessing.normalize_input = normalize_input
+    deepface.DeepFace = deepface_api
+    deepface.modules = modules
+    modules.preprocessing = preprocessing
+
+    sys.modules["deepface"] = deepface
+    sys.modules["deepface.DeepFace"] = deepface_api
+    sys.modules["deepface.modules"] = modules
+    sys.modules["deepface.modules.preprocessing"] = preprocessing
+
+class FakeResponse(dict):
+    """Dict that also exposes .body, like the client's ObjectApiResponse."""
+
+    @property
+    def body(self):
+        return self
+
+class _Serializer:
+    @staticmethod
+    def dumps(data) -> str:
+        if isinstance(data, (str, bytes)):
+            return data
+        return json.dumps(data, default=lambda value: value.tolist() if hasattr(value, "tolist") else str(value))
+
+    @staticmethod
+    def loads(data):
+        return json.loads(data)
+
+class _Serializers:
+    def get_serializer(self, mimetype: str) -> _Serializer:
+        return _Serializer()
+
+class _Transport:
+    serializers = _Serializers()
+
+class _FakeIndices:
+    def __init__(self, es: "FakeAsyncElasticsearch"):
+        self._es = es
+
+    async def exists(self, index: str, **kwargs) -> bool:
+        return self._es._resolve(index) in self._es._indices
+
+    async def create(self, index: str, body: dict = None, **kwargs) -> FakeResponse:
+        body = body or {}
+        self._es._indices.setdefault(index, {
+            "docs": {},
+            "settings": dict(body.get("settings", {})),
+            "mappings": body.get("mappings", kwargs.get("mappings", {}))
+        })
+        for alias in body.get("aliases", {}):
+            self._es._aliases[alias] = index
+        return FakeResponse(acknowledged=True, index=index)
+
+    async def delete(self, index: str, **kwargs) -> FakeResponse:
+        self._es._indices.pop(self._es._resolve(index), None)
+        return FakeResponse(acknowledged=True)
+
+class FakeAsyncElasticsearch:
+    """In-process stand-in for AsyncElasticsearch with exact cosine kNN."""
+
+    def __init__(self):
+        self._indices = {}
+        self._aliases = {}
+        self.indices = _FakeIndices(self)
+        self.transport = _Transport()
+        self._client_meta = ()
+
+    def options(self, **kwargs) -> "FakeAsyncElasticsearch":
+        return self
+
+    async def close(self) -> None:
+        pass
+
+    def _resolve(self, index: str) -> str:
+        return self._aliases.get(index, index)
+
+    def _docs(self, index: str) -> dict:
+        return self._indices[self._resolve(index)]["docs"]
+
+    async def index(self, index: str, document: dict, id: str = None, **kwargs) -> FakeResponse:
+        doc_id = id or f"doc-{len(self._docs(index))}"
+        self._docs(index)[doc_id] = json.loads(_Serializer.dumps(document))
+        return FakeResponse(_index=self._resolve(index), _id=doc_id, result="created")
+
+    async def bulk(self, operations: list, index: str = None, **kwargs) -> FakeResponse:
+        lines = [json.loads(op) if isinstance(op, (str, bytes)) else op for op in operations]
+        items = []
+        position = 0
+        while position < len(lines):
+            op_type, action = next(iter(lines[position].items()))
+            target = action.get("_index", index)
+            doc_id = action.get("_id") or f"doc-{len(self._docs(target))}"
+            if op_type == "delete":
+                self._docs(target).pop(doc_id, None)
+                position += 1
+            else:
+                self._docs(target)[doc_id] = json.loads(_Serializer.dumps(lines[position + 1]))
+                position += 2
+            items.append({op_type: {"_index": self._resolve(target), "_id": doc_id, "status": 200}})
+        return FakeResponse(errors=False, items=items)
+
+    async def get(self, index: str, id: str, **kwargs) -> FakeResponse:
+        source = self._docs(index).get(id)
+        return FakeResponse(_index=self._resolve(index), _id=id, found=source is not None, _source=source)
+
+    async def mget(self, index: str, ids: list, source=None, **kwargs) -> FakeResponse:
+        docs = []
+        for doc_id in ids:
+            document = self._docs(index).get(doc_id)
+            if document is None:
+                docs.append({"_id": doc_id, "found": False})
+            else:
+                docs.append({"_id": doc_id, "found": True, "_source": self._filter_source(document, source)})
+        return FakeResponse(docs=docs)
+
+    async def search(self, index: str, body: dict = None, **kwargs) -> FakeResponse:
+        body = dict(body or {}, **{key: value for key, value in kwargs.items() if key in ("knn", "query", "size", "source")})
+        return self._search(index, body)
+
+    async def msearch(self, searches: list, index: str = None, **kwargs) -> FakeResponse:
+        responses = []
+        for header, body in zip(searches[::2], searches[1::2]):
+            responses.append(self._search(header.get("index", index), body))
+        return FakeResponse(responses=responses)
+
+    def _search(self, index: str, body: dict) -> FakeResponse:
+        if "knn" not in body:
+            return self._term_search(index, body)
+        knn = body["knn"]
+        query = np.asarray(knn["query_vector"], dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1)
+
+        hits = []
+        for doc_id, document in self._docs(index).items():
+            vector = np.asarray(document.get(knn["field"]) or [], dtype=np.float32)
+            if vector.shape != query.shape:
+                continue
+            cosine = float(vector @ query / (np.linalg.norm(vector) or 1))
+            if knn.get("similarity") is not None and cosine < knn["similarity"]:
+                continue
+            hits.append((cosine, doc_id, document))
+
+        hits.sort(key=lambda hit: hit[0], reverse=True)
+        size = body.get("size", knn["k"])
+        source = body.get("_source", body.get("source"))
+        return FakeResponse(hits={
+            "total": {"value": len(hits), "relation": "eq"},
+            "hits": [
+                {"_index": self._resolve(index), "_id": doc_id, "_score": (1 + cosine) / 2, "_source": self._filter_source(document, source)}
+                for cosine, doc_id, document in hits[:min(size, knn["k"])]
+            ]
+        })
+
+    def _term_search(self, index: str, body: dict) -> FakeResponse:
+        """Only the single term query the app uses for keyed lookups."""
+        field, value = next(iter(body["query"]["term"].items()))
+        source = body.get("_source", body.get("source"))
+        hits = [
+            {"_index": self._resolve(index), "_id": doc_id, "_score": 1.0, "_source": self._filter_source(document, source)}
+            for doc_id, document in self._docs(index).items()
+            if document.get(field) == value
+        ]
+        return FakeResponse(hits={"total": {"value": len(hits), "relation": "eq"}, "hits": hits[:body.get("size", 10)]})
+
+    @staticmethod
+    def _filter_source(document: dict, source) -> dict:
+        if source is None or source is True:
+            return document
+        if source is False:
+            return {}
+        return {field: document[field] for field in source if field in document}
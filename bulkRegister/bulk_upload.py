@@ -1,558 +1,300 @@
-import requests
+"""
+Bulk registration client for the /register-bulk/stream/ endpoint.
+
+Persons come from a manifest (CSV with a header row, or JSON lines) with an
+image_path column plus the person fields, or from a directory of images, where
+the full name is taken from the file name and the other fields from --defaults
+(or from a <image>.json file next to the image).
+
+Items are checked before upload (image file, required fields, birth date
+format), then sent in chunks, several chunks at a time over one HTTP session;
+the server reports every item of a chunk on its own.
+Every finished item is appended to a resume file, so an interrupted load
+started again with the same resume file only sends what is left. Registration
+is idempotent (documents are keyed by national ID or image hash), so
+re-sending a chunk after a timeout is safe.
+
+Usage:
+
+    python bulkRegister/bulk_upload.py --url http://localhost:8000 --manifest persons.csv
+    python bulkRegister/bulk_upload.py --dir dataset/register \\
+        --defaults '{"birth_place": "Bekasi", "birth_date": "1990-01-01", ...}' \\
+        --chunk-size 32 --concurrency 4 --resume-file register.progress.jsonl
+"""
+import argparse
+import asyncio
+import csv
 import json
+import mimetypes
 import os
-from pathlib import Path
-
-def bulk_register_persons(base_url: str, persons_data: list, image_paths: list):
-    """
-    Register multiple persons with their images.
-    
-    Args:
-        base_url: API base URL (e.g., "http://localhost:8000")
-        persons_data: List of dictionaries containing person information
-        image_paths: List of paths to image files, must match order of persons_data
-    """
-    try:
-        # Validasi jumlah data dan gambar
-        if len(persons_data) != len(image_paths):
-            raise ValueError("Jumlah data person harus sama dengan jumlah gambar")
-            
-        # Siapkan file gambar untuk upload
-        files = []
-        for i, image_path in enumerate(image_paths):
-            # Pastikan file exists
-            if not os.path.exists(image_path):
-                raise FileNotFoundError(f"File tidak ditemukan: {image_path}")
-                
-            # Buka file gambar dan tambahkan ke list files
-            # Parameter 'files' adalah nama field yang diexpect oleh API
-            files.append(
-                ('files', (
-                    os.path.basename(image_path),  # nama file
-                    open(image_path, 'rb'),        # file object dalam mode binary
-                    'image/jpeg'                   # mime type
-                ))
-            )
-        
-        # Siapkan data untuk request
-        request_data = {
-            'persons_data': json.dumps(persons_data),  # Convert list ke JSON string
-            'enforce_detection': 'true'
-        }
-        
-        # Kirim request ke endpoint bulk register
-        print("Mengirim request bulk registration...")
-        response = requests.post(
-            f'{base_url}/register-bulk/',
-            files=files,    # List of tuples untuk file upload
-            data=request_data  # Data tambahan (persons_data dan enforce_detection)
-        )
-        
-        # Tampilkan hasil
-        if response.status_code == 200:
-            result = response.json()
-            print("\nHasil Registration:")
-            print(f"Status: {result['status']}")
-            print(f"Total: {result['total']}")
-            print(f"Sukses: {result['successful']}")
-            print(f"Gagal: {result['failed']}")
-            print("\nDetail hasil:")
-            for r in result['results']:
-                print(f"- {r['data']['full_name']}: {r['status']}")
+import sys
+import time
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional, Set
+
+import aiohttp
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png"}
+PERSON_FIELDS = (
+    "full_name", "birth_place", "birth_date", "address", "nationality",
+    "passport_number", "gender", "national_id_number", "marital_status"
+)
+# Fields the server rejects an item without
+REQUIRED_FIELDS = ("full_name", "birth_date", "gender")
+# Statuses after which an item is not sent again on resume
+DONE_STATUSES = {"success", "unchanged"}
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Register many persons through /register-bulk/stream/")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--manifest", help="CSV (with header) or JSONL file with image_path and person fields")
+    source.add_argument("--dir", help="directory of images; the file name is the full name")
+    parser.add_argument("--defaults", default="{}", help="JSON object of person fields for items that lack them")
+    parser.add_argument("--url", default="http://localhost:8000", help="API base URL")
+    parser.add_argument("--chunk-size", type=int, default=32, help="persons per request")
+    parser.add_argument("--concurrency", type=int, default=4, help="requests in flight")
+    parser.add_argument("--retries", type=int, default=3, help="retries of unreported items after a connection error, timeout or 5xx")
+    parser.add_argument("--timeout", type=float, default=300.0, help="seconds per request")
+    parser.add_argument("--resume-file", help="progress file; finished items listed in it are skipped (default: <input>.progress.jsonl)")
+    parser.add_argument("--failures-file", help="write failed items as JSON lines (default: <input>.failures.jsonl)")
+    parser.add_argument("--detector-backend", help="face detector used by the server")
+    parser.add_argument("--no-enforce-detection", action="store_true", help="register images even when no face is detected")
+    return parser.parse_args(argv)
+
+def read_manifest(path: str) -> Iterator[Dict]:
+    """Items of a CSV or JSONL manifest; relative image paths are relative to the manifest."""
+    base = os.path.dirname(os.path.abspath(path))
+    with open(path, newline="", encoding="utf-8") as f:
+        if path.lower().endswith((".jsonl", ".ndjson")):
+            rows = (json.loads(line) for line in f if line.strip())
         else:
-            print(f"Error: {response.status_code}")
-            print(response.json())
-            
-    except Exception as e:
-        print(f"Error: {str(e)}")
+            rows = csv.DictReader(f)
+        for row in rows:
+            image_path = row.pop("image_path", None)
+            yield {"image_path": os.path.join(base, image_path) if image_path else "", "person": row}
+
+def scan_directory(path: str) -> Iterator[Dict]:
+    """Items for every image under a directory, in a stable order."""
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for name in sorted(files):
+            stem, ext = os.path.splitext(name)
+            if ext.lower() not in IMAGE_EXTENSIONS:
+                continue
+            image_path = os.path.join(root, name)
+            person = {"full_name": stem.replace("_", " ")}
+            sidecar = os.path.join(root, f"{stem}.json")
+            if os.path.exists(sidecar):
+                with open(sidecar, encoding="utf-8") as f:
+                    person.update(json.load(f))
+            yield {"image_path": image_path, "person": person}
+
+def validate_item(item: Dict) -> Optional[str]:
+    """Why an item cannot be registered, checked before upload, or None if it can."""
+    if not item["image_path"]:
+        return "No image_path for this person"
+    if not os.path.isfile(item["image_path"]):
+        return "Image file not found"
+    person = item["person"]
+    missing = [field for field in REQUIRED_FIELDS if not str(person.get(field) or "").strip()]
+    if missing:
+        return f"Missing {', '.join(missing)}"
+    try:
+        datetime.strptime(str(person["birth_date"]), "%Y-%m-%d")
+    except ValueError:
+        return "Invalid birth date format. Use YYYY-MM-DD"
+    return None
+
+def item_key(item: Dict) -> str:
+    """Identifies an item in the resume file."""
+    return f"{os.path.abspath(item['image_path']) if item['image_path'] else ''}|{item['person'].get('national_id_number') or ''}"
+
+def load_done(resume_file: str) -> Set[str]:
+    """Keys of items already registered according to the resume file."""
+    done = set()
+    if not os.path.exists(resume_file):
+        return done
+    with open(resume_file, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # A crash can leave the last line incomplete
+                continue
+            if record.get("status") in DONE_STATUSES:
+                done.add(record["key"])
+            else:
+                done.discard(record["key"])
+    return done
+
+def chunked(items: List[Dict], size: int) -> Iterator[List[Dict]]:
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+class BulkUploader:
+    """Sends chunks concurrently over one session and records every item's outcome."""
+
+    def __init__(self, args: argparse.Namespace, resume_file: str, failures_file: str, total: int):
+        self.args = args
+        self.resume = open(resume_file, "a", encoding="utf-8")
+        self.failures = open(failures_file, "a", encoding="utf-8")
+        self.total = total
+        self.counts: Dict[str, int] = {}
+        self.done = 0
+        self.started = time.monotonic()
+
+    def close(self) -> None:
+        self.resume.close()
+        self.failures.close()
+
+    def record(self, item: Dict, status: str, message: Optional[str] = None) -> None:
+        """Log the outcome of one item in the resume file, and in the failures file if it failed."""
+        self.counts[status] = self.counts.get(status, 0) + 1
+        self.done += 1
+        entry = {"key": item_key(item), "status": status}
+        self.resume.write(json.dumps(entry) + "\n")
+        if status not in DONE_STATUSES:
+            self.failures.write(json.dumps({
+                "image_path": item["image_path"],
+                "full_name": item["person"].get("full_name"),
+                "national_id_number": item["person"].get("national_id_number"),
+                "status": status,
+                "message": message
+            }) + "\n")
+
+    def flush(self) -> None:
+        self.resume.flush()
+        os.fsync(self.resume.fileno())
+        self.failures.flush()
+
+    async def send_chunk(self, session: aiohttp.ClientSession, chunk: List[Dict]) -> None:
+        """
+        Upload one chunk to the streaming endpoint, which reports every item on
+        its own, and record the outcomes. Items are not retried after a
+        rejection; only items left without a result by a connection error,
+        timeout or 5xx are sent again.
+        """
+        pending = []
+        for item in chunk:
+            problem = validate_item(item)
+            if problem:
+                self.record(item, "error", problem)
+            else:
+                pending.append(item)
+
+        contents = await asyncio.gather(*[asyncio.to_thread(read_file, item["image_path"]) for item in pending])
+        content_of = {id(item): content for item, content in zip(pending, contents)}
+        attempt = 0
+        while pending:
+            form = aiohttp.FormData()
+            # The endpoint needs persons_data and the options before the files
+            form.add_field("persons_data", json.dumps([item["person"] for item in pending]))
+            form.add_field("enforce_detection", "false" if self.args.no_enforce_detection else "true")
+            if self.args.detector_backend:
+                form.add_field("detector_backend", self.args.detector_backend)
+            for item in pending:
+                name = os.path.basename(item["image_path"])
+                form.add_field("files", content_of[id(item)], filename=name, content_type=mimetypes.guess_type(name)[0] or "application/octet-stream")
+
+            reported = set()
+            try:
+                async with session.post(f"{self.args.url.rstrip('/')}/register-bulk/stream/", data=form) as response:
+                    if response.status != 200:
+                        error = f"HTTP {response.status}: {(await response.text())[:200]}"
+                        if response.status < 500:
+                            for item in pending:
+                                self.record(item, "error", error)
+                            pending = []
+                    else:
+                        error = "Response ended early"
+                        async for line in response.content:
+                            if not line.strip():
+                                continue
+                            result = json.loads(line)
+                            if "index" in result:
+                                if result["index"] < len(pending) and result["index"] not in reported:
+                                    reported.add(result["index"])
+                                    self.record(pending[result["index"]], result["status"], result.get("error") or result.get("message"))
+                            elif result.get("status") == "aborted":
+                                # The server gave up on the rest of the chunk, e.g. invalid persons_data
+                                for idx, item in enumerate(pending):
+                                    if idx not in reported:
+                                        self.record(item, "error", result.get("error"))
+                                reported = set(range(len(pending)))
+                        pending = [item for idx, item in enumerate(pending) if idx not in reported]
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+                # ValueError: a line that is not JSON, e.g. from a proxy
+                error = f"{type(e).__name__}: {e}"
+                pending = [item for idx, item in enumerate(pending) if idx not in reported]
+            self.flush()
+
+            if pending:
+                attempt += 1
+                if attempt > self.args.retries:
+                    for item in pending:
+                        self.record(item, "error", error)
+                    break
+                await asyncio.sleep(2 ** (attempt - 1))
+        self.flush()
+        self.report_progress()
+
+    def report_progress(self) -> None:
+        elapsed = time.monotonic() - self.started
+        rate = self.done / elapsed if elapsed else 0.0
+        print(f"{self.done}/{self.total} items, {rate:.1f} images/s, {self.counts}", file=sys.stderr)
+
+def read_file(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+async def upload(args: argparse.Namespace) -> Dict:
+    source = args.manifest or args.dir.rstrip(os.sep)
+    resume_file = args.resume_file or f"{source}.progress.jsonl"
+    failures_file = args.failures_file or f"{source}.failures.jsonl"
+    defaults = json.loads(args.defaults)
+
+    items = list(read_manifest(args.manifest) if args.manifest else scan_directory(args.dir))
+    for item in items:
+        item["person"] = {field: item["person"].get(field) or defaults.get(field) for field in PERSON_FIELDS}
+    done = load_done(resume_file)
+    pending = [item for item in items if item_key(item) not in done]
+    print(f"{len(items)} items, {len(items) - len(pending)} already registered, {len(pending)} to send", file=sys.stderr)
+
+    uploader = BulkUploader(args, resume_file, failures_file, len(pending))
+    queue: asyncio.Queue = asyncio.Queue()
+    for chunk in chunked(pending, args.chunk_size):
+        queue.put_nowait(chunk)
+
+    async def worker(session: aiohttp.ClientSession) -> None:
+        while not queue.empty():
+            await uploader.send_chunk(session, queue.get_nowait())
+
+    # One session for all requests, so connections are kept alive and reused
+    connector = aiohttp.TCPConnector(limit=args.concurrency)
+    timeout = aiohttp.ClientTimeout(total=args.timeout)
+    try:
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+            await asyncio.gather(*[worker(session) for _ in range(args.concurrency)])
     finally:
-        # Tutup semua file yang dibuka
-        for _, (_, f, _) in files:
-            f.close()
+        uploader.close()
+
+    elapsed = time.monotonic() - uploader.started
+    registered = sum(uploader.counts.get(status, 0) for status in DONE_STATUSES)
+    return {
+        "sent": uploader.done,
+        "registered": registered,
+        "failed": uploader.done - registered,
+        "counts": uploader.counts,
+        "elapsed_seconds": round(elapsed, 1),
+        "images_per_second": round(uploader.done / elapsed, 2) if elapsed else None,
+        "failures_file": failures_file if uploader.done > registered else None
+    }
+
+def main(argv=None) -> None:
+    summary = asyncio.run(upload(parse_args(argv)))
+    print(json.dumps(summary, indent=2))
+    if summary["failed"]:
+        sys.exit(1)
 
-# Contoh penggunaan
 if __name__ == "__main__":
-    # URL API
-    BASE_URL = "http://172.15.3.237:8000"
-    
-    # Data person (sesuaikan dengan format yang dibutuhkan)
-    persons_data = [
-        {
-            "full_name": "abi",
-            "birth_place": "Bekasi",
-            "birth_date": "1990-01-01",
-            "address": "123 Main St",
-            "nationality": "Indonesia",
-            "passport_number": "INA123456",
-            "gender": "Male",
-            "national_id_number": "123-45-6789",
-            "marital_status": "Single"
-        },
-        {
-            "full_name": "adi",
-            "birth_place": "Bekasi",
-            "birth_date": "1992-05-15",
-            "address": "456 Oak Ave",
-            "nationality": "Indonesia",
-            "passport_number": "INA123456",
-            "gender": "Male",
-            "national_id_number": "987-65-4321",
-            "marital_status": "Married"
-        },
-        {
-            "full_name": "ali",
-            "birth_place": "Bekasi",
-            "birth_date": "1992-05-15",
-            "address": "456 Oak Ave",
-            "nationality": "Indonesia",
-            "passport_number": "INA123456",
-            "gender": "Male",
-            "national_id_number": "987-65-4321",
-            "marital_status": "Married"
-        },
-        {
-            "full_name": "arif munawar",
-            "birth_place": "Bekasi",
-            "birth_date": "1992-05-15",
-            "address": "456 Oak Ave",
-            "nationality": "Indonesia",
-            "passport_number": "INA123456",
-            "gender": "Male",
-            "national_id_number": "987-65-4321",
-            "marital_status": "Married"
-        },
-        {
-            "full_name": "arrizque",
-            "birth_place": "Bekasi",
-            "birth_date": "1992-05-15",
-            "address": "456 Oak Ave",
-            "nationality": "Indonesia",
-            "passport_number": "INA123456",
-            "gender": "Male",
-            "national_id_number": "987-65-4321",
-            "marital_status": "Married"
-        },
-        {
-            "full_name": "awan",
-            "birth_place": "Bekasi",
-            "birth_date": "1992-05-15",
-            "address": "456 Oak Ave",
-            "nationality": "Indonesia",
-            "passport_number": "INA123456",
-            "gender": "Male",
-            "national_id_number": "987-65-4321",
-            "marital_status": "Married"
-        },
-        {
-            "full_name": "azhar",
-            "birth_place": "Bekasi",
-            "birth_date": "1992-05-15",
-            "address": "456 Oak Ave",
-            "nationality": "Indonesia",
-            "passport_number": "INA123456",
-            "gender": "Male",
-            "national_id_number": "987-65-4321",
-            "marital_status": "Married"
-        },
-        {
-            "full_name": "chairul",
-            "birth_place": "Bekasi",
-            "birth_date": "1992-05-15",
-            "address": "456 Oak Ave",
-            "nationality": "Indonesia",
-            "passport_number": "INA123456",
-            "gender": "Male",
-            "national_id_number": "987-65-4321",
-            "marital_status": "Married"
-        },
-        {
-            "full_name": "chandra",
-            "birth_place": "Bekasi",
-            "birth_date": "1992-05-15",
-            "address": "456 Oak Ave",
-            "nationality": "Indonesia",
-            "passport_number": "INA123456",
-            "gender": "Male",
-            "national_id_number": "987-65-4321",
-            "marital_status": "Married"
-        },
-        {
-            "full_name": "cristoper",
-            "birth_place": "Bekasi",
-            "birth_date": "1992-05-15",
-            "address": "456 Oak Ave",
-            "nationality": "Indonesia",
-            "passport_number": "INA123456",
-            "gender": "Male",
-            "national_id_number": "987-65-4321",
-            "marital_status": "Married"
-        },
-        {
-            "full_name": "eko",
-            "birth_place": "Bekasi",
-            "birth_date": "1992-05-15",
-            "address": "456 Oak Ave",
-            "nationality": "Indonesia",
-            "passport_number": "INA123456",
-            "gender": "Male",
-            "national_id_number": "987-65-4321",
-            "marital_status": "Married"
-        },
-        {
-            "full_name": "fajri",
-            "birth_place": "Bekasi",
-            "birth_date": "1992-05-15",
-            "address": "456 Oak Ave",
-            "nationality": "Indonesia",
-            "passport_number": "INA123456",
-            "gender": "Male",
-            "national_id_number": "987-65-4321",
-            "marital_status": "Married"
-        },
-        {
-            "full_name": "fandi",
-            "birth_place": "Bekasi",
-            "birth_date": "1992-05-15",
-            "address": "456 Oak Ave",
-            "nationality": "Indonesia",
-            "passport_number": "INA123456",
-            "gender": "Male",
-            "national_id_number": "987-65-4321",
-            "marital_status": "Married"
-        },
-        {
-            "full_name": "ferdi",
-            "birth_place": "Bekasi",
-            "birth_date": "1992-05-15",
-            "address": "456 Oak Ave",
-            "nationality": "Indonesia",
-            "passport_number": "INA123456",
-            "gender": "Male",
-            "national_id_number": "987-65-4321",
-            "marital_status": "Married"
-        },
-        {
-            "full_name": "firman",
-            "birth_place": "Bekasi",
-            "birth_date": "1992-05-15",
-            "address": "456 Oak Ave",
-            "nationality": "Indonesia",
-            "passport_number": "INA123456",
-            "gender": "Male",
-            "national_id_number": "987-65-4321",
-            "marital_status": "Married"
-        },
-        {
-            "full_name": "gisna",
-            "birth_place": "Bekasi",
-            "birth_date": "1992-05-15",
-            "address": "456 Oak Ave",
-            "nationality": "Indonesia",
-            "passport_number": "INA123456",
-            "gender": "Male",
-            "national_id_number": "987-65-4321",
-            "marital_status": "Married"
-        },
-        {
-            "full_name": "hanif",
-            "birth_place": "Bekasi",
-            "birth_date": "1992-05-15",
-            "address": "456 Oak Ave",
-            "nationality": "Indonesia",
-            "passport_number": "INA123456",
-            "gender": "Male",
-            "national_id_number": "987-65-4321",
-            "marital_status": "Married"
-        },
-        {
-            "full_name": "imanuel zagoto",
-            "birth_place": "Bekasi",
-            "birth_date": "1992-05-15",
-            "address": "456 Oak Ave",
-            "nationality": "Indonesia",
-            "passport_number": "INA123456",
-            "gender": "Male",
-            "national_id_number": "987-65-4321",
-            "marital_status": "Married"
-        },
-        {
-            "full_name": "jaki",
-            "birth_place": "Bekasi",
-            "birth_date": "1992-05-15",
-            "address": "456 Oak Ave",
-            "nationality": "Indonesia",
-            "passport_number": "INA123456",
-            "gender": "Male",
-            "national_id_number": "987-65-4321",
-            "marital_status": "Married"
-        },
-        {
-            "full_name": "kharisma",
-            "birth_place": "Bekasi",
-            "birth_date": "1992-05-15",
-            "address": "456 Oak Ave",
-            "nationality": "Indonesia",
-            "passport_number": "INA123456",
-            "gender": "Male",
-            "national_id_number": "987-65-4321",
-            "marital_status": "Married"
-        },
-        {
-            "full_name": "kunto",
-            "birth_place": "Bekasi",
-            "birth_date": "1992-05-15",
-            "address": "456 Oak Ave",
-            "nationality": "Indonesia",
-            "passport_number": "INA123456",
-            "gender": "Male",
-            "national_id_number": "987-65-4321",
-            "marital_status": "Married"
-        },
-        {
-            "full_name": "leon",
-            "birth_place": "Bekasi",
-            "birth_date": "1992-05-15",
-            "address": "456 Oak Ave",
-            "nationality": "Indonesia",
-            "passport_number": "INA123456",
-            "gender": "Male",
-            "national_id_number": "987-65-4321",
-            "marital_status": "Married"
-        },
-        {
-            "full_name": "luthfi",
-            "birth_place": "Bekasi",
-            "birth_date": "1992-05-15",
-            "address": "456 Oak Ave",
-            "nationality": "Indonesia",
-            "passport_number": "INA123456",
-            "gender": "Male",
-            "national_id_number": "987-65-4321",
-            "marital_status": "Married"
-        },
-        {
-            "full_name": "moel",
-            "birth_place": "Bekasi",
-            "birth_date": "1992-05-15",
-            "address": "456 Oak Ave",
-            "nationality": "Indonesia",
-            "passport_number": "INA123456",
-            "gender": "Male",
-            "national_id_number": "987-65-4321",
-            "marital_status": "Married"
-        },
-        {
-            "full_name": "perlindungan duha",
-            "birth_place": "Bekasi",
-            "birth_date": "1992-05-15",
-            "address": "456 Oak Ave",
-            "nationality": "Indonesia",
-            "passport_number": "INA123456",
-            "gender": "Male",
-            "national_id_number": "987-65-4321",
-            "marital_status": "Married"
-        },
-        {
-            "full_name": "purwowidodo",
-            "birth_place": "Bekasi",
-            "birth_date": "1992-05-15",
-            "address": "456 Oak Ave",
-            "nationality": "Indonesia",
-            "passport_number": "INA123456",
-            "gender": "Male",
-            "national_id_number": "987-65-4321",
-            "marital_status": "Married"
-        },
-        {
-            "full_name": "radit",
-            "birth_place": "Bekasi",
-            "birth_date": "1992-05-15",
-            "address": "456 Oak Ave",
-            "nationality": "Indonesia",
-            "passport_number": "INA123456",
-            "gender": "Male",
-            "national_id_number": "987-65-4321",
-            "marital_status": "Married"
-        },
-        {
-            "full_name": "rajadi",
-            "birth_place": "Bekasi",
-            "birth_date": "1992-05-15",
-            "address": "456 Oak Ave",
-            "nationality": "Indonesia",
-            "passport_number": "INA123456",
-            "gender": "Male",
-            "national_id_number": "987-65-4321",
-            "marital_status": "Married"
-        },
-        {
-            "full_name": "reizky lesmana",
-            "birth_place": "Bekasi",
-            "birth_date": "1992-05-15",
-            "address": "456 Oak Ave",
-            "nationality": "Indonesia",
-            "passport_number": "INA123456",
-            "gender": "Male",
-            "national_id_number": "987-65-4321",
-            "marital_status": "Married"
-        },
-        {
-            "full_name": "reyhan",
-            "birth_place": "Bekasi",
-            "birth_date": "1992-05-15",
-            "address": "456 Oak Ave",
-            "nationality": "Indonesia",
-            "passport_number": "INA123456",
-            "gender": "Male",
-            "national_id_number": "987-65-4321",
-            "marital_status": "Married"
-        },
-        {
-            "full_name": "ridzki",
-            "birth_place": "Bekasi",
-            "birth_date": "1992-05-15",
-            "address": "456 Oak Ave",
-            "nationality": "Indonesia",
-            "passport_number": "INA123456",
-            "gender": "Male",
-            "national_id_number": "987-65-4321",
-            "marital_status": "Married"
-        },
-        {
-            "full_name": "rizky",
-            "birth_place": "Bekasi",
-            "birth_date": "1992-05-15",
-            "address": "456 Oak Ave",
-            "nationality": "Indonesia",
-            "passport_number": "INA123456",
-            "gender": "Male",
-            "national_id_number": "987-65-4321",
-            "marital_status": "Married"
-        },
-        {
-            "full_name": "rui costa hidayat",
-            "birth_place": "Bekasi",
-            "birth_date": "1992-05-15",
-            "address": "456 Oak Ave",
-            "nationality": "Indonesia",
-            "passport_number": "INA123456",
-            "gender": "Male",
-            "national_id_number": "987-65-4321",
-            "marital_status": "Married"
-        },
-        {
-            "full_name": "somad",
-            "birth_place": "Bekasi",
-            "birth_date": "1992-05-15",
-            "address": "456 Oak Ave",
-            "nationality": "Indonesia",
-            "passport_number": "INA123456",
-            "gender": "Male",
-            "national_id_number": "987-65-4321",
-            "marital_status": "Married"
-        },
-        {
-            "full_name": "tora",
-            "birth_place": "Bekasi",
-            "birth_date": "1992-05-15",
-            "address": "456 Oak Ave",
-            "nationality": "Indonesia",
-            "passport_number": "INA123456",
-            "gender": "Male",
-            "national_id_number": "987-65-4321",
-            "marital_status": "Married"
-        },
-        {
-            "full_name": "wahyu sanjaya",
-            "birth_place": "Bekasi",
-            "birth_date": "1992-05-15",
-            "address": "456 Oak Ave",
-            "nationality": "Indonesia",
-            "passport_number": "INA123456",
-            "gender": "Male",
-            "national_id_number": "987-65-4321",
-            "marital_status": "Married"
-        },
-        {
-            "full_name": "wildan",
-            "birth_place": "Bekasi",
-            "birth_date": "1992-05-15",
-            "address": "456 Oak Ave",
-            "nationality": "Indonesia",
-            "passport_number": "INA123456",
-            "gender": "Male",
-            "national_id_number": "987-65-4321",
-            "marital_status": "Married"
-        },
-        {
-            "full_name": "yasser arafat",
-            "birth_place": "Bekasi",
-            "birth_date": "1992-05-15",
-            "address": "456 Oak Ave",
-            "nationality": "Indonesia",
-            "passport_number": "INA123456",
-            "gender": "Male",
-            "national_id_number": "987-65-4321",
-            "marital_status": "Married"
-        },
-        {
-            "full_name": "yusuf",
-            "birth_place": "Bekasi",
-            "birth_date": "1992-05-15",
-            "address": "456 Oak Ave",
-            "nationality": "Indonesia",
-            "passport_number": "INA123456",
-            "gender": "Male",
-            "national_id_number": "987-65-4321",
-            "marital_status": "Married"
-        }
-    ]
-    
-    # Path ke file gambar (sesuaikan dengan lokasi file Anda)
-    image_paths = [
-        "/home/me/app/image_search/image-search-people-deepface-facenet/dataset/register/abi.png",
-        "/home/me/app/image_search/image-search-people-deepface-facenet/dataset/register/adi.png",
-        "/home/me/app/image_search/image-search-people-deepface-facenet/dataset/register/ali.png",
-        "/home/me/app/image_search/image-search-people-deepface-facenet/dataset/register/arif_munawar.jpeg",
-        "/home/me/app/image_search/image-search-people-deepface-facenet/dataset/register/arrizque.jpg",
-        "/home/me/app/image_search/image-search-people-deepface-facenet/dataset/register/awan.png",
-        "/home/me/app/image_search/image-search-people-deepface-facenet/dataset/register/azhar.jpg",
-        "/home/me/app/image_search/image-search-people-deepface-facenet/dataset/register/chairul.jpg",
-        "/home/me/app/image_search/image-search-people-deepface-facenet/dataset/register/chandra.jpg",
-        "/home/me/app/image_search/image-search-people-deepface-facenet/dataset/register/cristoper.jpeg",
-        "/home/me/app/image_search/image-search-people-deepface-facenet/dataset/register/eko.jpg",
-        "/home/me/app/image_search/image-search-people-deepface-facenet/dataset/register/fajri.jpg",
-        "/home/me/app/image_search/image-search-people-deepface-facenet/dataset/register/fandi.jpg",
-        "/home/me/app/image_search/image-search-people-deepface-facenet/dataset/register/ferdi.jpg",
-        "/home/me/app/image_search/image-search-people-deepface-facenet/dataset/register/firman.png",
-        "/home/me/app/image_search/image-search-people-deepface-facenet/dataset/register/gisna.jpeg",
-        "/home/me/app/image_search/image-search-people-deepface-facenet/dataset/register/hanif.jpg",
-        "/home/me/app/image_search/image-search-people-deepface-facenet/dataset/register/imanuel_zagoto.jpeg",
-        "/home/me/app/image_search/image-search-people-deepface-facenet/dataset/register/jaki.jpg",
-        "/home/me/app/image_search/image-search-people-deepface-facenet/dataset/register/kharisma.jpg",
-        "/home/me/app/image_search/image-search-people-deepface-facenet/dataset/register/kunto.png",
-        "/home/me/app/image_search/image-search-people-deepface-facenet/dataset/register/leon.png",
-        "/home/me/app/image_search/image-search-people-deepface-facenet/dataset/register/luthfi.jpeg",
-        "/home/me/app/image_search/image-search-people-deepface-facenet/dataset/register/moel.png",
-        "/home/me/app/image_search/image-search-people-deepface-facenet/dataset/register/perlindungan_duha.jpeg",
-        "/home/me/app/image_search/image-search-people-deepface-facenet/dataset/register/purwowidodo.jpeg",
-        "/home/me/app/image_search/image-search-people-deepface-facenet/dataset/register/radit.jpg",
-        "/home/me/app/image_search/image-search-people-deepface-facenet/dataset/register/rajadi.jpg",
-        "/home/me/app/image_search/image-search-people-deepface-facenet/dataset/register/reizky_lesmana.jpeg",
-        "/home/me/app/image_search/image-search-people-deepface-facenet/dataset/register/reyhan.jpg",
-        "/home/me/app/image_search/image-search-people-deepface-facenet/dataset/register/ridzki.jpg",
-        "/home/me/app/image_search/image-search-people-deepface-facenet/dataset/register/rizky.jpg",
-        "/home/me/app/image_search/image-search-people-deepface-facenet/dataset/register/rui_costa_hidayat.jpeg",
-        "/home/me/app/image_search/image-search-people-deepface-facenet/dataset/register/somad.jpg",
-        "/home/me/app/image_search/image-search-people-deepface-facenet/dataset/register/tora.jpg",
-        "/home/me/app/image_search/image-search-people-deepface-facenet/dataset/register/wahyu_sanjaya.jpeg",
-        "/home/me/app/image_search/image-search-people-deepface-facenet/dataset/register/wildan.jpg",
-        "/home/me/app/image_search/image-search-people-deepface-facenet/dataset/register/yasser_arafat.jpeg",
-        "/home/me/app/image_search/image-search-people-deepface-facenet/dataset/register/yusuf.jpg",
-    ]
-    
-    # Buat folder images jika belum ada
-    # Path("images").mkdir(exist_ok=True)
-    
-    # Jalankan bulk registration
-    bulk_register_persons(BASE_URL, persons_data, image_paths)
+    main()